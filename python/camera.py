@@ -16,9 +16,11 @@ from contextlib	import asynccontextmanager
 from fastapi.middleware.cors import	CORSMiddleware
 from space import Euler, Vector3, Quaternion, Matrix4, Pose, PoseCartesian, Vector2, deg2rad, scale_values
 from lara import Lara
+from config_store import ConfigStore
 from webrtc_streamer import WebRTCStreamer
 
 # -------------------- GLOBAL FLAGS	--------------------
+startup_start = time.perf_counter()
 lara = Lara()
 states = ["normal",	"square_detector", "tag_detector"]
 state =	states[2]
@@ -37,20 +39,14 @@ dist = None
 _offset_pos = Vector3(0, 0, 0)
 _offset_quat = Quaternion(0, 0, 0, 1)
 offset_tag = Pose(_offset_pos, _offset_quat)
-try:
-	with open('offset_tag.json', 'r') as f:
-		offset_tag_json = f.read()
-		offset_tag = Pose.from_json(offset_tag_json)
-
-except FileNotFoundError:
-	print("No offset tag file found")
-except json.JSONDecodeError:
-	print("Error reading offset tag file")
+# offset_tag.json kept in memory, saved in the background with versions for rollback
+offset_store = ConfigStore('offset_tag.json', default=offset_tag.to_dict())
+offset_tag = Pose.from_json(offset_store.get())
 
 # ---------------------	API	---------------------
 @asynccontextmanager
 async def lifespan(app:	FastAPI):	
-	global camera_thread, stop_camera_thread
+	global camera_thread, stop_camera_thread, lara
 	stop_camera_thread = False
 
 	# Detector Thread 
@@ -60,16 +56,19 @@ async def lifespan(app:	FastAPI):
 	camera_thread =	threading.Thread(target=camera_loop, daemon=True)
 	camera_thread.start()
 
-	#connect to the	robot
-	lara = Lara()
-	lara.robot.stop()
-	await lara.connect_socket()
-	print("Connected to the	robot")
-	lara.robot.turn_off_jog()
+	#connect the robot created at import without holding up startup
+	robot_connection = asyncio.create_task(lara.connect(stop=True))
+	lara.loop_lag.start()
+	# open the jog websocket now, AlingMove streams jog commands through it
+	lara.jog.start()
+	print(f"Camera API started in {time.perf_counter() - startup_start:.2f} s, connecting to the robot in the background")
 
 	try:
 		yield
 	finally:
+		robot_connection.cancel()
+		await lara.close()
+		await asyncio.to_thread(offset_store.save)
 		# Stop the reader thread and clean up
 		print("Stopping the camera thread")
 		stop_camera_thread = True
@@ -104,13 +103,13 @@ async def test_area(x: float, y: float, z: float):
 	x = x / 1000
 	y = y / 1000
 	z = z / 1000
-	err = move_relative(x, y, z, 0, 0, 0)
+	err = await move_relative(x, y, z, 0, 0, 0)
 	if not err:
 		return {"error": "No movement detected"}
 	else:
 		return {"status": "ok"}
 
-def move_relative(x, y, z, rx, ry, rz):
+async def move_relative(x, y, z, rx, ry, rz):
 	'''
 	Move robot relative to current position
 	
@@ -123,8 +122,11 @@ def move_relative(x, y, z, rx, ry, rz):
 	'''
 	global lara
 	
-	# Get current TCP pose
-	current_tcp_pose = lara.robot.get_tcp_pose()
+	# Get current TCP pose and joint angles in one round trip
+	async with lara.async_robot.batch() as batch:
+		tcp_pose = batch.get_tcp_pose()
+		joint_angles = batch.robot_status("jointAngles")
+	current_tcp_pose = tcp_pose.result()
 	
 	# Calculate target pose
 	target_pose = [
@@ -146,7 +148,7 @@ def move_relative(x, y, z, rx, ry, rz):
 			current_tcp_pose,
 			target_pose
 		],
-		"current_joint_angles": lara.robot.robot_status("jointAngles"),
+		"current_joint_angles": joint_angles.result(),
 		"dwell_time_left": 0.0,
 		"dwell_time_right": 0.0,
 		"elevation": 0.0,
@@ -154,12 +156,13 @@ def move_relative(x, y, z, rx, ry, rz):
 	}
 	
 	# Execute movement
-	lara.robot.set_mode("Automatic")
-	err = lara.robot.move_linear(**linear_property)
-	time.sleep(0.5)
+	await lara.async_robot.set_mode("Automatic")
+	err = await lara.async_robot.move_linear(**linear_property)
+	# settle, resuming as soon as the streamed pose holds still
+	await lara.wait_until_still(dwell=0.1, timeout=0.5)
 	
 	# Get new pose after movement
-	new_pose = lara.robot.get_tcp_pose()
+	new_pose = await lara.async_robot.get_tcp_pose()
 	
 	# Define thresholds for determining if movement occurred
 	position_threshold_mm = 0.1  # 0.1mm
@@ -199,10 +202,8 @@ async def setOffset():
 		if current_data:
 			try:
 				offset_tag = current_data[0]
-				offset_tag_json = offset_tag.to_json()
-				with open('offset_tag.json', 'w') as f:
-					f.write(offset_tag_json)
-				return {"status": "ok"}
+				offset_store.replace(offset_tag.to_dict(), note="SetOffSet")
+				return {"status": "ok", "version": offset_store.version}
 			except KeyError:
 				continue
 		await asyncio.sleep(0.5)
@@ -211,13 +212,28 @@ async def setOffset():
 
 
 
+@app.get("/offset/versions")
+def	get_offset_versions():
+	return {"current": offset_store.version, "versions": offset_store.versions()}
+
+@app.post("/offset/rollback")
+def	rollback_offset(version: int):
+	global offset_tag
+	try:
+		new_version = offset_store.rollback(version)
+	except KeyError as e:
+		return {"error": str(e)}
+	offset_tag = Pose.from_json(offset_store.get())
+	return {"version": new_version}
+
 @app.post("/AlingMove")
 async def AlingMove():
 	global lara, current_data
 	counter = 0
 	flag_buffered_movement = False
 	current_translation_speed = 4
-	await lara.set_translation_speed_mms(current_translation_speed)
+	# always sent, the main service and the pendant change the speed too
+	await lara.set_translation_speed_mms(current_translation_speed, force=True)
 	detection_timeout_break = 5 # 5 seconds
 	detection_timeout = 0.5 # 250ms
 	last_detection_time = time.time()
@@ -231,7 +247,10 @@ async def AlingMove():
 			quaternion = tag0.orientation
 			print(f"Position: {position.x * 1000:.2f} mm, {position.y * 1000:.2f} mm, {position.z * 1000:.2f} mm")
 			last_detection_time = time.time()
-			current_arm_pose = lara.current_pose_raw()
+			async with lara.async_robot.batch() as batch:
+				quaternion_pose = batch.get_tcp_pose_quaternion()
+				euler_pose = batch.get_tcp_pose()
+			current_arm_pose = lara.raw_pose(quaternion_pose.result())
 			current_arm_orientation = current_arm_pose.orientation
 			current_arm_orientation_euler = current_arm_orientation.to_euler()
 			current_tag_orientation = quaternion.to_euler()
@@ -239,7 +258,7 @@ async def AlingMove():
 			angle_arm_z = current_arm_orientation_euler.z
 			V2 = Vector2(position.x, position.y)
 			V2 = V2.rotate(angle_arm_z)
-			tcp_pose = lara.robot.get_tcp_pose()
+			tcp_pose = euler_pose.result()
 			#add to the final tcp pose the z angle of the tag
 			final_z_angle = tcp_pose[5] - angle_tag_z
 			#normalize the angle between -pi and pi
@@ -255,36 +274,36 @@ async def AlingMove():
 			if success:
 				flag_buffered_movement = True
 				lara.stopMoving()
-				success = await asyncio.to_thread(move_relative, -V2.x, -V2.y, 0, 0, 0, final_z_angle)
+				success = await move_relative(-V2.x, -V2.y, 0, 0, 0, final_z_angle)
 			else:
 				if flag_buffered_movement:
-					lara.robot.stop()
-					lara.robot.set_mode("Teach")
-					lara.robot.unpause()
+					await lara.async_robot.stop()
+					await lara.async_robot.set_mode("Teach")
+					await lara.async_robot.unpause()
 					flag_buffered_movement = False
-					await asyncio.sleep(0.3)
-				if not(abs(angle_tag_z) < rotation_tolerance):
-					lara.start_moving(0, 0, 0, 0, 0, final_z_angle)
+					await lara.wait_until_still(dwell=0.1, timeout=0.3)
+				# rotation and translation go in one jog command, a second one would replace the first before it is sent
+				rotation = final_z_angle if not(abs(angle_tag_z) < rotation_tolerance) else 0
 				if not (abs(V2.x) < tolerance and abs(V2.y) < tolerance):
-					lara.start_moving(-V2.x, -V2.y, 0, 0, 0, 0)
+					lara.start_moving(-V2.x, -V2.y, 0, 0, 0, rotation)
 				else:
-					lara.start_moving(0, 0, -1, 0, 0, 0)
+					lara.start_moving(0, 0, -1, 0, 0, rotation)
 		else:
 			if time.time() - last_detection_time > detection_timeout_break:
 				lara.stopMoving()
-				await asyncio.sleep(0.5)
-				lara.robot.stop()
-				lara.robot.set_mode("Teach")
+				await lara.wait_until_still(dwell=0.1, timeout=0.5)
+				await lara.async_robot.stop()
+				await lara.async_robot.set_mode("Teach")
 				return {"error": "No data received from the camera"}
 			elif time.time() - last_detection_time > detection_timeout:
 				lara.stopMoving()
 		await asyncio.sleep(0.01)
-	lara.robot.stop()
-	lara.robot.set_mode("Teach")
-	lara.robot.unpause()
-	lara.robot.stop()
+	await lara.async_robot.stop()
+	await lara.async_robot.set_mode("Teach")
+	await lara.async_robot.unpause()
+	await lara.async_robot.stop()
 	#fine alligment phase
-	await lara.set_translation_speed_mms(1)#
+	await lara.set_translation_speed_mms(1, force=True)
 	last_detection_time = time.time()
 	while True:
 		if current_data:
@@ -300,25 +319,25 @@ async def AlingMove():
 			#0.1 mm precision
 			if abs(V2.x) < 0.0001 and abs(V2.y) < 0.0001:
 				# await start_movement_slider(0, 0, -1, 0, 0, 0)
-				lara.robot.turn_on_jog(jog_velocity=[0, 0, -1, 0, 0, 0], jog_type='Cartesian')
-				lara.robot.jog(set_jogging_external_flag=1)
+				await lara.async_robot.turn_on_jog(jog_velocity=[0, 0, -1, 0, 0, 0], jog_type='Cartesian')
+				await lara.async_robot.jog(set_jogging_external_flag=1)
 			else:
 				# await start_movement_slider(-V2.x, -V2.y, 0, 0, 0, 0)
-				lara.robot.turn_on_jog(jog_velocity=[-V2.x, -V2.y, 0, 0, 0, 0], jog_type='Cartesian')
-				lara.robot.jog(set_jogging_external_flag=1)
+				await lara.async_robot.turn_on_jog(jog_velocity=[-V2.x, -V2.y, 0, 0, 0, 0], jog_type='Cartesian')
+				await lara.async_robot.jog(set_jogging_external_flag=1)
 			await asyncio.sleep(0.05)
 		else:
 			if time.time() - last_detection_time > detection_timeout_break:
-				lara.robot.turn_off_jog()
+				await lara.async_robot.turn_off_jog()
 				await asyncio.sleep(0.5)
-				lara.robot.stop()
+				await lara.async_robot.stop()
 				return {"error": "No data received from the camera"}
 			elif time.time() - last_detection_time > detection_timeout:
-				lara.robot.turn_off_jog()
+				await lara.async_robot.turn_off_jog()
 			await asyncio.sleep(0.05)
-	lara.robot.turn_off_jog()
-	lara.robot.stop()
-	await asyncio.sleep(0.5)
+	await lara.async_robot.turn_off_jog()
+	await lara.async_robot.stop()
+	await lara.wait_until_still(dwell=0.1, timeout=0.5)
 	return {"status": "ok"}
 
 @app.post("/Retract")
@@ -349,13 +368,24 @@ def	set_camera(index: int):
 @app.post("/set_rotation_speed/{speed}")
 async def set_rotation_speed(speed: int):
 	global lara
-	await lara.set_rotation_speed_degs(speed)
+	await lara.set_rotation_speed_degs(speed, force=True)
 	return {"status": "ok"}
 
 @app.get("/get_state")
 def	get_state():
 	return {"state": state,	"camera": current_camera_index}
 
+@app.get("/metrics")
+def	get_metrics():
+	global lara
+	return lara.metrics()
+
+@app.post("/metrics/reset")
+def	reset_metrics():
+	global lara
+	lara.reset_metrics()
+	return {"status": "ok"}
+
 def	sharpned_image(image, alpha=1.5, beta=-0.5):
 	# Applying the sharpening filter
 	sharpened =	cv2.convertScaleAbs(image, alpha=alpha,	beta=beta)
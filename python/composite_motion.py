@@ -0,0 +1,132 @@
+import numpy as np
+from scipy.spatial.transform import Rotation as R, Slerp
+from space import Pose, Vector3, Quaternion
+
+# Same speed and acceleration as the move_linear calls the composite moves replace
+COMPOSITE_SPEED = 0.2
+COMPOSITE_ACCELERATION = 0.001
+BLEND_RADIUS = 0.005
+# Base rotations smaller than this (rad) are done as straight lines, a circle through nearly collinear points is ill-defined
+MIN_ARC_ANGLE = 0.1
+
+
+class UnreachablePath(ValueError):
+	"""A planned composite motion passes a point the controller cannot reach or that is too low."""
+
+
+def cartesian_target(pose: Pose):
+	"""[x, y, z, rx, ry, rz] as used in move_linear/move_composite targets."""
+	euler = pose.orientation.to_euler(order="xyz")
+	return [pose.position.x, pose.position.y, pose.position.z, euler.x, euler.y, euler.z]
+
+
+def offset_along_normal(pose: Pose, distance) -> Pose:
+	"""pose moved by distance along its own Z axis (negative is away from the surface), orientation kept."""
+	rotation_matrix = R.from_quat([pose.orientation.x, pose.orientation.y, pose.orientation.z, pose.orientation.w]).as_matrix()
+	offset_global = rotation_matrix @ np.array([0, 0, distance])
+	return Pose(
+		Vector3(pose.position.x + offset_global[0], pose.position.y + offset_global[1], pose.position.z + offset_global[2]),
+		pose.orientation
+	)
+
+
+def base_arc_via(start: Pose, end: Pose):
+	"""
+	Middle point of an arc around the robot base from start to end: halfway in base angle, radius
+	and height, orientation slerped halfway. None when the base turns less than MIN_ARC_ANGLE.
+	"""
+	angle0 = np.arctan2(start.position.y, start.position.x)
+	angle1 = np.arctan2(end.position.y, end.position.x)
+	turn = (angle1 - angle0 + np.pi) % (2 * np.pi) - np.pi
+	if abs(turn) < MIN_ARC_ANGLE:
+		return None
+	angle = angle0 + turn / 2
+	radius = (np.hypot(start.position.x, start.position.y) + np.hypot(end.position.x, end.position.y)) / 2
+	rotations = R.from_quat([
+		[start.orientation.x, start.orientation.y, start.orientation.z, start.orientation.w],
+		[end.orientation.x, end.orientation.y, end.orientation.z, end.orientation.w],
+	])
+	x, y, z, w = Slerp([0, 1], rotations)(0.5).as_quat()
+	return Pose(
+		Vector3(float(radius * np.cos(angle)), float(radius * np.sin(angle)), (start.position.z + end.position.z) / 2),
+		Quaternion(x=float(x), y=float(y), z=float(z), w=float(w))
+	)
+
+
+class CompositeMotion:
+	"""
+	Builds the property dict of one move_composite command from Pose waypoints. Every segment
+	starts at the end of the previous one and consecutive linear waypoints share a segment,
+	so the controller blends through them instead of stopping between moves.
+	The controller only takes linear and circular segments; joint moves stay separate commands.
+	validate() checks the waypoints with the controller's inverse kinematics before sending.
+	"""
+	def __init__(self, start: Pose, speed=COMPOSITE_SPEED, acceleration=COMPOSITE_ACCELERATION, blend_radius=BLEND_RADIUS):
+		self.speed = speed
+		self.acceleration = acceleration
+		self.blend_radius = blend_radius
+		self.commands = []
+		self.end = start
+		# (kind, Pose) of every point the motion passes: "linear", "via" and "circular" targets
+		self.waypoints = []
+		# arc via points lower than this (m) are refused by validate(), None skips the check
+		self.min_via_z = None
+
+	def __len__(self):
+		return len(self.commands)
+
+	def linear(self, *poses: Pose, blend_radius=None):
+		blend_radius = self.blend_radius if blend_radius is None else blend_radius
+		last = self.commands[-1] if self.commands else None
+		if last is not None and "linear" in last and last["linear"]["blend_radius"] == blend_radius:
+			targets = last["linear"]["targets"]
+		else:
+			targets = [cartesian_target(self.end)]
+			self.commands.append({"linear": {"blend_radius": blend_radius, "targets": targets}})
+		for pose in poses:
+			targets.append(cartesian_target(pose))
+			self.waypoints.append(("linear", pose))
+			self.end = pose
+		return self
+
+	def circular(self, via: Pose, pose: Pose):
+		self.commands.append({"circular": {"targets": [cartesian_target(self.end), cartesian_target(via), cartesian_target(pose)]}})
+		self.waypoints.append(("via", via))
+		self.waypoints.append(("circular", pose))
+		self.end = pose
+		return self
+
+	def arc_around_base(self, pose: Pose):
+		"""Circular segment around the base to pose, like a base joint rotation; a straight line for small turns."""
+		via = base_arc_via(self.end, pose)
+		if via is None:
+			return self.linear(pose)
+		return self.circular(via, pose)
+
+	def validate(self, robot, current_joint_angles):
+		"""
+		Raises UnreachablePath if an arc via point is below min_via_z or robot.ik_fk("ik") finds
+		no finite joint solution for a waypoint. The IK calls go in one batch, seeded with
+		current_joint_angles.
+		"""
+		for kind, pose in self.waypoints:
+			if kind == "via" and self.min_via_z is not None and pose.position.z < self.min_via_z:
+				raise UnreachablePath(f"The arc passes {pose.position.z:.3f} m high, below the {self.min_via_z:.3f} m clearance")
+		current = [float(angle) for angle in current_joint_angles]
+		with robot.batch() as batch:
+			solutions = [batch.ik_fk("ik", target_pose=cartesian_target(pose), current_joint=current) for _, pose in self.waypoints]
+		for (kind, pose), solution in zip(self.waypoints, solutions):
+			try:
+				joints = np.ravel(solution.result()).astype(float)
+			except Exception as e:
+				raise UnreachablePath(f"No IK solution for the {kind} point {cartesian_target(pose)}: {e}") from e
+			if len(joints) < 6 or not np.all(np.isfinite(joints)):
+				raise UnreachablePath(f"No IK solution for the {kind} point {cartesian_target(pose)}: {joints.tolist()}")
+
+	def property(self, current_joint_angles):
+		return {
+			"speed": self.speed,
+			"acceleration": self.acceleration,
+			"current_joint_angles": current_joint_angles,
+			"commands": self.commands,
+		}
@@ -0,0 +1,148 @@
+import copy
+import json
+import os
+import tempfile
+import threading
+import time
+from collections import deque
+
+# Changes within this many seconds of each other are written to disk together
+SAVE_DELAY = 0.5
+# Versions kept for rollback, in memory and in the <file>.history.json next to the config
+HISTORY = 20
+
+
+def _default(obj):
+	"""Saves NumPy arrays and scalars (poses computed with NumPy) as plain JSON."""
+	if hasattr(obj, "tolist"):
+		return obj.tolist()
+	raise TypeError(f"Object of type {type(obj).__name__} is not JSON serializable")
+
+
+class ConfigStore:
+	"""
+	The parsed contents of one JSON file, kept in memory.
+
+	Reads never touch the disk. Every change becomes a new numbered version; the file is
+	rewritten SAVE_DELAY seconds after the last change, from a timer thread, by writing a
+	temporary file next to it and renaming it over the original, so readers and crashes never
+	see a half-written file. The last HISTORY saved versions are kept (and saved to
+	<file>.history.json) so a bad calibration can be rolled back to an earlier version;
+	changes saved together count as one version in the history.
+	"""
+	def __init__(self, path, default=None, save_delay=SAVE_DELAY, history=HISTORY):
+		self.path = path
+		self.history_path = path + ".history.json"
+		self.save_delay = save_delay
+		self._lock = threading.RLock()
+		self._write_lock = threading.Lock()
+		self._timer = None
+		self._notes = []
+		self.data = self._load(path, {} if default is None else default)
+		self.history = deque(self._load(self.history_path, []), maxlen=history)
+		if self.history and self.history[-1]["data"] == self.data:
+			self.version = self.history[-1]["version"]
+		else:
+			self.version = self.history[-1]["version"] + 1 if self.history else 1
+			self.history.append(self._entry("loaded"))
+		self.saved_version = self.version
+		self.saves = 0
+
+	@staticmethod
+	def _load(path, default):
+		try:
+			with open(path, "r") as f:
+				return json.load(f)
+		except FileNotFoundError:
+			return copy.deepcopy(default)
+		except json.JSONDecodeError:
+			print(f"Invalid JSON in {path}, starting from the defaults")
+			return copy.deepcopy(default)
+
+	def _entry(self, note):
+		return {"version": self.version, "time": time.time(), "note": note, "data": copy.deepcopy(self.data)}
+
+	def get(self, key=None, default=None):
+		"""A copy of one top-level value, or of the whole document if key is None."""
+		with self._lock:
+			if key is None:
+				return copy.deepcopy(self.data)
+			return copy.deepcopy(self.data.get(key, default))
+
+	def __contains__(self, key):
+		with self._lock:
+			return key in self.data
+
+	def update(self, note=None, **values):
+		"""Sets top-level values; returns the new version."""
+		with self._lock:
+			for key, value in values.items():
+				self.data[key] = copy.deepcopy(value)
+			return self._commit(note or ", ".join(values))
+
+	def replace(self, document, note=None):
+		"""Replaces the whole document; returns the new version."""
+		with self._lock:
+			self.data = copy.deepcopy(document)
+			return self._commit(note or "replaced")
+
+	def rollback(self, version):
+		"""Makes an earlier version current again (as a new version); returns the new version."""
+		with self._lock:
+			for entry in self.history:
+				if entry["version"] == version:
+					self.data = copy.deepcopy(entry["data"])
+					return self._commit(f"rollback to {version}")
+		raise KeyError(f"Version {version} is not in the history")
+
+	def versions(self):
+		with self._lock:
+			return [{"version": e["version"], "time": e["time"], "note": e["note"]} for e in self.history]
+
+	def _commit(self, note):
+		# caller holds the lock
+		self.version += 1
+		self._notes.append(note)
+		if self._timer is not None:
+			self._timer.cancel()
+		self._timer = threading.Timer(self.save_delay, self.save)
+		self._timer.daemon = True
+		self._timer.start()
+		return self.version
+
+	def save(self):
+		"""Writes the current version now if it is not on disk yet. Called by the timer and on shutdown."""
+		with self._write_lock:
+			with self._lock:
+				if self._timer is not None:
+					self._timer.cancel()
+					self._timer = None
+				if self.saved_version == self.version:
+					return
+				version = self.version
+				self.history.append(self._entry("; ".join(dict.fromkeys(self._notes))))
+				self._notes = []
+				document = json.dumps(self.data, indent=4, default=_default)
+				history = json.dumps(list(self.history), default=_default)
+			self._write_atomic(self.path, document)
+			self._write_atomic(self.history_path, history)
+			self.saved_version = version
+			self.saves += 1
+
+	@staticmethod
+	def _write_atomic(path, text):
+		directory = os.path.dirname(os.path.abspath(path))
+		fd, temporary = tempfile.mkstemp(dir=directory, prefix=os.path.basename(path), suffix=".tmp")
+		try:
+			with os.fdopen(fd, "w") as f:
+				f.write(text)
+				f.flush()
+				os.fsync(f.fileno())
+			os.replace(temporary, path)
+		except BaseException:
+			if os.path.exists(temporary):
+				os.remove(temporary)
+			raise
+
+	def stats(self):
+		return {"path": self.path, "version": self.version, "saved_version": self.saved_version, "saves": self.saves}
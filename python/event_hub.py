@@ -0,0 +1,154 @@
+import asyncio
+import json
+import time
+from collections import deque
+
+# Messages waiting per subscriber before it counts as too slow
+SUBSCRIBER_BACKLOG = 100
+
+
+class Message:
+	__slots__ = ("topic", "data", "published_at", "coalesce")
+
+	def __init__(self, topic, data, coalesce):
+		self.topic = topic
+		self.data = data
+		self.published_at = time.monotonic()
+		self.coalesce = coalesce
+
+
+class Subscriber:
+	"""One consumer of the hub with its own bounded backlog and writer task."""
+	def __init__(self, hub, send, name, maxsize, on_drop):
+		self.hub = hub
+		self.send = send
+		self.name = name
+		self.maxsize = maxsize
+		self.on_drop = on_drop
+		self.backlog = deque()
+		self.ready = asyncio.Event()
+		self.sent = 0
+		self.coalesced = 0
+		self.latency_total = 0.0
+		self.latency_max = 0.0
+		self.task = None
+		self.dropped = False
+
+	def offer(self, message):
+		"""Queues message; returns False if the subscriber is too slow to keep."""
+		if message.coalesce:
+			for index, queued in enumerate(self.backlog):
+				if queued.topic == message.topic:
+					# a newer value of the same topic replaces the one still waiting
+					self.backlog[index] = message
+					self.coalesced += 1
+					return True
+		if len(self.backlog) >= self.maxsize:
+			return False
+		self.backlog.append(message)
+		self.ready.set()
+		return True
+
+	async def run(self):
+		try:
+			while True:
+				while not self.backlog:
+					self.ready.clear()
+					await self.ready.wait()
+				message = self.backlog.popleft()
+				await self.send(message.data)
+				latency = time.monotonic() - message.published_at
+				self.sent += 1
+				self.latency_total += latency
+				self.latency_max = max(self.latency_max, latency)
+		except asyncio.CancelledError:
+			raise
+		except Exception as e:
+			print(f"Event subscriber {self.name} failed ({e!r}), unsubscribing")
+			self.hub.unsubscribe(self)
+
+	def stats(self):
+		return {
+			"backlog": len(self.backlog),
+			"sent": self.sent,
+			"coalesced": self.coalesced,
+			"latency_mean": self.latency_total / self.sent if self.sent else None,
+			"latency_max": self.latency_max,
+		}
+
+
+class EventHub:
+	"""
+	Fans published messages out to subscribers without polling.
+
+	publish() encodes the message once and hands it to every subscriber's bounded backlog; each
+	subscriber has its own writer task, so one slow client never delays the others. Messages
+	published with coalesce=True replace an older message of the same topic still waiting.
+	A subscriber whose backlog is full is dropped and its on_drop coroutine is called (e.g. to
+	close its websocket). publish() may be called from any thread once start() ran.
+	"""
+	def __init__(self, maxsize=SUBSCRIBER_BACKLOG):
+		self.maxsize = maxsize
+		self.loop = None
+		self.subscribers = set()
+		self.published = 0
+		self.dropped_subscribers = 0
+
+	def start(self):
+		self.loop = asyncio.get_running_loop()
+
+	def publish(self, topic, payload, coalesce=False):
+		self.publish_encoded(topic, json.dumps({topic: payload}), coalesce)
+
+	def publish_encoded(self, topic, data, coalesce=False):
+		"""Publishes data (str or bytes) as is, for subscribers whose send takes that form."""
+		if self.loop is None or self.loop.is_closed():
+			return
+		message = Message(topic, data, coalesce)
+		try:
+			running = asyncio.get_running_loop()
+		except RuntimeError:
+			running = None
+		if running is self.loop:
+			self._fan_out(message)
+		else:
+			self.loop.call_soon_threadsafe(self._fan_out, message)
+
+	def _fan_out(self, message):
+		self.published += 1
+		for subscriber in list(self.subscribers):
+			if not subscriber.offer(message):
+				print(f"Event subscriber {subscriber.name} has {len(subscriber.backlog)} messages waiting, dropping it")
+				self.dropped_subscribers += 1
+				subscriber.dropped = True
+				self.unsubscribe(subscriber)
+				if subscriber.on_drop is not None:
+					self.loop.create_task(self._drop(subscriber))
+
+	@staticmethod
+	async def _drop(subscriber):
+		try:
+			await subscriber.on_drop()
+		except Exception as e:
+			print(f"Closing event subscriber {subscriber.name} failed: {e!r}")
+
+	def subscribe(self, send, name=None, maxsize=None, on_drop=None) -> Subscriber:
+		"""send is an async callable taking the encoded message (str, or what publish_encoded was given)."""
+		if self.loop is None:
+			self.start()
+		subscriber = Subscriber(self, send, name or f"subscriber-{len(self.subscribers) + 1}", maxsize or self.maxsize, on_drop)
+		subscriber.task = self.loop.create_task(subscriber.run())
+		self.subscribers.add(subscriber)
+		return subscriber
+
+	def unsubscribe(self, subscriber):
+		self.subscribers.discard(subscriber)
+		if subscriber.task is not None and subscriber.task is not asyncio.current_task():
+			subscriber.task.cancel()
+
+	def stats(self):
+		return {
+			"published": self.published,
+			"dropped_subscribers": self.dropped_subscribers,
+			"subscribers": {subscriber.name: subscriber.stats() for subscriber in self.subscribers},
+		}
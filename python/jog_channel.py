@@ -0,0 +1,162 @@
+import asyncio
+import json
+import time
+from collections import deque
+import websockets
+from websockets.sync.client import connect
+
+# Jog commands are sent at most this often (Hz), newer ones replace the one waiting
+MAX_RATE = 50
+RECONNECT_DELAY = 0.1
+MAX_RECONNECT_DELAY = 2.0
+ACK_TIMEOUT = 1.0
+
+
+class JogChannel:
+	"""
+	Long-lived websocket to the jog server, reconnecting with backoff when it drops.
+
+	send() is fire-and-forget and never blocks the caller: coalesced messages (the jog
+	commands) share one slot where a newer one replaces the older one still waiting,
+	other messages are queued in order. At most max_rate messages are sent per second.
+	The server answers every message in order; pass on_reply to get the answer, or
+	await request() for it. Without a running event loop send() falls back to one
+	short-lived connection per message.
+	"""
+	def __init__(self, url, max_rate=MAX_RATE):
+		self.url = url
+		self.min_interval = 1.0 / max_rate
+		self.loop = None
+		self.task = None
+		self.connected = False
+		self._latest = None
+		self._queue = deque()
+		# reply handler (None, callable or future) of every message sent on the current connection
+		self._pending = deque()
+		self._wakeup = None
+		self._last_send = 0.0
+		self.counts = {"sent": 0, "coalesced": 0, "replies": 0, "reconnects": 0, "send_errors": 0}
+
+	def start(self):
+		if self.task is None or self.task.done():
+			self.loop = asyncio.get_running_loop()
+			self._wakeup = asyncio.Event()
+			if self._latest is not None or self._queue:
+				self._wakeup.set()
+			self.task = self.loop.create_task(self.run())
+		return self.task
+
+	async def close(self):
+		if self.task is not None:
+			self.task.cancel()
+			try:
+				await self.task
+			except asyncio.CancelledError:
+				pass
+			self.task = None
+
+	def send(self, message, on_reply=None, coalesce=True):
+		try:
+			running = asyncio.get_running_loop()
+		except RuntimeError:
+			running = None
+		if self.loop is None or self.loop.is_closed() or not self.loop.is_running():
+			if running is None:
+				return self._send_once(message, on_reply)
+			self.start()
+		if running is self.loop:
+			self._post(message, on_reply, coalesce)
+		else:
+			self.loop.call_soon_threadsafe(self._post, message, on_reply, coalesce)
+
+	async def request(self, message, timeout=ACK_TIMEOUT):
+		"""Sends message (never coalesced) and returns the server's reply."""
+		self.start()
+		reply = self.loop.create_future()
+		self._post(message, reply, False)
+		return await asyncio.wait_for(reply, timeout)
+
+	def _post(self, message, on_reply, coalesce):
+		if coalesce:
+			if self._latest is not None:
+				self.counts["coalesced"] += 1
+			self._latest = (message, on_reply)
+		else:
+			self._queue.append((message, on_reply))
+		self._wakeup.set()
+
+	def _send_once(self, message, on_reply):
+		with connect(self.url) as websocket:
+			websocket.send(json.dumps(message))
+			reply = websocket.recv()
+		self.counts["sent"] += 1
+		if callable(on_reply):
+			on_reply(reply)
+
+	async def _next(self):
+		while self._latest is None and not self._queue:
+			self._wakeup.clear()
+			await self._wakeup.wait()
+		wait = self._last_send + self.min_interval - time.monotonic()
+		if wait > 0:
+			# newer jog commands arriving meanwhile replace the waiting one
+			await asyncio.sleep(wait)
+		if self._queue:
+			return self._queue.popleft(), False
+		item, self._latest = self._latest, None
+		return item, True
+
+	def _reply(self, reply):
+		self.counts["replies"] += 1
+		on_reply = self._pending.popleft() if self._pending else None
+		if isinstance(on_reply, asyncio.Future):
+			if not on_reply.done():
+				on_reply.set_result(reply)
+		elif on_reply is not None:
+			on_reply(reply)
+
+	async def _read(self, websocket):
+		async for reply in websocket:
+			self._reply(reply)
+
+	async def run(self):
+		delay = RECONNECT_DELAY
+		while True:
+			try:
+				async with websockets.connect(self.url) as websocket:
+					self.connected = True
+					delay = RECONNECT_DELAY
+					reader = asyncio.ensure_future(self._read(websocket))
+					try:
+						while not reader.done():
+							item, coalesced = await self._next()
+							try:
+								await websocket.send(json.dumps(item[0]))
+							except websockets.ConnectionClosed:
+								# keep it for the next connection unless a newer jog command replaced it
+								if not coalesced:
+									self._queue.appendleft(item)
+								elif self._latest is None:
+									self._latest = item
+								raise
+							self._last_send = time.monotonic()
+							self._pending.append(item[1])
+							self.counts["sent"] += 1
+					finally:
+						reader.cancel()
+			except asyncio.CancelledError:
+				raise
+			except (OSError, websockets.WebSocketException) as e:
+				self.counts["send_errors"] += 1
+				print(f"Jog channel to {self.url} lost ({e!r}), reconnecting in {delay:.1f} s")
+			self.connected = False
+			while self._pending:
+				on_reply = self._pending.popleft()
+				if isinstance(on_reply, asyncio.Future) and not on_reply.done():
+					on_reply.set_exception(ConnectionError("jog channel closed before the reply"))
+			self.counts["reconnects"] += 1
+			await asyncio.sleep(delay)
+			delay = min(delay * 2, MAX_RECONNECT_DELAY)
+
+	def stats(self):
+		return {"connected": self.connected, "waiting": len(self._queue) + (self._latest is not None), **self.counts}
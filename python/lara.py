@@ -3,36 +3,148 @@ import asyncio
 import socketio
 import logging
 import time
+import os
+import threading
+from contextlib import contextmanager, asynccontextmanager
 import numpy as np
 from scipy.spatial.transform import	Rotation as R
-from neura.neurapy.robot import	Robot
+from neura.neurapy.robot import	Robot, ReadCache, rpc_metrics, MOTION_FUNCTIONS
+from neura.neurapy.async_robot import AsyncRobot
+from neura.neurapy.codec import SocketioJson
+from robot_gateway import resolve_robot_address
 from space import Pose,	Vector3, Quaternion, Euler,	PoseCartesian
-import requests
+from telemetry import RingBuffer
+from composite_motion import CompositeMotion, offset_along_normal
+from motion_scheduler import MotionScheduler
+from jog_channel import JogChannel
+from velocity_streamer import VelocityStreamer
+from postures import PostureLibrary, MIN_CLEARANCE
+from loop_watchdog import LoopLagMonitor
 
 logging.getLogger('socketio').setLevel(logging.ERROR)
 logging.getLogger('engineio').setLevel(logging.ERROR)
 logging.basicConfig(level=logging.ERROR)
 
-from websockets.sync.client import connect
-import json		
 link = "ws://192.168.2.209:8083"
-		
-class AsyncWrapper:
-	def __init__(self, robot):
-		self._robot = robot
-	def __getattr__(self, name):
-		attr = getattr(self._robot, name)
-		if callable(attr):
-			async def wrapper(*args, **kwargs):
-				return await asyncio.to_thread(attr, *args, **kwargs)
-			return wrapper
-		return attr
-
+CONTROLLER_URL = "http://192.168.2.13:8081"
+# Per-request timeout and attempts for controller REST calls
+HTTP_TIMEOUT = aiohttp.ClientTimeout(total=2.0)
+HTTP_RETRIES = 3
+# How long to wait for the controller to acknowledge a socket.io event
+ACK_TIMEOUT = 1.0
+# current_pose() answers from the socket.io stream when its newest sample is at most this old (s), 0 always uses RPC
+POSE_MAX_AGE = float(os.getenv("LARA_POSE_MAX_AGE", "0.05"))
+# Outside a motion session the tracked controller mode is trusted for this long (s), other processes may change it
+MODE_STATE_MAX_AGE = float(os.getenv("LARA_MODE_STATE_MAX_AGE", "5.0"))
+# A speed this process applied is assumed unchanged for this long (s); the other service and the teach pendant set it too
+SPEED_STATE_MAX_AGE = float(os.getenv("LARA_SPEED_STATE_MAX_AGE", "5.0"))
+
+def _wake(waiter):
+	if not waiter.done():
+		waiter.set_result(None)
+
+
+class ControllerState:
+	"""
+	Controller mode and pause state as last set by this process, followed from the calls
+	made through Robot/AsyncRobot (registered as a call listener). None means unknown:
+	failed commands, power/reset_error and disconnects forget what was known.
+	"""
+	def __init__(self):
+		self.mode = None
+		self.paused = None
+		self.updated_at = None
+		self._lock = threading.Lock()
+
+	def observe(self, function_name, args, kwargs, error=None):
+		with self._lock:
+			if error is not None:
+				if function_name in ("set_mode", "pause", "unpause", "stop", "power", "reset_error") or function_name in MOTION_FUNCTIONS:
+					self._forget()
+				return
+			if function_name == "set_mode":
+				self.mode = args[0] if args else kwargs.get("value", kwargs.get("mode"))
+			elif function_name in ("pause", "unpause"):
+				self.paused = function_name == "pause"
+			elif function_name == "stop":
+				self.paused = None
+			elif function_name in ("power", "reset_error"):
+				self._forget()
+				return
+			else:
+				return
+			self.updated_at = time.monotonic()
+
+	def _forget(self):
+		self.mode = None
+		self.paused = None
+		self.updated_at = None
+
+	def forget(self):
+		with self._lock:
+			self._forget()
+
+	def age(self):
+		return None if self.updated_at is None else time.monotonic() - self.updated_at
+
+	def known(self, trusted=False):
+		"""(mode, paused), or (None, None) when the state is older than MODE_STATE_MAX_AGE and not trusted."""
+		with self._lock:
+			age = self.age()
+			if age is None or (not trusted and age > MODE_STATE_MAX_AGE):
+				return None, None
+			return self.mode, self.paused
+
+	def snapshot(self):
+		return {"mode": self.mode, "paused": self.paused, "age": self.age()}
+
+
+class RobotSnapshot:
+	"""
+	Pose, joints, mode and motion status of the robot taken together by Lara.snapshot(), so
+	decisions made from it agree with each other. source is "stream" or "rpc"; taken_at is
+	the monotonic time of the pose.
+	"""
+	def __init__(self, pose: Pose, joints, mode, paused, moving, busy, source, taken_at):
+		self.pose = pose
+		self.joints = joints
+		self.mode = mode
+		self.paused = paused
+		# None when the pose stream is too old to tell
+		self.moving = moving
+		# inside a motion session or running a scheduled motion
+		self.busy = busy
+		self.source = source
+		self.taken_at = taken_at
+
+	@property
+	def age(self):
+		return time.monotonic() - self.taken_at
+
+	def to_dict(self):
+		return {
+			"pose": {
+				"position": [self.pose.position.x, self.pose.position.y, self.pose.position.z],
+				"orientation": [self.pose.orientation.x, self.pose.orientation.y, self.pose.orientation.z, self.pose.orientation.w],
+			},
+			"joints": [float(angle) for angle in self.joints],
+			"mode": self.mode,
+			"paused": self.paused,
+			"moving": self.moving,
+			"busy": self.busy,
+			"source": self.source,
+			"age": self.age,
+		}
 
 
 class Lara:
 	def __init__(self):
-		self.robot =	Robot()
+		# the local gateway when it runs, the control box otherwise
+		self.robot_address = resolve_robot_address()
+		# shared by both clients so a command sent through either one invalidates cached reads
+		self.read_cache = ReadCache()
+		# attributes load in the background, RPC calls work right away
+		self.robot =	Robot(address=self.robot_address, cache=self.read_cache, background_init=True)
 		self.joints = {
 			"joint1": 0,
 			"joint2": 0,
@@ -41,7 +153,7 @@ class Lara:
 			"joint5": 0,
 			"joint6": 0,
 		}
-		self.sio	= socketio.AsyncClient(logger=False, engineio_logger=False)
+		self.sio	= socketio.AsyncClient(logger=False, engineio_logger=False, json=SocketioJson)
 		self.sio.on('Cartesian_Pose', self.__set_cartesian_pose)
 		self.sio.on('Joint_Angle', self.__set_joint_angle)
 		self.sio.on('connect', self.on_connect)
@@ -51,7 +163,16 @@ class Lara:
 		self.sio.on('CollisionDetected', self.on_collision_effect)
 		self.max_rotation_speed = 0.2617994	# rad/s
 		self.max_translation_speed =	0.25	# m/s
-		self.pose: Pose = Pose(Vector3(0, 0, 0),	Quaternion(0, 0, 0, 1))
+		self._pose: Pose = Pose(Vector3(0, 0, 0),	Quaternion(0, 0, 0, 1))
+		self._pose_data = None
+		# timestamped samples of the socket.io streams: [X, Y, Z, qx, qy, qz, qw] and [A1..A6]
+		self.pose_history = RingBuffer(7)
+		self.joint_history = RingBuffer(6)
+		self.pose_max_age = POSE_MAX_AGE
+		# where the last current_pose()/current_pose_raw() value came from, for debugging
+		self.last_pose_source = {"source": None, "age": None}
+		# futures of wait_for_state callers, woken on every streamed sample
+		self._state_waiters = set()
 		# For tracking heartbeats & slider calls
 		self.last_slider_call = 0.0
 		self.heartbeat_task = None
@@ -61,8 +182,129 @@ class Lara:
 		self.started_movement_slider = False
 		self.current_linear_speed = None # Meters
 		self.current_rotation_speed = None # Rads
-		self.async_robot = AsyncWrapper(self.robot)
-
+		# (speed, monotonic time) the controller was last set to, by /api/cartesian field, to skip redundant changes
+		self.applied_speeds = {}
+		# cleared if the controller does not acknowledge socket.io events, then fixed delays are used
+		self.ack_supported = True
+		# started by the services to catch anything blocking their event loop
+		self.loop_lag = LoopLagMonitor()
+		self._http = None
+		self._http_loop = None
+		self.async_robot = AsyncRobot(address=self.robot_address, cache=self.read_cache)
+		# mode/pause state followed from the calls of both clients, so motion helpers skip redundant switches
+		self.controller = ControllerState()
+		self.robot.listeners.append(self.controller.observe)
+		self.async_robot.listeners.append(self.controller.observe)
+		self._session_depth = 0
+		self._session_lock = threading.Lock()
+		# the services queue their motions here so they run one at a time
+		self.motions = MotionScheduler()
+		# kept open for the jog commands of start_moving/stopMoving
+		self.jog = JogChannel(link)
+		# approach postures of the taught stations, see transfer()
+		self.postures = PostureLibrary()
+		# set once a Joint_Angle sample matched get_current_joint_angles, then the stream is used instead
+		self.joint_stream_checked = False
+		# CartesianSlider setpoints of move(), sent at a fixed rate
+		self.slider_stream = VelocityStreamer(self.start_movement_slider_values, self.stop_movement_slider_values)
+
+
+	def external_motion(self):
+		"""Called for motions sent outside the RPC (sliders, jog websocket) so cached reads and diagnostics polling follow them."""
+		self.read_cache.invalidate()
+		self.robot.monitor.notify_motion()
+
+	def metrics(self):
+		"""RPC call metrics of this process, slowest functions first, with the read cache counters."""
+		return {"rpc": rpc_metrics.snapshot(), "read_cache": self.read_cache.stats(), "event_loop": self.loop_lag.stats(), "motions": self.motions.stats(), "jog": self.jog.stats(), "slider_stream": self.slider_stream.last_report}
+
+	def reset_metrics(self):
+		rpc_metrics.reset()
+		self.loop_lag.reset()
+		self.motions.reset()
+
+	@property
+	def in_motion_session(self):
+		return self._session_depth > 0
+
+	def queue_automatic(self, batch, unpause=True):
+		"""
+		Queues set_mode("Automatic") and unpause() on batch unless the tracked state says they are
+		already in effect. Returns the queued BatchCalls for the caller to check after the batch.
+		"""
+		mode, paused = self.controller.known(trusted=self.in_motion_session)
+		calls = []
+		if mode != "Automatic":
+			calls.append(batch.set_mode("Automatic"))
+		if unpause and paused is not False:
+			calls.append(batch.unpause())
+		return calls
+
+	def _enter_session(self):
+		with self._session_lock:
+			self._session_depth += 1
+
+	def _exit_session(self):
+		"""True when the outermost session ended."""
+		with self._session_lock:
+			self._session_depth -= 1
+			return self._session_depth == 0
+
+	@contextmanager
+	def motion_session(self):
+		"""
+		Groups moves so the controller is switched to Automatic once (by queue_automatic
+		inside the block) and stopped and put back in Teach once, when the outermost session ends.
+		After an error only set_mode("Teach") is sent. Sessions nest and are shared with async_motion_session.
+		"""
+		self._enter_session()
+		failed = False
+		try:
+			yield self
+		except BaseException:
+			failed = True
+			raise
+		finally:
+			if self._exit_session():
+				try:
+					if failed:
+						self.robot.set_mode("Teach")
+					else:
+						with self.robot.batch() as batch:
+							stopped = batch.stop()
+							teach = batch.set_mode("Teach")
+						stopped.result()
+						teach.result()
+				except Exception as e:
+					if not failed:
+						raise
+					print(f"Failed to return to Teach mode: {e}")
+
+	@asynccontextmanager
+	async def async_motion_session(self):
+		"""motion_session for coroutines, leaving Automatic through async_robot."""
+		self._enter_session()
+		failed = False
+		try:
+			yield self
+		except BaseException:
+			failed = True
+			raise
+		finally:
+			if self._exit_session():
+				try:
+					if failed:
+						await self.async_robot.set_mode("Teach")
+					else:
+						async with self.async_robot.batch() as batch:
+							stopped = batch.stop()
+							teach = batch.set_mode("Teach")
+						stopped.result()
+						teach.result()
+				except Exception as e:
+					if not failed:
+						raise
+					print(f"Failed to return to Teach mode: {e}")
 
 	async def report_error(self, data):
 		print(f"Error: {data}")
@@ -75,39 +317,179 @@ class Lara:
 			"joint5": data['A5'],
 			"joint6": data['A6'],
 	   }
-	async def __set_cartesian_pose(self,	data) -> None:
-		self.pose = Pose(
+		self.joint_history.append([data['A1'], data['A2'], data['A3'], data['A4'], data['A5'], data['A6']])
+		self._notify_state()
+	@property
+	def pose(self) -> Pose:
+		# Cartesian_Pose events only store the raw data, the Pose is built on the first read after one
+		if self._pose is None:
+			self._pose = self.socket_pose(self._pose_data)
+		return self._pose
+	@pose.setter
+	def pose(self, pose: Pose) -> None:
+		self._pose = pose
+		self._pose_data = None
+	@staticmethod
+	def socket_pose(data) -> Pose:
+		return Pose(
 			Vector3(x=data['X'],y=data['Y'], z=data['Z']),
 			Quaternion(x=data['_X'],y=data['_Y'], z=data['_Z'],	w=data['_W'])
 		)
+	async def __set_cartesian_pose(self,	data) -> None:
+		self._pose_data = data
+		self._pose = None
+		self.pose_history.append([data['X'], data['Y'], data['Z'], data['_X'], data['_Y'], data['_Z'], data['_W']])
+		self._notify_state()
+	def _notify_state(self):
+		# waiters may belong to another event loop (e.g. asyncio.run in the NoAsync helpers)
+		for waiter in list(self._state_waiters):
+			waiter.get_loop().call_soon_threadsafe(_wake, waiter)
+	async def wait_for_state(self, condition, timeout=None, recheck=None):
+		"""
+		Waits until condition() is true, checking it again on every streamed pose or joint sample
+		and, if given, at least every `recheck` seconds. Returns False on timeout.
+		"""
+		deadline = None if timeout is None else time.monotonic() + timeout
+		loop = asyncio.get_running_loop()
+		while not condition():
+			remaining = None if deadline is None else deadline - time.monotonic()
+			if remaining is not None and remaining <= 0:
+				return False
+			if recheck is not None:
+				remaining = recheck if remaining is None else min(recheck, remaining)
+			waiter = loop.create_future()
+			self._state_waiters.add(waiter)
+			try:
+				await asyncio.wait_for(waiter, remaining)
+			except asyncio.TimeoutError:
+				pass
+			finally:
+				self._state_waiters.discard(waiter)
+		return True
+	async def wait_for_pose(self, predicate, timeout=None):
+		"""Waits until predicate(pose) holds for the streamed pose and returns that pose, None on timeout."""
+		if await self.wait_for_state(lambda: predicate(self.pose), timeout):
+			return self.pose
+		return None
+	def is_still(self, tol=0.0002, dwell=0.2, angle_tol=0.002):
+		"""
+		True if the streamed pose stayed within tol (m) in position and about angle_tol (rad)
+		in orientation for the last dwell seconds. A stream that went quiet counts as still.
+		"""
+		history = self.pose_history
+		start = time.monotonic() - dwell
+		first = history.first()
+		if first is None or first[0] > start:
+			return False
+		times, values = history.window(start)
+		values = np.vstack([history.interpolate(start), values])
+		spread = np.ptp(values, axis=0)
+		# quaternion components change by about half the rotation angle
+		return spread[:3].max() <= tol and spread[3:].max() <= angle_tol / 2
+	async def wait_until_still(self, tol=0.0002, dwell=0.2, timeout=None, angle_tol=0.002):
+		"""Waits until is_still(tol, dwell, angle_tol) holds. Returns False on timeout."""
+		return await self.wait_for_state(lambda: self.is_still(tol, dwell, angle_tol), timeout, recheck=dwell / 2)
+	def pose_at(self, t) -> Pose:
+		"""Pose interpolated from the streamed history at monotonic time t, None before the first sample."""
+		sample = self.pose_history.interpolate(t)
+		if sample is None:
+			return None
+		orientation = sample[3:] / np.linalg.norm(sample[3:])
+		return Pose(
+			Vector3(*sample[:3]),
+			Quaternion(x=float(orientation[0]), y=float(orientation[1]), z=float(orientation[2]), w=float(orientation[3]))
+		)
 	async def on_collision_effect(self, args):
 		print(f"Collision detected: {args}")
+		self.controller.forget()
 		await asyncio.sleep(2)
 		self.collided = True
 	async def reset_collision(self):
-		await self.sio.emit("reset_collision", {"reset": True})
-		await asyncio.sleep(0.5)
-		response = requests.get("http://192.168.2.13:8081/api/cartesian")
-		data = response.json()
+		await self.emit_acknowledged("reset_collision", {"reset": True}, delay=0.5)
+		data = await self.controller_get("/api/cartesian")
 
 		self.collided = False
 	async def fetch_cartesian_pose(self):
-		response = requests.get("http://192.168.2.13:8081/api/cartesianpose")
-		data = response.json()
-		data = data[0]
-		self.pose = Pose(
-			Vector3(x=data['X'],y=data['Y'], z=data['Z']),
-			Quaternion(x=data['_X'],y=data['_Y'], z=data['_Z'],	w=data['_W'])
-		)
+		data = (await self.controller_get("/api/cartesianpose"))[0]
+		self.pose = self.socket_pose(data)
+		self.pose_history.append([data['X'], data['Y'], data['Z'], data['_X'], data['_Y'], data['_Z'], data['_W']])
 
 	async def connect_socket(self):
+		# the pose is streamed while connected, so it is only fetched when (re)connecting
 		if not self.sio.connected:
-			await self.sio.connect('http://192.168.2.13:8081')
-		await self.fetch_cartesian_pose()
+			await self.sio.connect(CONTROLLER_URL)
+			await self.fetch_cartesian_pose()
+		elif len(self.pose_history) == 0:
+			await self.fetch_cartesian_pose()
+	async def http_session(self) -> aiohttp.ClientSession:
+		"""Keep-alive HTTP session to the controller, recreated when used from a new event loop."""
+		loop = asyncio.get_running_loop()
+		if self._http is None or self._http.closed or self._http_loop is not loop:
+			self._http = aiohttp.ClientSession(CONTROLLER_URL, timeout=HTTP_TIMEOUT)
+			self._http_loop = loop
+		return self._http
+	async def controller_get(self, path, retries=HTTP_RETRIES):
+		"""GETs a controller REST path as JSON, retrying timeouts, connection errors and 5xx replies."""
+		session = await self.http_session()
+		for attempt in range(retries):
+			try:
+				async with session.get(path) as response:
+					response.raise_for_status()
+					return await response.json(content_type=None)
+			except aiohttp.ClientResponseError as e:
+				if e.status < 500 or attempt == retries - 1:
+					raise
+				error = e
+			except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+				if attempt == retries - 1:
+					raise
+				error = e
+			print(f"GET {path} failed ({error!r}), retrying")
+			await asyncio.sleep(0.1 * 2 ** attempt)
+	async def emit_acknowledged(self, event, data, delay):
+		"""
+		Emits a socket.io event and returns once the controller acknowledges it. Falls back
+		to emitting and waiting `delay` seconds if the controller does not send acks.
+		"""
+		if self.ack_supported:
+			try:
+				return await self.sio.call(event, data, timeout=ACK_TIMEOUT)
+			except socketio.exceptions.TimeoutError:
+				print(f"Controller does not acknowledge {event}, waiting fixed delays instead")
+				self.ack_supported = False
+				return None
+		await self.sio.emit(event, data)
+		await asyncio.sleep(delay)
+	async def close(self):
+		self.motions.stop()
+		await self.jog.close()
+		if self._http is not None and not self._http.closed:
+			await self._http.close()
+		if self.sio.connected:
+			await self.sio.disconnect()
+	async def connect(self, stop=False):
+		"""
+		Connects socket.io and turns jogging off. Services start this as a task so their
+		startup does not wait on the robot; methods that need the socket reconnect themselves.
+		"""
+		start = time.perf_counter()
+		try:
+			if stop:
+				await self.async_robot.stop()
+			await self.connect_socket()
+			await self.async_robot.turn_off_jog()
+		except Exception as e:
+			print(f"Failed to connect to the robot: {e}")
+			return False
+		print(f"Connected to the robot in {time.perf_counter() - start:.2f} s")
+		return True
 	async def on_connect(self):
 		print('connection established')
 	async def on_disconnect(self):
 		print('disconnected from	server')
+		# the controller may have restarted with its default speeds
+		self.applied_speeds = {}
+		self.controller.forget()
 
 	def rot_speed_deg_is_close_to_current(self, deg_s, tol=0.1):
 		current_rad = self.current_rotation_speed
@@ -129,7 +511,7 @@ class Lara:
 	def deg2rad(self, deg):
 		return deg *	0.0174533
 	
-	async def set_translation_speed(self, speed):
+	async def set_translation_speed(self, speed, force=False):
 		self.current_linear_speed = speed
 		if speed > self.max_translation_speed:
 			speed = self.max_translation_speed
@@ -137,20 +519,10 @@ class Lara:
 		elif speed < 0:
 			print("Speed	cannot be negative,	setting	to 0")
 			speed = 0
-		await self.connect_socket()
-		async with aiohttp.ClientSession() as session:
-			async with session.patch(
-				"http://192.168.2.13:8081/api/cartesian",
-				headers={"Content-Type":	"application/json"},
-				json={"linearVelocity": speed}
-			) as response:
-				logging.info(await response.text())
-		await asyncio.sleep(0.2)
-		await self.sio.emit("linearveltrigger", {"data":	True})
-		await asyncio.sleep(0.2)
+		await self.apply_speed("linearVelocity", speed, force)
 		
 	
-	async def set_rotation_speed(self, speed):
+	async def set_rotation_speed(self, speed, force=False):
 		self.current_rotation_speed = speed
 		if speed > self.max_rotation_speed:
 			speed = self.max_rotation_speed
@@ -158,17 +530,29 @@ class Lara:
 		elif speed < 0:
 			print("Speed cannot be negative, setting to 0")
 			speed = 0
+		await self.apply_speed("rotationSpeed", speed, force)
+
+	async def apply_speed(self, field, speed, force=False):
+		"""
+		PATCHes one /api/cartesian speed field and triggers the controller to apply it.
+		Skipped if this process set that speed less than SPEED_STATE_MAX_AGE ago, unless force
+		is set; precision moves pass force since other processes change the speed too.
+		"""
+		applied = self.applied_speeds.get(field)
+		if not force and applied is not None and applied[0] == speed and time.monotonic() - applied[1] <= SPEED_STATE_MAX_AGE:
+			return
 		await self.connect_socket()
-		async with aiohttp.ClientSession() as session:
-			async with session.patch(
-				"http://192.168.2.13:8081/api/cartesian",
-				headers={"Content-Type":	"application/json"},
-				json={"rotationSpeed": speed}
-			) as response:
-				logging.info(await response.text())
-		await asyncio.sleep(0.2)
-		await self.sio.emit("linearveltrigger", {"data":	True})
-		await asyncio.sleep(0.2)
+		session = await self.http_session()
+		async with session.patch(
+			"/api/cartesian",
+			headers={"Content-Type":	"application/json"},
+			json={field: speed}
+		) as response:
+			logging.info(await response.text())
+			accepted = response.ok
+		await self.emit_acknowledged("linearveltrigger", {"data":	True}, delay=0.2)
+		if accepted:
+			self.applied_speeds[field] = (speed, time.monotonic())
 		
 	def setRotSpeedDegSNoAsync(self, deg_s):
 		rad_s = deg_s * 0.0174533
@@ -180,15 +564,15 @@ class Lara:
 		print(f"Setting translation speed to {linear_speed} m/s or {mm_s} mm/s")
 		asyncio.run(self.set_translation_speed(linear_speed))
 
-	async def set_translation_speed_mms(self, mm_s):
+	async def set_translation_speed_mms(self, mm_s, force=False):
 		linear_speed = mm_s / 1000
 		print(f"Setting translation speed to {linear_speed} m/s or {mm_s} mm/s")
-		await self.set_translation_speed(linear_speed)
+		await self.set_translation_speed(linear_speed, force)
 
-	async def set_rotation_speed_degs(self, deg_s):
+	async def set_rotation_speed_degs(self, deg_s, force=False):
 		rad_s = deg_s * 0.0174533
 		print(f"Setting rotational speed to {rad_s} rad/s or {deg_s} deg/s")
-		await self.set_rotation_speed(rad_s)
+		await self.set_rotation_speed(rad_s, force)
 	async def start_movement_slider(self,q0, q1, q2, q3, q4, q5):
 		data = {
 			'q0': q0,
@@ -208,6 +592,7 @@ class Lara:
 			'reference': "Base",
 			'absrel': "Absolute",
 		}
+		self.external_motion()
 		await self.sio.emit('CartesianSlider', data)
 		
 	async def stop_movement_slider(self, q0, q1, q2, q3, q4, q5):
@@ -229,98 +614,145 @@ class Lara:
 			'reference': "Base",
 			'absrel': "Absolute",
 		}
+		self.external_motion()
 		await self.sio.emit('CartesianSlider', data)
 
-	def retract(self, distance = -0.3):
-        # First step: use the current pose
+	async def start_movement_slider_values(self, values):
+		await self.start_movement_slider(*values)
+
+	async def stop_movement_slider_values(self):
+		await self.stop_movement_slider(0, 0, 0, 0, 0, 0)
+
+	def retract(self, distance = -0.3, start: Pose = None):
+		# First step: use the current pose, or start if the caller already read it
+		start = start or self.current_pose_raw()
 		steps = []
-		steps.append(self.current_pose())
+		steps.append(start.to_Cartesian())
 		# Second step: move 0.3 m along the local Z-axis (normal) of the current orientation
-		offset = np.array([0, 0, distance])
-		rotation_matrix = R.from_quat([
-			self.pose.orientation.x,
-			self.pose.orientation.y,
-			self.pose.orientation.z,
-			self.pose.orientation.w
-		]).as_matrix()
-		offset_global = rotation_matrix @ offset
-
-		new_position = Vector3(
-			self.pose.position.x + offset_global[0],
-			self.pose.position.y + offset_global[1],
-			self.pose.position.z + offset_global[2]
-		)
-		steps.append(PoseCartesian(position=new_position, orientation=self.pose.orientation.to_euler(order="xyz")))
+		steps.append(self.retract_waypoint(start, distance))
 		#move
 		self.__move_to_steps(steps)
 	
-	def move_to_pose_from_retract(self, pose: Pose):
+	def move_to_pose_from_retract(self, pose: Pose, start: Pose = None):
 		print(f"Moving to pose: {pose}")
-        # First step: use the current pose (retracted)
-		steps = []
-		steps.append(self.current_pose())
-		# Second step is target position + offset
-		offset = np.array([0, 0, -0.3])
-		rotation_matrix = R.from_quat([
-			pose.orientation.x,
-			pose.orientation.y,
-			pose.orientation.z,
-			pose.orientation.w
-		]).as_matrix()
-		offset_global = rotation_matrix @ offset
-		new_position = Vector3(
-			pose.position.x + offset_global[0],
-			pose.position.y + offset_global[1],
-			pose.position.z + offset_global[2]
-		)
-		steps.append(PoseCartesian(position=new_position, orientation=pose.orientation.to_euler(order="xyz")))
-		#fourth step is the target position
-		steps.append(PoseCartesian(position=pose.position, orientation=pose.orientation.to_euler(order="xyz")))
-		#move
-		self.__move_to_steps(steps)
+		# from the current (retracted) pose to 0.3 m above the target, then onto it
+		self.move_through(self.approach_waypoints(pose, -0.3), start)
+
+	@staticmethod
+	def retract_waypoint(pose: Pose, distance):
+		"""pose moved `distance` along its own Z axis as a move_through waypoint."""
+		return PoseCartesian(position=offset_along_normal(pose, distance).position, orientation=pose.orientation.to_euler(order="xyz"))
+
+	@staticmethod
+	def approach_waypoints(pose: Pose, distance, descend=True):
+		"""pose moved `distance` along its own Z axis and, if descend, pose itself, as move_through waypoints."""
+		orientation = pose.orientation.to_euler(order="xyz")
+		steps = [PoseCartesian(position=offset_along_normal(pose, distance).position, orientation=orientation)]
+		if descend:
+			steps.append(PoseCartesian(position=pose.position, orientation=orientation))
+		return steps
+
+	def move_through(self, waypoints, start: Pose = None):
+		"""Blended linear move from start (the current pose if None) through fixed waypoints (PoseCartesian)."""
+		start = start.to_Cartesian() if start is not None else self.current_pose()
+		self.__move_to_steps([start] + list(waypoints))
 	
 
 	
+	def _enter_automatic(self, joint_angles=None):
+		"""
+		Switches to Automatic if needed and reads the joint angles in the same round trip, unless
+		joint_angles (e.g. from a snapshot) are given.
+		"""
+		with self.robot.batch() as batch:
+			switches = self.queue_automatic(batch)
+			read = batch.robot_status("jointAngles") if joint_angles is None else None
+		for call in switches:
+			call.result()
+		return read.result() if read is not None else joint_angles
+
+	def plan_smart_move(self, target: Pose, approach=-0.3, descend=True, clearance=0.3, transfer_distance=0.5, snapshot: RobotSnapshot = None) -> CompositeMotion:
+		"""
+		Plans the smart move to target as one composite motion: retract `clearance` along the tool axis
+		if below target z + clearance, swing around the base to the approach pose (target moved
+		`approach` along its own axis) if further than transfer_distance in xy, then go down onto
+		target if descend is set. Plans from snapshot, or from a new one. The arc must stay
+		MIN_CLEARANCE above target, checked with the waypoints by move_composite().
+		"""
+		start = (snapshot or self.snapshot()).pose
+		motion = CompositeMotion(start)
+		motion.min_via_z = target.position.z + MIN_CLEARANCE
+		if start.position.z < target.position.z + clearance:
+			motion.linear(offset_along_normal(start, -clearance))
+		approach_pose = offset_along_normal(target, approach)
+		position = motion.end.position
+		if np.hypot(target.position.x - position.x, target.position.y - position.y) > transfer_distance:
+			motion.arc_around_base(approach_pose)
+		else:
+			motion.linear(approach_pose)
+		if descend:
+			motion.linear(target)
+		return motion
+
+	def move_composite(self, motion: CompositeMotion, joint_angles=None):
+		"""Sends motion as one move_composite after validating it; raises UnreachablePath before moving if it fails."""
+		if not len(motion):
+			raise ValueError("No segments planned")
+		if joint_angles is None:
+			joint_angles = self.robot.get_current_joint_angles()
+		motion.validate(self.robot, joint_angles)
+		print(f"Moving: {len(motion)} composite segments")
+		try:
+			with self.motion_session():
+				joint_angles = self._enter_automatic(joint_angles)
+				self.robot.move_composite(**motion.property(joint_angles))
+				print("Movement done")
+		except Exception as e:
+			print(f"Error: {e}")
+			raise ValueError("Error occurred during movement")
+		print("Movement completed successfully")
+
+	def smart_move(self, target: Pose, approach=-0.3, descend=True):
+		"""
+		Retract, transfer and approach to target as a single blended move_composite command,
+		planned and started from one snapshot.
+		"""
+		snapshot = self.snapshot()
+		self.move_composite(self.plan_smart_move(target, approach, descend, snapshot=snapshot), snapshot.joints)
+
 	def __move_to_steps(self, steps):
 		if not steps:
 			raise ValueError("No steps provided")
-		error = False
 		print(f"Moving: {len(steps)} steps")
-		try: 
-			self.robot.set_mode("Automatic")
-			linear_property = {
-			"speed": 0.2,
-			"acceleration": 0.001,
-			"blend_radius": 0.005,
-			"target_pose": [
-				[step.position.x, step.position.y, step.position.z, step.orientation.x, step.orientation.y, step.orientation.z] for step in steps
-			],
-			"current_joint_angles": self.robot.robot_status("jointAngles"),
-			"weaving": False,
-			"pattern": 1,
-			"amplitude": 0.006,
-			"amplitude_left": 0.0,
-			"amplitude_right": 0.0,
-			"frequency": 1.5,
-			"dwell_time_left": 0.0,
-			"dwell_time_right": 0.0,
-			"elevation": 0.0,
-			"azimuth": 0.0
-			}
-			self.robot.unpause()
-			self.robot.move_linear(**linear_property)
-			print("Movement done")
-			self.robot.stop()
-			print("Stopped")
+		try:
+			# inside an outer session the mode switches and the final stop are skipped
+			with self.motion_session():
+				joint_angles = self._enter_automatic()
+				linear_property = {
+				"speed": 0.2,
+				"acceleration": 0.001,
+				"blend_radius": 0.005,
+				"target_pose": [
+					[step.position.x, step.position.y, step.position.z, step.orientation.x, step.orientation.y, step.orientation.z] for step in steps
+				],
+				"current_joint_angles": joint_angles,
+				"weaving": False,
+				"pattern": 1,
+				"amplitude": 0.006,
+				"amplitude_left": 0.0,
+				"amplitude_right": 0.0,
+				"frequency": 1.5,
+				"dwell_time_left": 0.0,
+				"dwell_time_right": 0.0,
+				"elevation": 0.0,
+				"azimuth": 0.0
+				}
+				self.robot.move_linear(**linear_property)
+				print("Movement done")
 		except Exception as e:
 			print(f"Error: {e}")
-			error = True
-		finally:
-			self.robot.set_mode("Teach")
-			if error:
-				raise ValueError("Error occurred during movement")
-			else:
-				print("Movement completed successfully")
+			raise ValueError("Error occurred during movement")
+		print("Movement completed successfully")
 
 
 	def move_to_pose(self, pose: Pose):
@@ -328,46 +760,10 @@ class Lara:
 		Moves to the target position by performing a retract along the normal then moving toward the target position
 		'''
 		print(f"Moving to pose: {pose}")
-        # First step: use the current pose
-		steps = []
-		steps.append(self.current_pose())
-
-		# Second step: move 0.3 m along the local Z-axis (normal) of the current orientation
-		offset = np.array([0, 0, -0.3])
-		rotation_matrix = R.from_quat([
-			self.pose.orientation.x,
-			self.pose.orientation.y,
-			self.pose.orientation.z,
-			self.pose.orientation.w
-		]).as_matrix()
-		offset_global = rotation_matrix @ offset
-
-		new_position = Vector3(
-			self.pose.position.x + offset_global[0],
-			self.pose.position.y + offset_global[1],
-			self.pose.position.z + offset_global[2]
-		)
+		# retract 0.3 m along the current tool axis, then to 0.3 m above the target and onto it
+		start = self.current_pose_raw()
+		return self.move_through([self.retract_waypoint(start, -0.3)] + self.approach_waypoints(pose, -0.3), start)
 
-		steps.append(PoseCartesian(position=new_position, orientation=self.pose.orientation.to_euler(order="xyz")))
-		# third step is target position + offset
-		rotation_matrix = R.from_quat([
-			pose.orientation.x,
-			pose.orientation.y,
-			pose.orientation.z,
-			pose.orientation.w
-		]).as_matrix()
-		offset_global = rotation_matrix @ offset
-		new_position = Vector3(
-			pose.position.x + offset_global[0],
-			pose.position.y + offset_global[1],
-			pose.position.z + offset_global[2]
-		)
-		steps.append(PoseCartesian(position=new_position, orientation=pose.orientation.to_euler(order="xyz")))
-		# fourth step is the target position
-		steps.append(PoseCartesian(position=pose.position, orientation=pose.orientation.to_euler(order="xyz")))
-		# 
-		return self.__move_to_steps(steps)
-	
 	def move_to_pose_cartesian_from_current(self, pose: PoseCartesian):
 		'''
 		Moves to the target position by performing a retract along the normal then moving toward the target position
@@ -381,29 +777,12 @@ class Lara:
 		# 
 		return self.__move_to_steps(steps)
 	
-	def move_to_pose_tag_from_retract(self, pose: Pose):
+	def move_to_pose_tag_from_retract(self, pose: Pose, start: Pose = None):
 		'''
 		Moves to tag pose, to be used only with retract movement before hand
 		'''
-		# First step: use the current pose (retracted)
-		steps = []
-		steps.append(self.current_pose())
-		# Second step is target position + offset
-		offset = np.array([0, 0, -0.15])
-		rotation_matrix = R.from_quat([
-			pose.orientation.x,
-			pose.orientation.y,
-			pose.orientation.z,
-			pose.orientation.w
-		]).as_matrix()
-		offset_global = rotation_matrix @ offset
-		new_position = Vector3(
-			pose.position.x + offset_global[0],
-			pose.position.y + offset_global[1],
-			pose.position.z + offset_global[2]
-		)
-		steps.append(PoseCartesian(position=new_position, orientation=pose.orientation.to_euler(order="xyz")))
-		self.__move_to_steps(steps)
+		# from the current (retracted) pose to 0.15 m above the tag
+		self.move_through(self.approach_waypoints(pose, -0.15, descend=False), start)
 
 	def move_from_current_direct(self, pose: Pose):
 		'''
@@ -419,65 +798,111 @@ class Lara:
 	
 	def move_to_pose_tag(self, pose: Pose):
 		print(f"Moving to pose: {pose}")
-        # First step: use the current pose
-		steps = []
-		print(f"Current pose: {self.current_pose()}")
-		steps.append(self.current_pose())
-		
-
-		# Second step: move 0.3 m along the local Z-axis (normal) of the current orientation
-		offset = np.array([0, 0, -0.3])
-		rotation_matrix = R.from_quat([
-			self.pose.orientation.x,
-			self.pose.orientation.y,
-			self.pose.orientation.z,
-			self.pose.orientation.w
-		]).as_matrix()
-		offset_global = rotation_matrix @ offset
-
-		new_position = Vector3(
-			self.pose.position.x + offset_global[0],
-			self.pose.position.y + offset_global[1],
-			self.pose.position.z + offset_global[2]
-		)
-
-		steps.append(PoseCartesian(position=new_position, orientation=self.pose.orientation.to_euler(order="xyz")))
-		#third step is target position + offset
-		offset = np.array([0, 0, -0.15])
-		rotation_matrix = R.from_quat([
-			pose.orientation.x,
-			pose.orientation.y,
-			pose.orientation.z,
-			pose.orientation.w
-		]).as_matrix()
-		offset_global = rotation_matrix @ offset
-		new_position = Vector3(
-			pose.position.x + offset_global[0],
-			pose.position.y + offset_global[1],
-			pose.position.z + offset_global[2]
-		)
-		steps.append(PoseCartesian(position=new_position, orientation=pose.orientation.to_euler(order="xyz")))
-		self.__move_to_steps(steps)
+		# retract 0.3 m along the current tool axis, then to 0.15 m above the tag
+		start = self.current_pose_raw()
+		print(f"Current pose: {start.to_Cartesian()}")
+		self.move_through([self.retract_waypoint(start, -0.3)] + self.approach_waypoints(pose, -0.15, descend=False), start)
 
 	def current_pose(self) -> PoseCartesian:
-		pose = self.robot.get_tcp_pose_quaternion() # [X,Y,Z,w,x,y,z] 
-		return Pose(
-			position=Vector3(x=pose[0], y=pose[1], z=pose[2]),
-			orientation=Quaternion(x=pose[4], y=pose[5], z=pose[6], w=pose[3])
-		).to_Cartesian()
+		return self.current_pose_raw().to_Cartesian()
 		
 	def current_pose_raw(self) -> Pose:
-		pose = self.robot.get_tcp_pose_quaternion() # [X,Y,Z,w,x,y,z]
-		qt = Quaternion(x=pose[4], y=pose[5], z=pose[6], w=pose[3])
-		qt = qt * Quaternion(1, 0, 0, 0).invert()
-		p =  Pose(
+		"""
+		The streamed pose if its newest sample is younger than pose_max_age and arrived after
+		the last robot command, otherwise a get_tcp_pose_quaternion RPC. The source and age
+		of the value are kept in last_pose_source.
+		"""
+		last = self.pose_history.last()
+		if last is not None and self.pose_max_age > 0:
+			age = time.monotonic() - last[0]
+			if age <= self.pose_max_age and last[0] > self.read_cache.invalidated_at:
+				self.last_pose_source = {"source": "stream", "age": float(age)}
+				return self.pose
+		pose = self.raw_pose(self.robot.get_tcp_pose_quaternion())
+		self.last_pose_source = {"source": "rpc", "age": 0.0}
+		return pose
+
+	def streamed_joints(self):
+		"""
+		The streamed joint angles under the same freshness rule as current_pose_raw(), None if
+		they are stale or have not yet been checked against an RPC reading.
+		"""
+		last = self.joint_history.last()
+		if last is None or self.pose_max_age <= 0:
+			return None
+		if time.monotonic() - last[0] > self.pose_max_age or last[0] <= self.read_cache.invalidated_at:
+			return None
+		return last[1] if self.joint_stream_checked else None
+
+	def snapshot(self) -> RobotSnapshot:
+		"""
+		Pose, joints, mode and motion status in one reading: from the stream when pose and joints
+		are fresh (the rule of current_pose_raw() and streamed_joints()), otherwise from one batched
+		round trip that also reads the mode if this process does not know it.
+		"""
+		pose_sample = self.pose_history.last()
+		joints = self.streamed_joints()
+		mode, paused = self.controller.known()
+		busy = self.in_motion_session or self.motions.running is not None
+		if pose_sample is not None and joints is not None:
+			age = time.monotonic() - pose_sample[0]
+			if age <= self.pose_max_age and pose_sample[0] > self.read_cache.invalidated_at:
+				self.last_pose_source = {"source": "stream", "age": float(age)}
+				return RobotSnapshot(self.pose, np.asarray(joints), mode, paused, not self.is_still(), busy, "stream", pose_sample[0])
+		with self.robot.batch() as batch:
+			pose_call = batch.get_tcp_pose_quaternion()
+			joints_call = batch.get_current_joint_angles()
+			mode_call = batch.get_mode() if mode is None else None
+		taken_at = time.monotonic()
+		joints = joints_call.result()
+		self._check_joint_stream(joints)
+		if mode_call is not None:
+			mode = mode_call.result()
+		self.last_pose_source = {"source": "rpc", "age": 0.0}
+		# the pose stream only tells whether the arm moves while it is current
+		moving = not self.is_still() if pose_sample is not None and taken_at - pose_sample[0] <= self.pose_max_age else None
+		return RobotSnapshot(self.raw_pose(pose_call.result()), np.asarray(joints), mode, paused, moving, busy, "rpc", taken_at)
+
+	def _check_joint_stream(self, joint_angles):
+		last = self.joint_history.last()
+		if last is not None and time.monotonic() - last[0] <= self.pose_max_age and len(joint_angles) == 6:
+			self.joint_stream_checked = bool(np.allclose(last[1], joint_angles, atol=0.01))
+
+	async def transfer(self, station):
+		"""
+		Joint move to the cached approach posture of station ("tray", "socket", "home"): one
+		move_joint, with the joint angles read from the stream when fresh and the mode switch
+		skipped when already in Automatic. A posture not validated yet, or that failed before,
+		is validated again first.
+		"""
+		if not self.postures.validated(station):
+			await asyncio.to_thread(self.postures.validate, self.robot, [station])
+		posture = self.postures.get(station)
+		async with self.async_motion_session():
+			joints = self.streamed_joints()
+			async with self.async_robot.batch() as batch:
+				switches = self.queue_automatic(batch, unpause=False)
+				read = batch.get_current_joint_angles() if joints is None else None
+			for call in switches:
+				call.result()
+			if read is not None:
+				joints = read.result()
+				self._check_joint_stream(joints)
+			await self.async_robot.move_joint(**posture.transfer_property(joints))
+
+	@staticmethod
+	def raw_pose(pose) -> Pose:
+		"""Builds a Pose from a get_tcp_pose_quaternion reply ([X,Y,Z,w,x,y,z])."""
+		return Pose(
 			position=Vector3(x=pose[0], y=pose[1], z=pose[2]),
 			orientation=Quaternion(x=pose[4], y=pose[5], z=pose[6], w=pose[3])
 		)
-		return p
 
 	def move_to_pose_relative(self, relative: Pose):
-		pose = self.robot.get_tcp_pose_quaternion()
+		with self.robot.batch() as batch:
+			tcp_pose = batch.get_tcp_pose_quaternion()
+			joint_angles = batch.robot_status("jointAngles")
+		pose = tcp_pose.result()
 		#last 4 values are quaternion
 		quat = pose[-4:]
 		rpy = self.robot.quaternion_to_rpy(quat[0], quat[1], quat[2], quat[3])
@@ -508,12 +933,17 @@ class Lara:
 					pose[5],
 			],
 		],
-		"current_joint_angles":self.robot.robot_status("jointAngles"),
+		"current_joint_angles":joint_angles.result(),
 		}
 		self.robot.move_linear(**linear_property)
 		self.robot.stop()
 	
-	async def move(self, v: Vector3, r: Vector3 = Vector3(0, 0, 0), along_normal: bool = False):
+	async def move(self, v: Vector3, r: Vector3 = Vector3(0, 0, 0), along_normal: bool = False, duration=None, distance=None, ramp=0.0, rate=None):
+		"""
+		Streams CartesianSlider setpoints v (translation) and r (rotation) for `duration` seconds
+		(1 s if neither bound is given) or until the streamed position moved `distance` metres, then stops. ramp smooths the start
+		and end over that many seconds. Returns the streamer's rate report.
+		"""
 		if along_normal:
 			a, b = 0, 0
 			c = 0 + self.deg2rad(self.customC)
@@ -522,13 +952,16 @@ class Lara:
 			movement_vector = rot_matrix @ v
 		else:
 			movement_vector = v
-		for _ in range(10):
-			await self.start_movement_slider(
-				movement_vector.x, movement_vector.y, movement_vector.z,
-				r.x, r.y, r.z
-			)
-			await asyncio.sleep(0.1)
-		await self.stop_movement_slider(0, 0, 0, 0, 0, 0)
+		velocity = [movement_vector.x, movement_vector.y, movement_vector.z, r.x, r.y, r.z]
+		progress = None
+		if duration is None and distance is None:
+			duration = 1.0
+		if distance is not None:
+			start = self.pose_history.last()
+			if start is None:
+				raise ValueError("No streamed pose to measure the distance from")
+			progress = lambda: float(np.linalg.norm(self.pose_history.last()[1][:3] - start[1][:3]))
+		return await self.slider_stream.stream(velocity, duration=duration, distance=distance, progress=progress, ramp=ramp, rate=rate)
 
 	def init_lara(self):
 		return {
@@ -548,24 +981,17 @@ class Lara:
 			"command": "echo",
 			"message": message
 		}
-		global link
-		with connect(link) as websocket:
-			websocket.send(json.dumps(data_echo))
-			reply = websocket.recv()
-			print(f"Echo reply: {reply}")
+		self.jog.send(data_echo, on_reply=lambda reply: print(f"Echo reply: {reply}"), coalesce=False)
 
 	def stopMoving(self):
 		data_stop_moving = {
 			"command": "stopMoving"
 		}
-		global link
-		with connect(link) as websocket:
-			websocket.send(json.dumps(data_stop_moving))
-			reply = websocket.recv()
+		self.external_motion()
+		self.jog.send(data_stop_moving)
 
 	
 	def start_moving(self, q0=0, q1=0, q2=0, q3=0, q4=0, q5=0, absrel="Absolute", reference="Base"):
-		global link
 		data_start_moving = {
 			"command": "startMoving",
 			"q0": q0,
@@ -577,9 +1003,9 @@ class Lara:
 			"absrel": absrel,
 			"reference": reference
 		}
-		with connect(link) as websocket:
-			websocket.send(json.dumps(data_start_moving))
-			reply = websocket.recv()
+		self.external_motion()
+		# fire-and-forget, a newer jog command replaces one that has not been sent yet
+		self.jog.send(data_start_moving)
 
 	
 if __name__	== "__main__":
@@ -0,0 +1,57 @@
+import asyncio
+import time
+
+# A timer firing this much later than scheduled means something blocked the event loop
+LAG_WARNING = 0.02
+
+
+class LoopLagMonitor:
+	"""
+	Wakes up every `interval` seconds on the running event loop and measures how late
+	it was woken. Blocking calls made from coroutines (sync HTTP, RPC, sleeps) show up
+	as lag; anything over warn_threshold is printed with the worst case kept in stats().
+	"""
+	def __init__(self, interval=0.05, warn_threshold=LAG_WARNING):
+		self.interval = interval
+		self.warn_threshold = warn_threshold
+		self.samples = 0
+		self.blocked = 0
+		self.max_lag = 0.0
+		self.last_lag = 0.0
+		self.task = None
+
+	def start(self):
+		if self.task is None or self.task.done():
+			self.task = asyncio.get_running_loop().create_task(self.run())
+		return self.task
+
+	def stop(self):
+		if self.task is not None:
+			self.task.cancel()
+			self.task = None
+
+	async def run(self):
+		while True:
+			start = time.monotonic()
+			await asyncio.sleep(self.interval)
+			lag = time.monotonic() - start - self.interval
+			self.samples += 1
+			self.last_lag = lag
+			self.max_lag = max(self.max_lag, lag)
+			if lag > self.warn_threshold:
+				self.blocked += 1
+				print(f"Event loop was blocked for {lag * 1000:.1f} ms")
+
+	def stats(self):
+		return {
+			"samples": self.samples,
+			"blocked": self.blocked,
+			"max_lag": self.max_lag,
+			"last_lag": self.last_lag,
+			"warn_threshold": self.warn_threshold,
+		}
+
+	def reset(self):
+		self.samples = 0
+		self.blocked = 0
+		self.max_lag = 0.0
@@ -10,13 +10,17 @@ from tray import Tray
 from space import Euler, Vector3, Quaternion, Matrix4, Pose, PoseCartesian
 import numpy as np
 from lara import Lara
+from composite_motion import offset_along_normal, UnreachablePath
+from motion_scheduler import MotionCancelled
+from event_hub import EventHub
+from config_store import ConfigStore
+from telemetry_stream import TelemetryService, ENCODINGS, BINARY_SCHEMA
 import os
 from plunger import	Plunger
 from scipy.spatial.transform import	Rotation as R
 import json
 import threading
 import time
-import queue
 import logging
 import traceback
 import json
@@ -27,8 +31,10 @@ stop_event = threading.Event()
 lara : Lara	= None
 offset_x = 3.4
 logging.getLogger('lara').setLevel(logging.ERROR)
-error_queue = queue.Queue()
-warning_queue = queue.Queue()
+# errors and warnings pushed to every /ws client
+events = EventHub()
+# /telemetry streams, one sampler per rate shared by its clients
+telemetry : TelemetryService = None
 is_paused =	False
 force =	0.0
 threshold_default = 1000.0 # Default threshold value for force
@@ -38,10 +44,10 @@ unblock_pressure_flag = False
 autonomous_control_flag = False
 
 def emit_error(error_code: int, error_message: str):
-	error_queue.put((error_code, error_message))
+	events.publish("error", {"error_code": error_code, "error_message": error_message})
 
 def emit_warning(warning_code: int, warning_message: str):
-	warning_queue.put((warning_code, warning_message))
+	events.publish("warning", {"warning_code": warning_code, "warning_message": warning_message})
 
 def	current_milli_time():
 	return round(time.time() * 1000)
@@ -49,13 +55,22 @@ def	current_milli_time():
 @asynccontextmanager
 async def lifespan(app:	FastAPI):
 	print("Starting up...")
-	global lara
+	global lara, telemetry
+	start = time.perf_counter()
 	lara = Lara()
-	await lara.connect_socket()
-	print("Connected to the	robot")
-	lara.robot.turn_off_jog()
+	telemetry = TelemetryService(lara)
+	teach_postures()
+	robot_connection = asyncio.create_task(lara.connect())
+	posture_check = asyncio.create_task(asyncio.to_thread(lara.postures.validate, lara.robot))
+	lara.loop_lag.start()
+	events.start()
+	print(f"Started in {time.perf_counter() - start:.2f} s, connecting to the robot in the background")
 	yield
 	print("Shutting down...")
+	robot_connection.cancel()
+	posture_check.cancel()
+	await lara.close()
+	await asyncio.to_thread(config.save)
 
 app	= FastAPI(lifespan=lifespan)
 app.add_middleware(
@@ -71,125 +86,175 @@ class GenerateTrayRequest(BaseModel):
 	offset_y: Optional[float] =	0.0
 	offset_z: Optional[float] =	0.0
 
+async def queued(name, func, *args, preempt=False):
+	"""Runs a motion through lara's motion queue, cancelled motions are answered with an error."""
+	global lara
+	try:
+		return await lara.motions.submit(name, func, *args, preempt=preempt)
+	except MotionCancelled as e:
+		return {"error": str(e)}
+
 @app.get("/")
 def	read_root():
 	return RedirectResponse(url="/docs")
 
-class ConnectionManager:
-	def __init__(self):
-		self.active_connections: list[WebSocket] = []
-
-	async def connect(self, websocket: WebSocket):
-		await websocket.accept()
-		self.active_connections.append(websocket)
-
-	def disconnect(self, websocket: WebSocket):
-		self.active_connections.remove(websocket)
-
-	async def send_personal_message(self, message: str, websocket: WebSocket):
-		await websocket.send_text(message)
-
-	async def broadcast(self, message):
-		if not isinstance(message, str):
-			message = json.dumps(message)
-		for connection in self.active_connections.copy():
-			try:
-				await connection.send_text(message)
-			except (WebSocketDisconnect, RuntimeError):
-				self.disconnect(connection)
-
-manager = ConnectionManager()
-
 @app.websocket("/ws")
 async def websocket_endpoint(websocket: WebSocket):
-	global lara, threshold, is_paused
-	await manager.connect(websocket)
+	await websocket.accept()
+	# the hub's writer task sends to the client, reading here only notices it leaving
+	subscriber = events.subscribe(websocket.send_text, name=f"ws {websocket.client}", on_drop=websocket.close)
+	try:
+		while True:
+			await websocket.receive_text()
+	except WebSocketDisconnect:
+		pass
+	finally:
+		events.unsubscribe(subscriber)
+
 
+@app.websocket("/telemetry")
+async def telemetry_socket(websocket: WebSocket, rate: float = 10.0, encoding: str = "binary"):
+	"""
+	Pushes robot state at `rate` Hz from the socket.io stream, as binary frames (layout in the
+	first text message) or JSON keyframes and deltas. Sending {"rate": ..., "encoding": ...}
+	switches the stream.
+	"""
+	global telemetry
+	await websocket.accept()
+	stream = subscriber = None
+
+	async def attach(rate, encoding):
+		nonlocal stream, subscriber
+		if encoding not in ENCODINGS:
+			await websocket.send_text(json.dumps({"error": f"encoding must be one of {ENCODINGS}"}))
+			return False
+		if subscriber is not None:
+			stream.unsubscribe(subscriber_encoding, subscriber)
+		stream = telemetry.stream(rate)
+		header = {"rate": stream.rate, "encoding": encoding}
+		if encoding == "binary":
+			header["schema"] = BINARY_SCHEMA
+		await websocket.send_text(json.dumps(header))
+		send = websocket.send_bytes if encoding == "binary" else websocket.send_text
+		subscriber = stream.subscribe(encoding, send, f"telemetry {websocket.client}", on_drop=websocket.close)
+		return True
+
+	subscriber_encoding = encoding
 	try:
+		if not await attach(rate, encoding):
+			await websocket.close()
+			return
 		while True:
-			if not error_queue.empty():
-					error = error_queue.get()
-					await manager.broadcast({
-						"error": {
-							"error_code": error[0],
-							"error_message": error[1]
-						}
-					})
-			if not warning_queue.empty():
-				warning = warning_queue.get()
-				await manager.broadcast({
-					"warning": {
-						"warning_code": warning[0],
-						"warning_message": warning[1]
-					}
-				})
-			await asyncio.sleep(0.1)  # Adjust the sleep time as needed
+			try:
+				request = json.loads(await websocket.receive_text())
+			except ValueError:
+				continue
+			new_encoding = request.get("encoding", subscriber_encoding)
+			if await attach(request.get("rate", stream.rate), new_encoding):
+				subscriber_encoding = new_encoding
 	except WebSocketDisconnect:
-		manager.disconnect(websocket)
+		pass
+	finally:
+		if subscriber is not None:
+			stream.unsubscribe(subscriber_encoding, subscriber)
 
 
 @app.post("/setPause")
-def	set_pause(pause: bool):
+async def set_pause(pause: bool):
 	print("Setting pause to", pause)
 	global lara, is_paused
+	# pause/unpause must not wait behind queued motions
 	if pause:
-		lara.robot.pause()
+		await lara.motions.bypass("pause", lara.async_robot.pause)
 	else:
-		lara.robot.unpause()
+		await lara.motions.bypass("unpause", lara.async_robot.unpause)
 	is_paused =	pause
 	return {"is_paused": is_paused}
 
 @app.post("/changeMode")
-def	change_mode(mode: str):
+async def change_mode(mode: str):
 	global lara
 	mode = mode.lower()
 	if mode	== "teach":
-		lara.robot.set_mode("Teach")
+		await lara.async_robot.set_mode("Teach")
 	elif mode == "semiautomatic":
-		lara.robot.set_mode("SemiAutomatic")
+		await lara.async_robot.set_mode("SemiAutomatic")
 	elif mode == "automatic":
-		lara.robot.set_mode("Automatic")
+		await lara.async_robot.set_mode("Automatic")
 	else:
 		return {"error": "Invalid mode"}
-	return {"mode":	lara.robot.get_mode()}
+	return {"mode":	await lara.async_robot.get_mode()}
 
 @app.get("/mode")
-def	get_mode():
+async def get_mode():
 	global lara
-	return {"mode":	lara.robot.get_mode()}
+	return {"mode":	await lara.async_robot.get_mode()}
 
 @app.post("/resetRobot")
-def	reset_robot():
+async def reset_robot():
+	global lara
+	await lara.async_robot.reset_error()
+
+@app.get("/diagnostics")
+def	get_diagnostics():
+	global lara
+	monitor = lara.robot.monitor
+	return {"diagnostics": monitor.snapshot, "monitor": monitor.status(), "robot_ready": lara.robot.ready.done(), "robot_init_time": lara.robot.init_time, "pose_source": lara.last_pose_source, "controller": lara.controller.snapshot()}
+
+@app.get("/motions")
+async def get_motions():
 	global lara
-	lara.robot.reset_error()
+	return lara.motions.stats()
+
+@app.post("/motions/cancel")
+async def cancel_motions():
+	global lara
+	return {"cancelled": lara.motions.cancel_pending()}
+
+@app.get("/metrics")
+async def get_metrics():
+	global lara
+	return {**lara.metrics(), "events": events.stats(), "telemetry": telemetry.stats()}
+
+@app.post("/metrics/reset")
+async def reset_metrics():
+	global lara
+	lara.reset_metrics()
+	return {"status": "ok"}
 
 @app.get("/sim_or_emulation")
-def	sim_or_emulation():
+async def sim_or_emulation():
 	global lara
-	return {"context": lara.robot.get_sim_or_real()}
+	return {"context": await lara.async_robot.get_sim_or_real()}
 
 @app.post("/set_sim_or_emulation")
-def	set_sim_or_emulation(mode: str):
+async def set_sim_or_emulation(mode: str):
 	global lara
-	lara.robot.set_sim_real(mode)
-	return {"context": lara.robot.get_sim_or_real()}
+	await lara.async_robot.set_sim_real(mode)
+	return {"context": await lara.async_robot.get_sim_or_real()}
 
 tray = None
 socket_pose	= None
-
-try:
-	with open("config.json", "r") as f:
-		config = json.load(f)
-		if "socket_pose" in config:
-			socket_pose	= Pose.from_json(config["socket_pose"])
-			print("Loaded socket pose from config.json")
-		if "tray" in config:
-			tray = Tray.from_dict(config["tray"])
-			print("Loaded tray from	config.json")
-except FileNotFoundError:
-	pass
-except json.JSONDecodeError:
-	print("Invalid JSON	in config.json")
+# config.json parsed once, saved in the background when it changes
+config = ConfigStore("config.json")
+
+def	load_config():
+	global socket_pose, tray, target_camera_translation
+	socket_pose	= None
+	tray = None
+	target_camera_translation =	Vector3(-0.00033, -0.0033, 0)
+	if "socket_pose" in config:
+		socket_pose	= Pose.from_json(config.get("socket_pose"))
+		print("Loaded socket pose from config.json")
+	if "tray" in config:
+		tray = Tray.from_dict(config.get("tray"))
+		print("Loaded tray from	config.json")
+	if "target_camera_translation" in config:
+		tct	= config.get("target_camera_translation")
+		target_camera_translation =	Vector3(tct["x"], tct["y"],	tct["z"])
+		print("Loaded target_camera_translation	from config.json")
+	else:
+		print("Using default target_camera_translation")
 
 @app.post("/setAutonomousControl")
 def set_autonomous_control(autonomous_control: bool):
@@ -198,24 +263,13 @@ def set_autonomous_control(autonomous_control: bool):
 	return {"autonomous_control": autonomous_control_flag}
 
 @app.post("/setSocket")
-def	set_socket():
+async def set_socket():
 	global lara, socket_pose
 	socket_pose	= lara.pose
-	# Read existing	config or initialize empty
-	config_path	= "config.json"
-	if os.path.exists(config_path):
-		with open(config_path, "r")	as f:
-			try:
-				config = json.load(f)
-			except json.JSONDecodeError:
-				config = {}
-	else:
-		config = {}
-	# Update the socket_pose
-	config["socket_pose"] =	socket_pose.to_dict()
-	# Write	the	updated	config back	to the file
-	with open(config_path, "w")	as f:
-		json.dump(config, f, indent=4)
+	# written to config.json in the background
+	config.update(socket_pose=socket_pose.to_dict())
+	lara.postures.teach("socket", socket_pose.position)
+	await asyncio.to_thread(lara.postures.validate, lara.robot, ["socket"])
 	return socket_pose.to_dict()
 
 @app.get("/getSocket")
@@ -224,27 +278,15 @@ def	get_socket():
 	return socket_pose.to_dict()
 
 @app.post("/setTray")
-def	set_tray():
+async def set_tray():
 	global lara, tray
 	current_pose = lara.pose
 	tray = Tray(pose=current_pose)
-	# Read existing	config or initialize empty
-	config_path	= "config.json"
-	if os.path.exists(config_path):
-		with open(config_path, "r")	as f:
-			try:
-				config = json.load(f)
-			except json.JSONDecodeError:
-				config = {}
-	else:
-		config = {}
-	# Update the tray
-	config["tray"] = tray.to_dict()
-
-	# Write	the	updated	config back	to the file
-	with open(config_path, "w")	as f:
-		json.dump(config, f, indent=4)			
-	return tray.get_cell_positions()
+	config.update(tray=tray.to_dict())
+	lara.postures.teach("tray", tray.get_cell_robot_orientation(0, 0).position)
+	await asyncio.to_thread(lara.postures.validate, lara.robot, ["tray"])
+	# the cell poses are scipy rotations, slow enough to stall the loop
+	return await asyncio.to_thread(tray.get_cell_positions)
 
 @app.get("/getTray")
 def	get_tray():
@@ -256,130 +298,86 @@ def	rotate_vector(x, y, angle):
 	y_new =	x *	np.sin(angle) +	y *	np.cos(angle)
 	return x_new, y_new
 
-target_camera_translation =	Vector3(-0.00033, -0.0033, 0)
+target_camera_translation =	None
+load_config()
 
-# Try to load target_camera_translation	from config.json
-try:
-	with open("config.json", "r") as f:
-		config = json.load(f)
-		if "target_camera_translation" in config:
-			tct	= config["target_camera_translation"]
-			target_camera_translation =	Vector3(tct["x"], tct["y"],	tct["z"])
-			print("Loaded target_camera_translation	from config.json")
+def	teach_postures():
+	"""Approach postures of the stations in the config, validated later in the background."""
+	global lara
+	for station, pose in (("tray", tray.get_cell_robot_orientation(0, 0) if tray is not None else None), ("socket", socket_pose)):
+		if pose is None:
+			lara.postures.forget(station)
 		else:
-			print("Using default target_camera_translation")
-except FileNotFoundError:
-	print("config.json not found. Using	default	target_camera_translation")
-except json.JSONDecodeError:
-	print("Invalid JSON	in config.json.	Using default target_camera_translation")
+			lara.postures.teach(station, pose.position)
+
+@app.get("/config/versions")
+def	get_config_versions():
+	return {"current": config.version, "versions": config.versions()}
+
+@app.post("/config/rollback")
+def	rollback_config(version: int):
+	"""Restores socket pose, tray and camera translation from an earlier config.json version."""
+	try:
+		new_version = config.rollback(version)
+	except KeyError as e:
+		return {"error": str(e)}
+	load_config()
+	teach_postures()
+	return {"version": new_version}
 
 pose_correct = False
 @app.post("/moveToCell")
 async def move_to_cell(row: int = 0, col: int = 0):
 	global lara, socket_pose
-	error = await asyncio.to_thread(lara.move_to_pose, tray.get_cell_robot_orientation(row, col))
+	error = await queued("moveToCell", lara.move_to_pose, tray.get_cell_robot_orientation(row, col))
 	if error:
-		return {"error": error}
+		return error
 	return {"success": "Moved to cell"}
 
 
 
 @app.post("/to_tray")
 async def to_tray():
-	global lara, tray
-	cell_a0 = tray.get_cell_robot_orientation(0, 0)
-	cell_a0_position = cell_a0.position
-	#compute headint using x and y
-	heading_tray = np.arctan2(cell_a0_position.y, cell_a0_position.x)
-	current_joint_angles = await lara.async_robot.get_current_joint_angles()
-	lara.robot.set_mode("Automatic")
+	return await queued("to_tray", run_to_tray)
+
+async def run_to_tray():
+	global lara
 	try:
-		joint_property = {
-			"speed": 50.0,
-			"acceleration": 3.0,
-			"safety_toggle": True,
-			"target_joint": [
-				[
-					current_joint_angles[0],
-					current_joint_angles[1],
-					current_joint_angles[2],
-					current_joint_angles[3],
-					current_joint_angles[4],
-					current_joint_angles[5]
-				],
-				[
-					current_joint_angles[0],
-					-0.056414989727909474,
-					1.5068518732631686,
-					0.0006344149059273136,
-					1.6912666241349086,
-					2.322130079912925
-				],
-				[
-					heading_tray,
-					-0.056414989727909474,
-					1.5068518732631686,
-					0.0006344149059273136,
-					1.6912666241349086,
-					2.322130079912925
-				]
-				
-			],
-			"current_joint_angles":  lara.robot.get_current_joint_angles()
-		}
-		await asyncio.to_thread(lara.robot.move_joint, **joint_property)
-		lara.robot.stop() # if there are multiple motions than,this needs to be called only once at the end of the script
-		lara.robot.set_mode("Teach")
+		# posture cached when the tray was taught, one move_joint
+		await lara.transfer("tray")
 		return {"success": "ok"}
 	except Exception as e:
 		error = str(e)
 		emit_error(1, error)
 		return {"error": "IK Failure"}
 	
+@app.post("/to_home")
+async def to_home():
+	global lara
+	return await queued("to_home", run_to_home)
+
+async def run_to_home():
+	global lara
+	try:
+		await lara.transfer("home")
+		return {"success": "ok"}
+	except Exception as e:
+		emit_error(1, str(e))
+		return {"error": "IK Failure"}
+
+@app.get("/postures")
+def	get_postures():
+	global lara
+	return lara.postures.to_dict()
+
 @app.post("/to_socket")
 async def to_socket():
-	global lara, socket_pose
-	socket_position = socket_pose.position
-	heading_socket = np.arctan2(socket_position.y, socket_position.x)
-	current_joint_angles = await asyncio.to_thread(lara.robot.get_current_joint_angles)
-	await asyncio.to_thread(lara.robot.set_mode, "Automatic")
-	try: 
-		joint_property = {
-				"speed": 50.0,
-				"acceleration": 3.0,
-				"safety_toggle": True,
-				"target_joint": [
-					[
-						current_joint_angles[0],
-						current_joint_angles[1],
-						current_joint_angles[2],
-						current_joint_angles[3],
-						current_joint_angles[4],
-						current_joint_angles[5]
-					],
-					[
-						current_joint_angles[0],
-						-0.056414989727909474,
-						1.5068518732631686,
-						0.0006344149059273136,
-						1.6912666241349086,
-						2.322130079912925
-					],
-					[
-						heading_socket,
-						-0.056414989727909474,
-						1.5068518732631686,
-						0.0006344149059273136,
-						1.6912666241349086,
-						2.322130079912925
-					]
-					
-				],
-				"current_joint_angles":  lara.robot.get_current_joint_angles()
-			}
-		await asyncio.to_thread(lara.robot.move_joint, **joint_property)
-		lara.robot.stop()
-		lara.robot.set_mode("Teach")
+	return await queued("to_socket", run_to_socket)
+
+async def run_to_socket():
+	global lara
+	try:
+		await lara.transfer("socket")
 		return {"success": "ok"}
 	except Exception as e:
 		error = str(e)
@@ -394,7 +392,9 @@ async def retract(distance = -0.15):
 	if distance >= 0.0:
 		return {"error": "Distance must be negative"}
 	# lara.retract(distance)
-	await asyncio.to_thread(lara.retract, distance)
+	result = await queued("retract", lara.retract, distance)
+	if result is not None:
+		return result
 	threshold = threshold_default
 	unblock_pressure_flag = False
 	return {"success": "Retracted"}
@@ -402,8 +402,12 @@ async def retract(distance = -0.15):
 @app.post("/moveToCellRetract")
 async def move_to_cell_retract(row: int = 0, col: int = 0):
 	global lara, socket_pose
-	# lara.move_to_pose_from_retract(tray.get_cell_robot_orientation(row, col))
-	await asyncio.to_thread(lara.move_to_pose_from_retract, tray.get_cell_robot_orientation(row, col))
+	# queued waypoint moves are merged into one blended move_linear
+	waypoints = lara.approach_waypoints(tray.get_cell_robot_orientation(row, col), -0.3)
+	try:
+		await lara.motions.submit_waypoints("moveToCellRetract", lara.move_through, waypoints)
+	except MotionCancelled as e:
+		return {"error": str(e)}
 	return {"success": "Moved to cell and retracted"}
 
 @app.get("/getOffset")
@@ -413,11 +417,22 @@ def	get_offset():
 
 @app.post("/moveToSocketRetract")
 async def move_to_socket_retract():
+	return await queued("moveToSocketRetract", run_move_to_socket_retract)
+
+async def run_move_to_socket_retract(start: Pose = None):
 	global lara, socket_pose
 	try:
-		await asyncio.to_thread(lara.move_to_pose_tag_from_retract, socket_pose)
-		await lara.set_translation_speed_mms(4)
-		await lara.set_rotation_speed_degs(1)
+		await asyncio.to_thread(lara.move_to_pose_tag_from_retract, socket_pose, start)
+	except Exception as e:
+		return {"error": f"Error during first-time socket move: {str(e)}"}
+	return await align_to_socket()
+
+async def align_to_socket():
+	global lara
+	try:
+		# always sent, the camera service and the pendant change these speeds too
+		await lara.set_translation_speed_mms(4, force=True)
+		await lara.set_rotation_speed_degs(1, force=True)
 		loop = asyncio.get_running_loop()
 		def blocking_call():
 			return requests.post(
@@ -431,7 +446,7 @@ async def move_to_socket_retract():
 			#Response from AlignToTag: {"error":"No data received from the camera"}
 			return response_json
 		print(f"Response from AlignToTag: {response.text}")
-		set_socket()
+		await set_socket()
 	except Exception as e:
 		return {"error": f"Error during first-time socket move: {str(e)}"}
 
@@ -469,11 +484,15 @@ tag_pose : Pose = None
 
 @app.post("/moveToSocket")
 async def move_to_socket():
+	return await queued("moveToSocket", run_move_to_socket)
+
+async def run_move_to_socket():
 	global lara, socket_pose, firstTimeSocketMove, tag_pose
 	try:
 		await asyncio.to_thread(lara.move_to_pose_tag, socket_pose)
-		await lara.set_translation_speed_mms(4)
-		await lara.set_rotation_speed_degs(1)
+		# always sent, the camera service and the pendant change these speeds too
+		await lara.set_translation_speed_mms(4, force=True)
+		await lara.set_rotation_speed_degs(1, force=True)
 		loop = asyncio.get_running_loop()
 		def blocking_call():
 			return requests.post(
@@ -483,22 +502,17 @@ async def move_to_socket():
 		response = await loop.run_in_executor(None, blocking_call)
 		response.raise_for_status()  # Add this to check for HTTP errors
 		print(f"Response from AlignToTag: {response.text}")
-		set_socket()
+		await set_socket()
 		firstTimeSocketMove = False
 		return {"status": "First-time socket move completed successfully"}
 	except Exception as e:
 		emit_error(1, f"Error during first-time socket move: {str(e)}")
 		return {"error": f"Error during first-time socket move: {str(e)}"}
 	
-@app.get("/distance_to_socket")
-def distance_to_socket():
-	global lara, socket_pose
-	if socket_pose is None:
-		raise ValueError("Socket pose not set")
-	current_pose = lara.current_pose_raw()
-	dx = socket_pose.position.x - current_pose.position.x
-	dy = socket_pose.position.y - current_pose.position.y
-	dz = socket_pose.position.z - current_pose.position.z
+def distance_between(target: Pose, current_pose: Pose):
+	dx = target.position.x - current_pose.position.x
+	dy = target.position.y - current_pose.position.y
+	dz = target.position.z - current_pose.position.z
 	dxy = np.sqrt(dx**2 + dy**2)
 	distance = np.sqrt(dx**2 + dy**2 + dz**2)
 	return {
@@ -509,69 +523,108 @@ def distance_to_socket():
 		"dxy": dxy
 	}
 
+@app.get("/distance_to_socket")
+def distance_to_socket():
+	global lara, socket_pose
+	if socket_pose is None:
+		raise ValueError("Socket pose not set")
+	return distance_between(socket_pose, lara.current_pose_raw())
+
 @app.get("/distance_to_cell")
 def distance_to_cell(row: int = 0, col: int = 0):
 	global lara, tray
 	if tray is None:
 		raise ValueError("Tray not set")
-	cell_pose = tray.get_cell_robot_orientation(row, col)
-	current_pose = lara.current_pose_raw()
-	dx = cell_pose.position.x - current_pose.position.x
-	dy = cell_pose.position.y - current_pose.position.y
-	dz = cell_pose.position.z - current_pose.position.z
-	dxy = np.sqrt(dx**2 + dy**2)
-	distance = np.sqrt(dx**2 + dy**2 + dz**2)
-	return {
-		"distance": distance,
-		"dx": dx,
-		"dy": dy,
-		"dz": dz,
-		"dxy": dxy
-	}
+	return distance_between(tray.get_cell_robot_orientation(row, col), lara.current_pose_raw())
+
+@app.get("/snapshot")
+def snapshot():
+	global lara
+	return lara.snapshot().to_dict()
+
+def plan_legacy_smart_move(state, target: Pose, clearance=0.3, transfer_distance=0.5):
+	"""
+	The steps of the non-composite smart moves, all decided from one snapshot: (retract, transfer).
+	The transfer check uses the pose the retract will end at instead of reading it again.
+	"""
+	pose = state.pose
+	retract = pose.position.z < target.position.z + clearance
+	if retract:
+		pose = offset_along_normal(pose, -clearance)
+	transfer = distance_between(target, pose)["dxy"] > transfer_distance
+	return retract, transfer
 
 
+# the smart moves go as one blended Cartesian move_composite whose waypoints are checked with the
+# controller's IK first; an unreachable path, or composite=False, uses the joint space moves instead
 @app.post("/moveToSocketSmart")
-async def move_to_socket_smart():
+async def move_to_socket_smart(composite: bool = True, preempt: bool = False):
+	return await queued("moveToSocketSmart", run_move_to_socket_smart, composite, preempt=preempt)
+
+async def run_move_to_socket_smart(composite: bool = True):
 	global lara, socket_pose, firstTimeSocketMove, tag_pose
 	if socket_pose is None:
 		return {"error": "Socket pose not set"}
-	current_pose = lara.current_pose_raw()
-	#if we are at below the soocket pose in z plus 0.3 then we first retract 0.3m
-	if current_pose.position.z < socket_pose.position.z + 0.3:
-		await asyncio.to_thread(lara.retract, -0.3)
-	#we then check how far we are from the socket pose in x and y
-	distance = distance_to_socket()
-	if distance["dxy"] > 0.5:
-		#we use move to socket
-		await to_socket()
-	#finally we move to the socket pose without retracting
-	await move_to_socket_retract()
+	if composite:
+		# retract, transfer and approach to 0.15 m above the socket in one blended command
+		try:
+			await asyncio.to_thread(lara.smart_move, socket_pose, -0.15, False)
+		except UnreachablePath as e:
+			emit_warning(1, f"Composite move to socket refused, moving in joint space: {e}")
+		except Exception as e:
+			return {"error": f"Error during first-time socket move: {str(e)}"}
+		else:
+			await align_to_socket()
+			return {"success": "Moved to socket"}
+	state = await asyncio.to_thread(lara.snapshot)
+	# below the socket pose z plus 0.3 we first retract 0.3 m, further than 0.5 m in x and y we transfer
+	retract, transfer = plan_legacy_smart_move(state, socket_pose)
+	# one Automatic/Teach cycle for the retract and transfer; the alignment runs in the camera service
+	async with lara.async_motion_session():
+		if retract:
+			await asyncio.to_thread(lara.retract, -0.3, state.pose)
+		if transfer:
+			await run_to_socket()
+	#finally we move to the socket pose without retracting, from the snapshot pose if nothing moved
+	await run_move_to_socket_retract(None if retract or transfer else state.pose)
 	return {"success": "Moved to socket"}
 
 @app.post("/moveToCellSmart")
-async def move_to_cell_smart(row: int = 0, col: int = 0):
+async def move_to_cell_smart(row: int = 0, col: int = 0, composite: bool = True, preempt: bool = False):
+	return await queued("moveToCellSmart", run_move_to_cell_smart, row, col, composite, preempt=preempt)
+
+async def run_move_to_cell_smart(row: int = 0, col: int = 0, composite: bool = True):
 	global lara, socket_pose
 	cell_pose = tray.get_cell_robot_orientation(row, col)
 	if cell_pose is None:
 		return {"error": "Cell pose not set"}
-	current_pose = lara.current_pose_raw()
-	#if we are at below the cell pose in z plus 0.3 then we first retract 0.3m
-	if current_pose.position.z < cell_pose.position.z + 0.3:
-		await asyncio.to_thread(lara.retract, -0.3)
-	#we then check how far we are from the cell pose in x and y
-	distance = distance_to_cell(row, col)
-	if distance["dxy"] > 0.5:
-		#we use move to cell
-		await to_tray()
-	error = await asyncio.to_thread(lara.move_to_pose_from_retract, tray.get_cell_robot_orientation(row, col))
+	if composite:
+		try:
+			await asyncio.to_thread(lara.smart_move, cell_pose)
+		except UnreachablePath as e:
+			emit_warning(1, f"Composite move to cell refused, moving in joint space: {e}")
+		except Exception as e:
+			return {"error": str(e)}
+		else:
+			return {"success": "Moved to cell"}
+	state = await asyncio.to_thread(lara.snapshot)
+	retract, transfer = plan_legacy_smart_move(state, cell_pose)
+	# the controller stays in Automatic from the retract to the cell
+	async with lara.async_motion_session():
+		if retract:
+			await asyncio.to_thread(lara.retract, -0.3, state.pose)
+		if transfer:
+			await run_to_tray()
+		error = await asyncio.to_thread(lara.move_to_pose_from_retract, cell_pose, None if retract or transfer else state.pose)
 	if error:
 		return {"error": error}
 	return {"success": "Moved to cell"}
 
 @app.post("/EmergencyStop")
-def emergency_stop():
+async def emergency_stop():
 	global lara
-	lara.robot.power('off')
+	# never waits behind queued motions, and nothing queued runs after it
+	await lara.motions.bypass("EmergencyStop", lara.async_robot.power, 'off', cancel_pending=True)
 	emit_warning(1, "Emergency stop triggered")
 	return {"success": "Emergency stop"}
 
@@ -686,15 +739,15 @@ def	get_orientation_data():
 	return orientation
 
 @app.get("/getJointTorques")
-def	get_joint_torques():
+async def get_joint_torques():
 	global lara
-	torques =  lara.robot.get_current_joint_torques()
+	torques =  await lara.async_robot.get_current_joint_torques()
 	return {"torques": torques}
 
 @app.post("/TurnJogOff")
-def	turn_jog_off():
+async def turn_jog_off():
 	global lara
-	lara.robot.turn_off_jog()
+	await lara.async_robot.turn_off_jog()
 
 if __name__	== "__main__":
 	import uvicorn
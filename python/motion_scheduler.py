@@ -0,0 +1,210 @@
+import asyncio
+import time
+from collections import deque
+
+# Finished commands kept for stats()
+HISTORY = 200
+
+
+class MotionCancelled(Exception):
+	"""Raised to callers whose queued command was cancelled before it ran."""
+
+
+class MotionCommand:
+	def __init__(self, name, func, args, kwargs, waypoints=None):
+		self.name = name
+		self.func = func
+		self.args = args
+		self.kwargs = kwargs
+		# commands with waypoints run func(waypoints) and may be merged with the next ones
+		self.waypoints = waypoints
+		self.future = asyncio.get_running_loop().create_future()
+		self.enqueued_at = time.monotonic()
+		self.started_at = None
+		self.finished_at = None
+		self.status = "queued"
+
+	@property
+	def wait_time(self):
+		return None if self.started_at is None else self.started_at - self.enqueued_at
+
+	@property
+	def run_time(self):
+		return None if self.finished_at is None or self.started_at is None else self.finished_at - self.started_at
+
+
+class MotionScheduler:
+	"""
+	Runs robot motions one at a time in submission order on the event loop it was first used on.
+
+	submit() queues a command and returns its result once it ran; sync functions run in a worker
+	thread, coroutine functions are awaited. submit_waypoints() queues a Cartesian move through
+	fixed waypoints, consecutive waypoint moves still in the queue are merged into one blended
+	command. preempt=True cancels everything still queued first. bypass() runs stop/pause
+	style commands right away, next to whatever is queued or running.
+	Commands must not submit further commands, they would wait behind themselves.
+	"""
+	def __init__(self, history=HISTORY):
+		self.queue = deque()
+		self.running = None
+		self.history = deque(maxlen=history)
+		self.counts = {"completed": 0, "failed": 0, "cancelled": 0, "merged": 0, "bypassed": 0}
+		self._wakeup = None
+		self.task = None
+
+	def start(self):
+		if self.task is None or self.task.done():
+			self._wakeup = asyncio.Event()
+			if self.queue:
+				self._wakeup.set()
+			self.task = asyncio.get_running_loop().create_task(self.run())
+		return self.task
+
+	def stop(self):
+		if self.task is not None:
+			self.task.cancel()
+			self.task = None
+		self.cancel_pending("scheduler stopped")
+
+	@property
+	def depth(self):
+		return len(self.queue)
+
+	async def submit(self, name, func, *args, preempt=False, **kwargs):
+		return await self._enqueue(MotionCommand(name, func, args, kwargs), preempt)
+
+	async def submit_waypoints(self, name, move, waypoints, preempt=False):
+		"""Queues move(waypoints); returns once the (possibly merged) move finished."""
+		return await self._enqueue(MotionCommand(name, move, (), {}, waypoints=list(waypoints)), preempt)
+
+	async def _enqueue(self, command, preempt):
+		self.start()
+		if preempt:
+			self.cancel_pending(f"preempted by {command.name}")
+		self.queue.append(command)
+		self._wakeup.set()
+		return await command.future
+
+	def cancel_pending(self, reason="cancelled"):
+		"""Cancels every queued command that has not started. Returns how many were cancelled."""
+		cancelled = 0
+		while self.queue:
+			command = self.queue.popleft()
+			command.status = "cancelled"
+			command.finished_at = time.monotonic()
+			if not command.future.done():
+				command.future.set_exception(MotionCancelled(f"{command.name} {reason}"))
+			self.counts["cancelled"] += 1
+			self.history.append(command)
+			cancelled += 1
+		return cancelled
+
+	async def bypass(self, name, func, *args, cancel_pending=False, **kwargs):
+		"""Runs func right away without waiting for the queue, optionally cancelling the queued commands first."""
+		if cancel_pending:
+			self.cancel_pending(f"cancelled by {name}")
+		self.counts["bypassed"] += 1
+		start = time.monotonic()
+		try:
+			return await self._call(func, args, kwargs)
+		finally:
+			print(f"{name} bypassed the motion queue, took {(time.monotonic() - start) * 1000:.1f} ms")
+
+	@staticmethod
+	async def _call(func, args, kwargs):
+		if asyncio.iscoroutinefunction(func):
+			return await func(*args, **kwargs)
+		return await asyncio.to_thread(func, *args, **kwargs)
+
+	def _take(self):
+		command = self.queue.popleft()
+		if command.waypoints is None:
+			return command, []
+		merged = []
+		while self.queue and self.queue[0].waypoints is not None and self.queue[0].func == command.func:
+			merged.append(self.queue.popleft())
+		return command, merged
+
+	async def run(self):
+		while True:
+			if not self.queue:
+				self._wakeup.clear()
+				await self._wakeup.wait()
+				continue
+			command, merged = self._take()
+			group = [command] + merged
+			started = time.monotonic()
+			for item in group:
+				item.started_at = started
+				item.status = "running"
+			self.running = command
+			if merged:
+				self.counts["merged"] += len(merged)
+				waypoints = [waypoint for item in group for waypoint in item.waypoints]
+				args = (waypoints,)
+			elif command.waypoints is not None:
+				args = (command.waypoints,)
+			else:
+				args = command.args
+			try:
+				result = await self._call(command.func, args, command.kwargs)
+				error = None
+			except asyncio.CancelledError:
+				for item in group:
+					if not item.future.done():
+						item.future.set_exception(MotionCancelled(f"{item.name} interrupted"))
+				raise
+			except Exception as e:
+				result, error = None, e
+			finished = time.monotonic()
+			self.running = None
+			for item in group:
+				item.finished_at = finished
+				item.status = "failed" if error is not None else "completed"
+				self.counts[item.status] += 1
+				self.history.append(item)
+				if item.future.done():
+					continue
+				if error is not None:
+					item.future.set_exception(error)
+				else:
+					item.future.set_result(result)
+
+	def stats(self):
+		"""Queue depth, the running command and wait/run times per command name over the recent history."""
+		by_name = {}
+		for command in self.history:
+			entry = by_name.setdefault(command.name, {"count": 0, "wait_total": 0.0, "wait_max": 0.0, "run_total": 0.0, "run_max": 0.0, "runs": 0})
+			entry["count"] += 1
+			if command.wait_time is not None:
+				entry["wait_total"] += command.wait_time
+				entry["wait_max"] = max(entry["wait_max"], command.wait_time)
+			if command.run_time is not None:
+				entry["runs"] += 1
+				entry["run_total"] += command.run_time
+				entry["run_max"] = max(entry["run_max"], command.run_time)
+		commands = {
+			name: {
+				"count": entry["count"],
+				"wait_mean": entry["wait_total"] / entry["runs"] if entry["runs"] else None,
+				"wait_max": entry["wait_max"],
+				"run_mean": entry["run_total"] / entry["runs"] if entry["runs"] else None,
+				"run_max": entry["run_max"],
+			}
+			for name, entry in by_name.items()
+		}
+		running = None
+		if self.running is not None:
+			running = {"name": self.running.name, "running_for": time.monotonic() - self.running.started_at}
+		return {
+			"depth": self.depth,
+			"queued": [command.name for command in self.queue],
+			"running": running,
+			"counts": dict(self.counts),
+			"commands": commands,
+		}
+
+	def reset(self):
+		self.history.clear()
+		for key in self.counts:
+			self.counts[key] = 0
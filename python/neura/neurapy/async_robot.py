@@ -0,0 +1,344 @@
+import asyncio
+import socket
+import time
+import struct
+
+from .robot import (
+    FUNCTIONS,
+    Batch,
+    DiagnosticsMonitor,
+    POOLED,
+    POOL_SIZE,
+    POOL_CLOSES_BEFORE_ONE_SHOT,
+    CALL_TIMEOUT,
+    PIPELINE_PROBE_TIMEOUT,
+    ConnectionClosed,
+    ResponseReader,
+    can_resend,
+    neurapy_logger,
+    pipelining_setting,
+    probe_document,
+    notify_batch,
+    notify_listeners,
+    rpc_metrics,
+    unwrap_response,
+)
+from .codec import get_codec
+
+
+class AsyncConnection:
+    """An asyncio stream to the control box together with its response reader."""
+    def __init__(self, reader, writer, length_prefixed=False, codec=None):
+        self.stream_reader = reader
+        self.writer = writer
+        self.reader = ResponseReader(length_prefixed, codec=codec)
+
+    async def send(self, *documents):
+        if self.reader.length_prefixed:
+            documents = [struct.pack(">I", len(document)) + document for document in documents]
+        self.writer.write(b"".join(documents))
+        await self.writer.drain()
+
+    async def receive(self):
+        while True:
+            reply = self.reader.next_reply()
+            if reply is not None:
+                return reply
+            chunk = await self.stream_reader.read(self.reader.chunk_size)
+            if not chunk:
+                raise self.reader.eof()
+            self.reader.feed(chunk)
+
+    def is_closing(self):
+        return self.writer.is_closing() or self.stream_reader.at_eof()
+
+    def close(self):
+        self.writer.close()
+
+
+class AsyncConnectionPool:
+    """
+    asyncio counterpart of ConnectionPool, replacing closed connections and switching
+    to one-shot mode the same way. Idle connections belong to the event loop that
+    opened them and are dropped if the pool is used from a different loop.
+    """
+    def __init__(self, address, size=POOL_SIZE, persistent=True, length_prefixed=False, codec=None):
+        self.address = address
+        self.size = size
+        self.persistent = persistent
+        self.length_prefixed = length_prefixed
+        self.codec = codec
+        self.reuse_confirmed = False
+        # pooled connections found closed by the server since a reused one last answered
+        self.closes_in_a_row = 0
+        # whether the server answers documents written back to back, None until probed
+        self.pipelining = pipelining_setting()
+        self._idle = []
+        self._loop = None
+
+    async def _connect(self):
+        try:
+            if isinstance(self.address, str):
+                reader, writer = await asyncio.open_unix_connection(self.address)
+            else:
+                reader, writer = await asyncio.open_connection(*self.address)
+        except OSError:
+            raise ConnectionError("Failed to establish the communication to control box.Please cross check whether the robot is reachable or try reset control from Teach pendant")
+        sock = writer.get_extra_info("socket")
+        if sock is not None and sock.family != socket.AF_UNIX:
+            sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        return AsyncConnection(reader, writer, self.length_prefixed, self.codec)
+
+    async def acquire(self):
+        """Returns (connection, reused)."""
+        loop = asyncio.get_running_loop()
+        if loop is not self._loop:
+            self.close()
+            self._loop = loop
+        if self.persistent:
+            closed = False
+            while self._idle:
+                conn = self._idle.pop()
+                # drop connections the server closed while idle before writing a request to them
+                if not conn.is_closing():
+                    break
+                conn.close()
+                closed = True
+            else:
+                conn = None
+            # connections dropped after an idle timeout all count once
+            if closed:
+                self.closed_by_peer()
+            if conn is not None:
+                return conn, True
+        return await self._connect(), False
+
+    def release(self, conn):
+        if self.persistent and not conn.is_closing():
+            if len(self._idle) < self.size:
+                self._idle.append(conn)
+                return
+        elif self.persistent:
+            self.closed_by_peer()
+        conn.close()
+
+    def discard(self, conn):
+        conn.close()
+
+    def reused(self):
+        """A reused connection answered: the server keeps connections open."""
+        self.reuse_confirmed = True
+        self.closes_in_a_row = 0
+
+    def closed_by_peer(self):
+        """A pooled connection was closed by the server; enough of them in a row mean one-shot mode."""
+        self.closes_in_a_row += 1
+        if self.closes_in_a_row >= POOL_CLOSES_BEFORE_ONE_SHOT:
+            self.fall_back_to_one_shot()
+
+    def fall_back_to_one_shot(self):
+        if self.persistent:
+            neurapy_logger.info(f"Control box at {self.address} closes connections after each reply, using one-shot connections")
+        self.persistent = False
+        self.close()
+
+    def close(self):
+        idle, self._idle = self._idle, []
+        for conn in idle:
+            conn.close()
+
+
+def generate_coroutine(function_name):
+    async def wrapped_coroutine(self, *args, rpc_timeout=None, **kwargs):
+        return await self.call(function_name, *args, rpc_timeout=rpc_timeout, **kwargs)
+
+    wrapped_coroutine.__name__ = function_name + "_method"
+    return wrapped_coroutine
+
+
+class AsyncRobot:
+    """
+    asyncio client for the control box RPC, with the same method surface as Robot.
+    Every method is a coroutine and accepts an extra rpc_timeout keyword (seconds,
+    defaults to self.timeout). A call that times out or is cancelled closes its
+    connection, since the reply can no longer be matched to a request.
+    """
+    def __init__(self, address=("192.168.2.13", 65432), pooled=POOLED, length_prefixed=False, timeout=CALL_TIMEOUT, cache=None, codec=None, arrays=False, metrics=None):
+        self.address = address
+        self.metrics = rpc_metrics if metrics is None else metrics
+        # callables(function_name, args, kwargs, error) told about every completed call
+        self.listeners = []
+        self.codec = get_codec(codec) if codec is None or isinstance(codec, str) else codec
+        self.arrays = arrays
+        self.timeout = timeout
+        self.cache = cache
+        self.logger = neurapy_logger
+        self.last_call_stats = None
+        self._pool = AsyncConnectionPool(address, persistent=pooled, length_prefixed=length_prefixed, codec=self.codec)
+
+    async def call(self, function_name, *args, rpc_timeout=None, **kwargs):
+        self.logger.info(f"{function_name} called with args {args}, {kwargs}")
+        try:
+            response = await self.request(function_name, args, kwargs, rpc_timeout)
+            result = unwrap_response(self.logger, function_name, args, kwargs, response, self.arrays)
+        except Exception as e:
+            notify_listeners(self, function_name, args, kwargs, e)
+            raise
+        notify_listeners(self, function_name, args, kwargs)
+        return result
+
+    async def request(self, function_name, args, kwargs, rpc_timeout=None):
+        """Sends one call and returns the raw {"error", "result"} reply without unwrapping it."""
+        data = {"function": function_name, "args": args, "kwargs": kwargs}
+        timeout = self.timeout if rpc_timeout is None else rpc_timeout
+        with self.metrics.track(function_name) as timing:
+            with DiagnosticsMonitor.motion_context(self.address, function_name):
+                if self.cache is None:
+                    response, received, decode_time = await asyncio.wait_for(self._request(data, timing), timeout)
+                else:
+                    fetch = lambda: asyncio.wait_for(self._request(data, timing), timeout)
+                    response, received, decode_time = await self.cache.call_async(function_name, args, kwargs, fetch)
+            timing["error"] = bool(response.get("error"))
+        self.last_call_stats = {"function": function_name, "bytes": received, "decode_time": decode_time}
+        self.logger.debug(f"{function_name} reply: {received} bytes decoded in {decode_time * 1000:.2f} ms")
+        return response
+
+    async def _request(self, data, timing=None):
+        payload = self.codec.encode(data)
+        while True:
+            start = time.perf_counter()
+            conn, reused = await self._pool.acquire()
+            sent = time.perf_counter()
+            written = False
+            try:
+                await conn.send(payload)
+                written = True
+                reply = await conn.receive()
+            except (ConnectionClosed, ConnectionResetError, BrokenPipeError):
+                self._pool.discard(conn)
+                if not reused or not can_resend([data["function"]], written):
+                    raise
+                # the server dropped the idle connection before handling the request, try another one
+                self._pool.closed_by_peer()
+                continue
+            except BaseException:
+                self._pool.discard(conn)
+                raise
+            if timing is not None:
+                if not reused:
+                    timing["connect"] += sent - start
+                timing["server"] += time.perf_counter() - sent - reply[2]
+                timing["decode"] += reply[2]
+            if reused:
+                self._pool.reused()
+            self._pool.release(conn)
+            return reply
+
+    def batch(self):
+        return Batch(self)
+
+    async def _request_many(self, calls):
+        if not calls:
+            return
+        try:
+            if self.cache is not None and any(self.cache.invalidates(call.function_name) for call in calls):
+                self.cache.invalidate()
+                try:
+                    return await self._send_many(calls)
+                finally:
+                    self.cache.invalidate()
+            return await self._send_many(calls)
+        finally:
+            notify_batch(self, calls)
+
+    async def _pipelining(self):
+        """Whether batches may be written back to back, probing the server the first time."""
+        pool = self._pool
+        if not (pool.persistent and pool.reuse_confirmed) or pool.pipelining is False:
+            return False
+        if pool.pipelining is None:
+            pool.pipelining = await self._probe_pipelining()
+        return pool.pipelining
+
+    async def _probe_pipelining(self):
+        document = probe_document(self.codec)
+        conn, reused = await self._pool.acquire()
+        try:
+            await conn.send(document, document)
+            await asyncio.wait_for(conn.receive(), PIPELINE_PROBE_TIMEOUT)
+            await asyncio.wait_for(conn.receive(), PIPELINE_PROBE_TIMEOUT)
+        except (OSError, ValueError, asyncio.TimeoutError) as e:
+            self._pool.discard(conn)
+            self.logger.info(f"Control box at {self.address} does not answer pipelined requests ({e!r}), sending batches call by call")
+            return False
+        except BaseException:
+            self._pool.discard(conn)
+            raise
+        self._pool.release(conn)
+        return True
+
+    async def _send_many(self, calls):
+        if len(calls) == 1 or not await self._pipelining():
+            for call in calls:
+                timing = self.metrics.timing()
+                start = self.metrics.begin(call.function_name)
+                try:
+                    response, received, decode_time = await asyncio.wait_for(self._request(call.data, timing), self.timeout)
+                except Exception as e:
+                    call.set_error(e)
+                else:
+                    call.set_response(self.logger, response, self.arrays)
+                timing["error"] = call.failed
+                self.metrics.end(call.function_name, start, timing)
+            return
+        for call in calls:
+            self.logger.info(f"{call.function_name} batched with args {call.args}, {call.kwargs}")
+        documents = [self.codec.encode(call.data) for call in calls]
+        starts = [self.metrics.begin(call.function_name) for call in calls]
+        conn, reused = await self._pool.acquire()
+        answered = 0
+        written = False
+        try:
+            await conn.send(*documents)
+            written = True
+            last = time.perf_counter()
+            for call, start in zip(calls, starts):
+                response, received, decode_time = await asyncio.wait_for(conn.receive(), self.timeout)
+                call.set_response(self.logger, response, self.arrays)
+                # replies arrive in order, so each call waited on the server since the previous reply
+                now = time.perf_counter()
+                timing = dict(self.metrics.timing(), server=now - last - decode_time, decode=decode_time, error=call.failed)
+                last = now
+                self.metrics.end(call.function_name, start, timing)
+                answered += 1
+        except (ConnectionClosed, ConnectionResetError, BrokenPipeError) as e:
+            self._pool.discard(conn)
+            # a server that only seemed to pipeline gets its batches call by call from now on
+            self._pool.pipelining = False
+            if reused and answered == 0 and can_resend([call.function_name for call in calls], written):
+                # the server dropped the idle connection before handling the batch
+                for call in calls:
+                    self.metrics.cancel(call.function_name)
+                self._pool.closed_by_peer()
+                return await self._send_many(calls)
+            for call, start in zip(calls[answered:], starts[answered:]):
+                call.set_error(e)
+                self.metrics.end(call.function_name, start, dict(self.metrics.timing(), error=True))
+            return
+        except BaseException as e:
+            self._pool.discard(conn)
+            if isinstance(e, (OSError, asyncio.TimeoutError)):
+                self._pool.pipelining = False
+            for call, start in zip(calls[answered:], starts[answered:]):
+                self.metrics.end(call.function_name, start, dict(self.metrics.timing(), error=True))
+            raise
+        if reused:
+            self._pool.reused()
+        self._pool.release(conn)
+
+    def close(self):
+        self._pool.close()
+
+
+for _function in FUNCTIONS:
+    setattr(AsyncRobot, _function, generate_coroutine(_function))
@@ -0,0 +1,151 @@
+import json
+import os
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+# json (the default), orjson or msgpack; auto picks orjson when it is installed
+CODEC = os.getenv("NEURAPY_CODEC", "json")
+
+
+def _default(obj):
+    """Lets callers pass NumPy arrays and scalars as call arguments."""
+    if np is not None:
+        if isinstance(obj, np.ndarray):
+            return obj.tolist()
+        if isinstance(obj, np.generic):
+            return obj.item()
+    raise TypeError(f"Object of type {type(obj).__name__} is not serializable")
+
+
+class JsonCodec:
+    """The standard library codec, what the control box speaks."""
+    name = "json"
+    binary = False
+
+    def encode(self, obj):
+        return json.dumps(obj, default=_default).encode("utf-8")
+
+    def decode(self, data):
+        return json.loads(data)
+
+
+class OrjsonCodec(JsonCodec):
+    """
+    Same wire format as JsonCodec, encoded and decoded by orjson. orjson is stricter than the
+    json module (no NaN/Infinity, which the control box sends, and only str keys), so documents
+    it rejects go through JsonCodec instead.
+    """
+    name = "orjson"
+    OPTIONS = orjson.OPT_SERIALIZE_NUMPY if orjson is not None else 0
+
+    def encode(self, obj):
+        try:
+            return orjson.dumps(obj, default=_default, option=self.OPTIONS)
+        except orjson.JSONEncodeError:
+            return super().encode(obj)
+
+    def decode(self, data):
+        try:
+            return orjson.loads(data)
+        except orjson.JSONDecodeError:
+            return super().decode(data)
+
+
+class MsgpackCodec:
+    """
+    Binary codec for links we own (the robot gateway, local IPC). The control box only
+    speaks JSON. msgpack documents cannot be delimited by scanning, so connections
+    using this codec must be length-prefixed.
+    """
+    name = "msgpack"
+    binary = True
+
+    def encode(self, obj):
+        return msgpack.packb(obj, default=_default)
+
+    def decode(self, data):
+        return msgpack.unpackb(data)
+
+
+def get_codec(name=None):
+    """Returns the codec called name, defaulting to NEURAPY_CODEC."""
+    name = (name or CODEC).lower()
+    if name == "auto":
+        name = "orjson" if orjson is not None else "json"
+    if name == "json":
+        return JsonCodec()
+    if name == "orjson":
+        if orjson is None:
+            raise ImportError("orjson codec requested but orjson is not installed")
+        return OrjsonCodec()
+    if name == "msgpack":
+        if msgpack is None:
+            raise ImportError("msgpack codec requested but msgpack is not installed")
+        return MsgpackCodec()
+    raise ValueError(f"Unknown codec {name}")
+
+
+def codec_for_document(document):
+    """Guesses the codec of one length-prefixed document from its first byte."""
+    if document[:1] in (b"{", b"["):
+        return get_codec()
+    return get_codec("msgpack")
+
+
+def as_array(value):
+    """
+    Returns value as a float NumPy array when it is a flat or rectangular nested
+    list of numbers (joint angles, poses, ...), otherwise returns it unchanged.
+    """
+    if np is None or not isinstance(value, list) or not value:
+        return value
+    first = value[0]
+    if isinstance(first, list):
+        width = len(first)
+        if not all(isinstance(row, list) and len(row) == width and _numeric(row) for row in value):
+            return value
+    elif not _numeric(value):
+        return value
+    return np.asarray(value, dtype=float)
+
+
+def _numeric(values):
+    return all(isinstance(v, (int, float)) and not isinstance(v, bool) for v in values)
+
+
+class SocketioJson:
+    """
+    json module replacement for python-socketio packets, backed by orjson when available and
+    falling back to the json module for packets orjson rejects (see OrjsonCodec).
+    """
+    @staticmethod
+    def dumps(obj, *args, **kwargs):
+        if orjson is not None:
+            try:
+                return orjson.dumps(obj, default=_default, option=OrjsonCodec.OPTIONS).decode("utf-8")
+            except orjson.JSONEncodeError:
+                pass
+        kwargs.setdefault("default", _default)
+        return json.dumps(obj, *args, **kwargs)
+
+    @staticmethod
+    def loads(data, *args, **kwargs):
+        if orjson is not None:
+            try:
+                return orjson.loads(data)
+            except orjson.JSONDecodeError:
+                pass
+        return json.loads(data, *args, **kwargs)
@@ -1,15 +1,22 @@
+import copy
 import json
+import re
 import socket
+import struct
 import datetime
-from types import MethodType
 
 
 import logging
 import sys
 import os
 from logging.handlers import TimedRotatingFileHandler
-from threading import Thread
+from threading import Thread, Lock, Event
+from concurrent.futures import Future
+from contextlib import contextmanager, nullcontext
+from bisect import bisect_left
+import asyncio
 import time
+from .codec import as_array, get_codec
 
 OS = None
 if sys.platform == "linux":
@@ -23,9 +30,93 @@ VERSION = "v4.11.0-alpha.74"
     
 LOGLEVEL = os.getenv('NEURAPY_LOG_LEVEL', 'WARNING')
 
+# Diagnostics polling period while the robot moves, and while it is idle
 MONITOR_CYCLE_TIME = 0.1
+MONITOR_IDLE_CYCLE_TIME = float(os.getenv('NEURAPY_MONITOR_IDLE_CYCLE_TIME', '1.0'))
+# Keep polling fast for this long after the last motion command returned
+MONITOR_MOTION_HOLD_TIME = 2.0
 
-COUNTER = 0
+MOTION_FUNCTIONS = {
+    "move_joint",
+    "move_linear",
+    "move_circular",
+    "move_composite",
+    "move_linear_relative",
+    "move_linear_from_current_position",
+    "executor",
+    "record_path",
+    "jog",
+    "turn_on_jog",
+    "zero_g",
+}
+
+# Keep RPC sockets to the control box open between calls (falls back to one socket per call if the server closes them)
+POOLED = os.getenv('NEURAPY_POOLED', '1') == '1'
+POOL_SIZE = int(os.getenv('NEURAPY_POOL_SIZE', '4'))
+# Pooled connections the server has to close after a reply, with no reused connection answering in
+# between, before the pool switches to one socket per call (a single stale socket is just replaced)
+POOL_CLOSES_BEFORE_ONE_SHOT = 3
+# Batches are written back to back only to servers that answer pipelined requests: "auto" probes
+# the server with two reads first, "1" always pipelines, "0" never does
+PIPELINING = os.getenv('NEURAPY_PIPELINING', 'auto')
+# A read-only call sent twice in one write to probe pipelining, and how long to wait for both replies
+PIPELINE_PROBE = "get_mode"
+PIPELINE_PROBE_TIMEOUT = 2.0
+# Seconds a call waits on its socket before the connection counts as dead (motions block until they finish)
+CALL_TIMEOUT = float(os.getenv('NEURAPY_CALL_TIMEOUT', '300'))
+
+# Upper bounds in seconds of the RpcMetrics latency histogram buckets (motions can block for a long time)
+LATENCY_BUCKETS = (
+    0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5,
+    1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0, 300.0,
+)
+
+# Staleness bound in seconds for read-only calls that a ReadCache may answer without an RPC
+READ_CACHE_TTL = {
+    "get_tcp_pose_quaternion": 0.05,
+    "get_tcp_pose": 0.05,
+    "get_current_joint_angles": 0.05,
+    "robot_status": 0.05,
+    "get_current_joint_torques": 0.05,
+    "motion_status": 0.05,
+    "get_mode": 0.25,
+    "get_sim_or_real": 1.0,
+}
+
+# Read-only calls that are never cached but must not invalidate the cache either.
+# Every other call is treated as a command that may change the robot state.
+PASSIVE_FUNCTIONS = {
+    "initialize_attributes",
+    "get_diagnostics",
+    "get_errors",
+    "get_warnings",
+    "get_doc",
+    "get_tools",
+    "get_point",
+    "get_reference_frame",
+    "get_reference_frame_with_offset",
+    "get_encoder_offsets",
+    "get_linear_speed",
+    "get_zerog_status",
+    "read_safeio",
+    "program_status",
+    "rpy_to_quaternion",
+    "quaternion_to_rpy",
+    "ik_fk",
+    "compute_inverse_kinematics",
+    "encoder2rad",
+    "get_current_cartesian_pose",
+    "get_current_load_side_encoder_values",
+    "get_current_load_side_encoder2rade_values",
+    "get_flange_pose_quaternion",
+    "get_tool_flange_pose",
+    "plan_move_linear_relative",
+    "is_robot_in_automatic_mode",
+    "is_robot_in_collision",
+    "is_robot_in_semi_automatic_mode",
+    "is_robot_in_simulation",
+    "is_robot_in_teach_mode",
+}
 
 class CustomFormatter(logging.Formatter):
 
@@ -69,166 +160,1134 @@ def get_logger(logger_name):
 
 neurapy_logger = get_logger("neurapy_logger")
 
-def generate_function(function_name, address):
-    def wrapped_function(self, *args, **kwargs):
-        sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+class ConnectionClosed(ConnectionError):
+    """Raised when the control box closes a connection before sending a reply."""
+
+
+class ResponseReader:
+    """
+    Reads replies of any size from a stream socket, one document per call.
+    The control box sends bare JSON documents, so the reader only scans each new
+    chunk for structural characters to find where a document ends and decodes it
+    once. Peers that prefix every message with a 4 byte big-endian length
+    (length_prefixed=True) are read with exact-size receives instead.
+    Bytes received past the end of a document are kept for the next read.
+    Documents are decoded with codec; binary codecs need length_prefixed=True.
+    """
+    STRUCTURE = re.compile(rb'[{}\[\]"]')
+    STRING_END = re.compile(rb'["\\]')
+
+    def __init__(self, length_prefixed=False, chunk_size=65536, codec=None):
+        self.codec = codec or get_codec()
+        if self.codec.binary and not length_prefixed:
+            raise ValueError(f"The {self.codec.name} codec needs length-prefixed framing")
+        self.length_prefixed = length_prefixed
+        self.chunk_size = chunk_size
+        self._buffer = bytearray()
+        self._reset_scan()
+
+    def _reset_scan(self):
+        self._pos = 0
+        self._depth = 0
+        self._in_string = False
+
+    def feed(self, data):
+        self._buffer += data
+
+    def next_reply(self):
+        """Returns (response, received_bytes, decode_time), or None while the buffered reply is incomplete."""
+        if self.length_prefixed:
+            if len(self._buffer) < 4:
+                return None
+            (length,) = struct.unpack_from(">I", self._buffer)
+            if len(self._buffer) < 4 + length:
+                return None
+            document = bytes(self._buffer[4:4 + length])
+            received = 4 + length
+        else:
+            received = self._scan()
+            if received is None:
+                return None
+            document = bytes(self._buffer[:received])
+            self._reset_scan()
+        del self._buffer[:received]
+        start = time.perf_counter()
+        response = self.codec.decode(document)
+        return response, received, time.perf_counter() - start
+
+    def eof(self):
+        """Returns the exception to raise when the peer closes the stream mid-read."""
+        if not self._buffer:
+            return ConnectionClosed("Control box closed the connection before replying")
+        return ConnectionError(f"Control box closed the connection after {len(self._buffer)} bytes of an incomplete reply")
+
+    def read(self, sock):
+        """Blocks until a whole reply is received from sock. Returns (response, received_bytes, decode_time)."""
+        while True:
+            reply = self.next_reply()
+            if reply is not None:
+                return reply
+            chunk = sock.recv(self.chunk_size)
+            if not chunk:
+                raise self.eof()
+            self.feed(chunk)
+
+    def _scan(self):
+        buffer = self._buffer
+        while self._pos < len(buffer):
+            if self._in_string:
+                match = self.STRING_END.search(buffer, self._pos)
+                if match is None:
+                    self._pos = len(buffer)
+                elif match.group() == b'"':
+                    self._in_string = False
+                    self._pos = match.end()
+                elif match.end() < len(buffer):
+                    self._pos = match.end() + 1 # skip the escaped character
+                else:
+                    return None
+                continue
+            match = self.STRUCTURE.search(buffer, self._pos)
+            if match is None:
+                self._pos = len(buffer)
+                continue
+            self._pos = match.end()
+            char = match.group()
+            if char == b'"':
+                self._in_string = True
+            elif char in (b"{", b"["):
+                self._depth += 1
+            else:
+                self._depth -= 1
+                if self._depth == 0:
+                    return self._pos
+        return None
+
+
+def is_read_only(function_name):
+    """True for calls that do not change the robot state, which may be sent again after a lost reply."""
+    return function_name in READ_CACHE_TTL or function_name in PASSIVE_FUNCTIONS
+
+
+def can_resend(function_names, sent):
+    """
+    Whether calls that failed on a reused connection may be sent again on a new one: always if
+    the failure came before the request was written, otherwise only if they are all read-only,
+    since the control box may have run a command before the connection broke.
+    """
+    return not sent or all(is_read_only(name) for name in function_names)
+
+
+def pipelining_setting():
+    return {"1": True, "0": False}.get(PIPELINING)
+
+
+def probe_document(codec):
+    return codec.encode({"function": PIPELINE_PROBE, "args": [], "kwargs": {}})
+
+
+class Connection:
+    """A socket to the control box together with its response reader."""
+    def __init__(self, sock, length_prefixed=False, codec=None):
+        self.sock = sock
+        self.reader = ResponseReader(length_prefixed, codec=codec)
+
+    def send(self, *documents):
+        """Sends one or more encoded documents in a single write, framing each one if length-prefixed."""
+        if self.reader.length_prefixed:
+            documents = [struct.pack(">I", len(document)) + document for document in documents]
+        self.sock.sendall(b"".join(documents))
+
+    def receive(self):
+        return self.reader.read(self.sock)
+
+    def close(self):
         try:
-            sock.connect(address)
-        except ConnectionError:
+            self.sock.close()
+        except OSError:
+            pass
+
+
+class ConnectionPool:
+    """
+    Keeps long-lived sockets to the control box and hands them out per call.
+    Calls never wait for a free socket: when every pooled socket is busy a new one
+    is opened and closed again on release if the pool is already full.
+    A pooled socket the server closed is dropped and replaced. If the server turns out
+    to close connections after each reply (POOL_CLOSES_BEFORE_ONE_SHOT closes with no
+    reused socket answering in between), the pool switches to one-shot mode and every
+    call opens its own socket as before.
+    """
+    def __init__(self, address, size=POOL_SIZE, persistent=True, length_prefixed=False, codec=None):
+        self.address = address
+        self.size = size
+        self.persistent = persistent
+        self.length_prefixed = length_prefixed
+        self.codec = codec
+        # set once a reused connection has answered, i.e. the server keeps connections open
+        self.reuse_confirmed = False
+        # pooled connections found closed by the server since a reused one last answered
+        self.closes_in_a_row = 0
+        # whether the server answers documents written back to back, None until probed
+        self.pipelining = pipelining_setting()
+        self._idle = []
+        self._lock = Lock()
+
+    def _connect(self):
+        try:
+            if isinstance(self.address, str):
+                # a Unix socket path, e.g. a local gateway
+                sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+                sock.settimeout(CALL_TIMEOUT)
+                sock.connect(self.address)
+            else:
+                sock = socket.create_connection(self.address, timeout=CALL_TIMEOUT)
+                sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        except OSError:
             raise ConnectionError("Failed to establish the communication to control box.Please cross check whether the robot is reachable or try reset control from Teach pendant")
+        return Connection(sock, self.length_prefixed, self.codec)
+
+    def acquire(self):
+        """Returns (connection, reused)."""
+        if self.persistent:
+            closed = False
+            with self._lock:
+                while self._idle:
+                    conn = self._idle.pop()
+                    # drop sockets the server closed while idle before writing a request to them
+                    if not self._peer_closed(conn.sock):
+                        break
+                    conn.close()
+                    closed = True
+                else:
+                    conn = None
+            # sockets dropped after an idle timeout all count once
+            if closed:
+                self.closed_by_peer()
+            if conn is not None:
+                return conn, True
+        return self._connect(), False
+
+    def release(self, conn):
+        if self.persistent and not self._peer_closed(conn.sock):
+            with self._lock:
+                if len(self._idle) < self.size:
+                    self._idle.append(conn)
+                    return
+        elif self.persistent:
+            self.closed_by_peer()
+        conn.close()
+
+    def discard(self, conn):
+        conn.close()
+
+    def reused(self):
+        """A reused connection answered: the server keeps connections open."""
+        self.reuse_confirmed = True
+        self.closes_in_a_row = 0
+
+    def closed_by_peer(self):
+        """A pooled connection was closed by the server; enough of them in a row mean one-shot mode."""
+        self.closes_in_a_row += 1
+        if self.closes_in_a_row >= POOL_CLOSES_BEFORE_ONE_SHOT:
+            self.fall_back_to_one_shot()
+
+    def fall_back_to_one_shot(self):
+        if self.persistent:
+            neurapy_logger.info(f"Control box at {self.address} closes connections after each reply, using one-shot connections")
+        self.persistent = False
+        self.close()
+
+    def close(self):
+        with self._lock:
+            idle, self._idle = self._idle, []
+        for conn in idle:
+            conn.close()
+
+    @staticmethod
+    def _peer_closed(sock):
+        timeout = sock.gettimeout()
         try:
-            if OS == 'linux':
-                signal.signal(signal.SIGINT,lambda signal, frame: self.stop())
-                signal.signal(signal.SIGHUP,lambda signal, frame: self.stop())
+            sock.setblocking(False)
+            try:
+                return sock.recv(1, socket.MSG_PEEK) == b""
+            finally:
+                sock.settimeout(timeout)
+        except BlockingIOError:
+            return False
+        except OSError:
+            return True
+
+
+FUNCTIONS = [
+    "move_joint",
+    "move_linear",
+    "move_circular",
+    "move_composite",
+    "record_path",
+    "power",
+    "zero_g",
+    "io",
+    "set_tool",
+    "gripper",
+    "wait",
+    "override",
+    "pause",
+    "unpause",
+    "stop",
+    "ik_fk",
+    "robot_status",
+    "program_status",
+    "get_point",
+    "initialize_attributes",
+    "set_mode",
+    "motion_status",
+    "get_mode",
+    "get_zerog_status",
+    "rpy_to_quaternion",
+    "quaternion_to_rpy",
+    "get_tcp_pose",
+    "get_reference_frame",
+    "get_doc",
+    "get_reference_frame_with_offset",
+    "set_encoder_offsets",
+    "set_opcua_msg",
+    "turn_on_jog",
+    "turn_off_jog",
+    "jog",
+    "read_safeio",
+    "get_encoder_offsets",
+    "get_sim_or_real",
+    "move_linear_from_current_position",
+    "get_tools",
+    "get_encoder_offsets",
+    "set_sim_real",
+    "reset_error",
+    "reset_warnings",
+    "get_diagnostics",
+    "get_errors",
+    "get_warnings",
+    "wait",
+    "wait_for_digital_input",
+    "wait_for_digital_input_timer_on_delay",
+    "wait_for_digital_input_timer_off_delay",
+    "wait_for_analog_input",
+    "wait_for_tool_digital_input",
+    "wait_for_tool_digital_input_timer_on_delay",
+    "wait_for_tool_digital_input_timer_off_delay",
+    "wait_for_tool_analog_input",
+    "set_linear_speed",
+    "get_linear_speed",
+    "disable_collision_detection",
+    "disable_reflex",
+    "enable_collision_detection",
+    "enable_reflex",
+    "encoder2rad",
+    "get_tcp_pose_quaternion",
+    "get_current_joint_torques",
+    "is_robot_in_automatic_mode",
+    "is_robot_in_collision",
+    "is_robot_in_semi_automatic_mode",
+    "is_robot_in_simulation",
+    "is_robot_in_teach_mode",
+    "motion_status",
+    "move_linear_relative",
+    "quaternion_to_rpy",
+    "rpy_to_quaternion",
+    "set_joint_speed",
+    "set_linear_acceleration",
+    "set_current_position_as_zero",
+    "get_current_load_side_encoder_values",
+    "get_current_load_side_encoder2rade_values",
+    "get_current_cartesian_pose",
+    "get_tcp_pose_quaternion",
+    "quaternion_to_rpy",
+    "program_status",
+    "compute_inverse_kinematics",
+    "get_flange_pose_quaternion",
+    "get_tool_flange_pose",
+    "plan_move_linear_relative",
+    "get_current_joint_angles",
+    "executor"
+]
+
+
+def unwrap_response(logger, function_name, args, kwargs, response, arrays=False):
+    if response["error"]:
+        if "Not Enough Points in Target" in response["error"]:
+            logger.warning(f"{function_name} called with args {args}, {kwargs} returned warning: {response['error']}")
+        else:
+            logger.error(f"{function_name} call with args {args}, {kwargs} failed with exception {response['error']}")
+        raise Exception(response["error"])
+    if arrays:
+        return as_array(response["result"])
+    return response["result"]
+
+
+def notify_listeners(client, function_name, args, kwargs, error=None):
+    """Passes a completed call to the client's listeners; error is the exception if the call failed."""
+    for listener in client.listeners:
+        try:
+            listener(function_name, args, kwargs, error)
+        except Exception as e:
+            client.logger.warning(f"Call listener failed for {function_name}: {e}")
+
+
+def notify_batch(client, calls):
+    for call in calls:
+        if call.done:
+            notify_listeners(client, call.function_name, call.args, call.kwargs, call._error)
+
+
+class RpcMetrics:
+    """
+    Per-function call counters, error counts, in-flight gauges and latency histograms.
+
+    Latencies go into fixed buckets (LATENCY_BUCKETS), so recording is O(1) and
+    p50/p95/p99 are interpolated within the bucket they fall into. Besides the
+    total latency the time spent connecting, waiting for the server and decoding
+    the reply is summed per function; calls answered by a ReadCache have none.
+    All clients of a process share rpc_metrics unless given their own.
+    """
+    def __init__(self, buckets=LATENCY_BUCKETS):
+        self.buckets = tuple(buckets)
+        self._functions = {}
+        self._lock = Lock()
+        self.started = time.time()
+
+    def _entry(self, function_name):
+        entry = self._functions.get(function_name)
+        if entry is None:
+            entry = self._functions[function_name] = {
+                "count": 0,
+                "errors": 0,
+                "in_flight": 0,
+                "total_time": 0.0,
+                "max_time": 0.0,
+                "connect_time": 0.0,
+                "server_time": 0.0,
+                "decode_time": 0.0,
+                "histogram": [0] * (len(self.buckets) + 1),
+            }
+        return entry
+
+    @staticmethod
+    def timing():
+        """The per-call record the transport adds its connect/server/decode times to."""
+        return {"connect": 0.0, "server": 0.0, "decode": 0.0, "error": False}
+
+    def begin(self, function_name):
+        """Marks a call as in flight and returns its start time for end()."""
+        with self._lock:
+            self._entry(function_name)["in_flight"] += 1
+        return time.perf_counter()
+
+    def end(self, function_name, start, timing):
+        latency = time.perf_counter() - start
+        index = bisect_left(self.buckets, latency)
+        with self._lock:
+            entry = self._entry(function_name)
+            entry["in_flight"] -= 1
+            entry["count"] += 1
+            entry["errors"] += bool(timing["error"])
+            entry["total_time"] += latency
+            entry["max_time"] = max(entry["max_time"], latency)
+            entry["histogram"][index] += 1
+            for key in ("connect", "server", "decode"):
+                entry[key + "_time"] += timing[key]
+
+    def cancel(self, function_name):
+        """Drops an in-flight call without recording it, e.g. before it is retried."""
+        with self._lock:
+            self._entry(function_name)["in_flight"] -= 1
+
+    @contextmanager
+    def track(self, function_name):
+        """Records the call made in the block, as an error if the block raises or sets timing["error"]."""
+        timing = self.timing()
+        start = self.begin(function_name)
+        try:
+            yield timing
+        except BaseException:
+            timing["error"] = True
+            raise
+        finally:
+            self.end(function_name, start, timing)
+
+    def percentile(self, histogram, fraction):
+        count = sum(histogram)
+        if count == 0:
+            return None
+        rank = fraction * count
+        seen = 0
+        for index, hits in enumerate(histogram):
+            if hits and seen + hits >= rank:
+                lower = self.buckets[index - 1] if index > 0 else 0.0
+                if index == len(self.buckets):
+                    return lower # beyond the last bucket
+                return lower + (self.buckets[index] - lower) * (rank - seen) / hits
+            seen += hits
+        return self.buckets[-1]
+
+    def snapshot(self):
+        """Per-function metrics, sorted by the total time spent in each function."""
+        with self._lock:
+            entries = {name: dict(entry, histogram=list(entry["histogram"])) for name, entry in self._functions.items()}
+        functions = {}
+        for name, entry in sorted(entries.items(), key=lambda item: item[1]["total_time"], reverse=True):
+            count = entry["count"]
+            histogram = entry.pop("histogram")
+            entry["mean_time"] = entry["total_time"] / count if count else None
+            for key, fraction in (("p50", 0.50), ("p95", 0.95), ("p99", 0.99)):
+                value = self.percentile(histogram, fraction)
+                entry[key] = None if value is None else min(value, entry["max_time"])
+            entry["histogram"] = dict(zip([str(bound) for bound in self.buckets] + ["inf"], histogram))
+            functions[name] = entry
+        return {
+            "since": self.started,
+            "calls": sum(entry["count"] for entry in functions.values()),
+            "errors": sum(entry["errors"] for entry in functions.values()),
+            "in_flight": sum(entry["in_flight"] for entry in functions.values()),
+            "functions": functions,
+        }
+
+    def reset(self):
+        """Clears the counters, e.g. to measure a single cell cycle. In-flight gauges are kept."""
+        with self._lock:
+            in_flight = {name: entry["in_flight"] for name, entry in self._functions.items() if entry["in_flight"]}
+            self._functions = {}
+            for name, value in in_flight.items():
+                self._entry(name)["in_flight"] = value
+            self.started = time.time()
+
+
+rpc_metrics = RpcMetrics()
+
+
+class ReadCache:
+    """
+    Short-lived cache for read-only RPCs with single-flight coalescing.
+
+    Calls listed in ttl are answered from the cache while their last reply is
+    younger than the bound, and concurrent identical reads share one in-flight
+    request. Any call that is neither cached nor in PASSIVE_FUNCTIONS (motions,
+    set_mode, stop, jog, ...) clears the cache before and after it runs.
+    Every caller gets its own copy of the reply, so mutating a result cannot
+    change what other callers read. One ReadCache can be shared by a Robot and
+    an AsyncRobot.
+    """
+    def __init__(self, ttl=None):
+        self.ttl = dict(READ_CACHE_TTL if ttl is None else ttl)
+        self.hits = 0
+        self.misses = 0
+        self.coalesced = 0
+        # monotonic time of the last command, state observed before it is stale
+        self.invalidated_at = 0.0
+        self._entries = {}
+        self._inflight = {}
+        self._async_inflight = {}
+        self._generation = 0
+        self._lock = Lock()
+
+    def cacheable(self, function_name):
+        return self.ttl.get(function_name, 0) > 0
+
+    def invalidates(self, function_name):
+        return function_name not in self.ttl and function_name not in PASSIVE_FUNCTIONS
+
+    def invalidate(self):
+        with self._lock:
+            self._generation += 1
+            self.invalidated_at = time.monotonic()
+            self._entries.clear()
+            self._inflight.clear()
+            self._async_inflight.clear()
+
+    @staticmethod
+    def _key(function_name, args, kwargs):
+        return function_name + json.dumps([args, kwargs], sort_keys=True, default=str)
+
+    @staticmethod
+    def _copy(reply):
+        response, received, decode_time = reply
+        return copy.deepcopy(response), received, decode_time
+
+    def _fresh(self, key, function_name):
+        entry = self._entries.get(key)
+        if entry is not None and time.monotonic() - entry[0] < self.ttl[function_name]:
+            self.hits += 1
+            return self._copy(entry[1])
+        return None
+
+    def _store(self, key, generation, started, reply, inflight, future):
+        with self._lock:
+            if inflight.get(key) is future:
+                del inflight[key]
+            if generation == self._generation and not reply[0]["error"]:
+                self._entries[key] = (started, reply)
+
+    def call(self, function_name, args, kwargs, fetch):
+        """Returns fetch() or a cached reply of it. fetch performs the actual request."""
+        if not self.cacheable(function_name):
+            if not self.invalidates(function_name):
+                return fetch()
+            self.invalidate()
+            try:
+                return fetch()
+            finally:
+                self.invalidate()
+        key = self._key(function_name, args, kwargs)
+        with self._lock:
+            reply = self._fresh(key, function_name)
+            if reply is not None:
+                return reply
+            future = self._inflight.get(key)
+            if future is not None:
+                self.coalesced += 1
+                owner = False
             else:
-                win32api.SetConsoleCtrlHandler(self.stop, True)
+                self.misses += 1
+                future = Future()
+                self._inflight[key] = future
+                generation = self._generation
+                owner = True
+        if not owner:
+            return self._copy(future.result())
+        started = time.monotonic()
+        try:
+            reply = fetch()
+        except BaseException as e:
+            self._store(key, -1, started, None, self._inflight, future)
+            future.set_exception(e)
+            raise
+        # the entry and the waiters get a copy of their own, the caller keeps the reply
+        shared = self._copy(reply)
+        self._store(key, generation, started, shared, self._inflight, future)
+        future.set_result(shared)
+        return reply
+
+    async def call_async(self, function_name, args, kwargs, fetch):
+        """Coroutine version of call; fetch is a coroutine function."""
+        if not self.cacheable(function_name):
+            if not self.invalidates(function_name):
+                return await fetch()
+            self.invalidate()
+            try:
+                return await fetch()
+            finally:
+                self.invalidate()
+        key = self._key(function_name, args, kwargs)
+        with self._lock:
+            reply = self._fresh(key, function_name)
+            if reply is not None:
+                return reply
+            future = self._async_inflight.get(key)
+            if future is not None:
+                self.coalesced += 1
+                owner = False
+            else:
+                self.misses += 1
+                future = asyncio.get_running_loop().create_future()
+                self._async_inflight[key] = future
+                generation = self._generation
+                owner = True
+        if not owner:
+            return self._copy(await asyncio.shield(future))
+        started = time.monotonic()
+        try:
+            reply = await fetch()
+        except BaseException as e:
+            self._store(key, -1, started, None, self._async_inflight, future)
+            if isinstance(e, asyncio.CancelledError):
+                future.cancel()
+            else:
+                future.set_exception(e)
+                future.exception() # retrieved here so an unawaited future does not log a warning
+            raise
+        shared = self._copy(reply)
+        self._store(key, generation, started, shared, self._async_inflight, future)
+        future.set_result(shared)
+        return reply
+
+    def stats(self):
+        return {"hits": self.hits, "misses": self.misses, "coalesced": self.coalesced, "entries": len(self._entries)}
+
+
+class DiagnosticsMonitor:
+    """
+    Polls get_diagnostics for one control box and shares the result with every Robot
+    in the process, instead of each Robot running its own poller.
+
+    Polling runs every MONITOR_CYCLE_TIME while a motion command is in flight (and
+    for MONITOR_MOTION_HOLD_TIME after it) and every MONITOR_IDLE_CYCLE_TIME otherwise.
+    Subscribers are called from the polling thread as callback(snapshot, changed_keys)
+    whenever the diagnostics change.
+    """
+    _monitors = {}
+    _monitors_lock = Lock()
+
+    def __init__(self, address, fetch):
+        self.address = address
+        self.snapshot = None
+        self.last_update = None
+        self.polls = 0
+        self._fetch = fetch
+        self._subscribers = []
+        self._lock = Lock()
+        self._motions = 0
+        self._fast_until = 0.0
+        self._wake = Event()
+        self._critical_counter = 0
+        self.thread = Thread(target=self._run, daemon=True)
+
+    @classmethod
+    def for_robot(cls, robot):
+        """Returns the running monitor for robot's control box, starting one on first use."""
+        with cls._monitors_lock:
+            monitor = cls._monitors.get(robot.address)
+            if monitor is None:
+                monitor = cls(robot.address, robot.get_diagnostics)
+                cls._monitors[robot.address] = monitor
+                monitor.thread.start()
+            return monitor
+
+    @classmethod
+    def motion_context(cls, address, function_name):
+        """Context manager that switches the monitor of address to fast polling around a motion call."""
+        monitor = cls._monitors.get(address)
+        if monitor is None or function_name not in MOTION_FUNCTIONS:
+            return nullcontext()
+        return monitor.motion()
+
+    @contextmanager
+    def motion(self):
+        with self._lock:
+            self._motions += 1
+        self._wake.set()
+        try:
+            yield
+        finally:
+            with self._lock:
+                self._motions -= 1
+                self._fast_until = time.monotonic() + MONITOR_MOTION_HOLD_TIME
+
+    def notify_motion(self):
+        """Polls fast for MONITOR_MOTION_HOLD_TIME, for motions started outside the RPC (jog, sliders)."""
+        with self._lock:
+            self._fast_until = time.monotonic() + MONITOR_MOTION_HOLD_TIME
+        self._wake.set()
+
+    @property
+    def cycle_time(self):
+        if self._motions > 0 or time.monotonic() < self._fast_until:
+            return MONITOR_CYCLE_TIME
+        return MONITOR_IDLE_CYCLE_TIME
+
+    @property
+    def last_update_age(self):
+        """Seconds since the last successful poll, None before the first one."""
+        if self.last_update is None:
+            return None
+        return time.monotonic() - self.last_update
+
+    def subscribe(self, callback):
+        """Registers callback(snapshot, changed_keys). Returns a function that unsubscribes it."""
+        with self._lock:
+            self._subscribers.append(callback)
+        def unsubscribe():
+            with self._lock:
+                if callback in self._subscribers:
+                    self._subscribers.remove(callback)
+        return unsubscribe
+
+    def _run(self):
+        while True:
+            self._wake.clear()
+            try:
+                diagnostics = self._fetch()
+            except Exception as e:
+                neurapy_logger.warning(f"Diagnostics poll failed: {e}")
+            else:
+                self._publish(diagnostics)
+            self._wake.wait(self.cycle_time)
+
+    def _publish(self, diagnostics):
+        self.polls += 1
+        self.last_update = time.monotonic()
+        previous, self.snapshot = self.snapshot, diagnostics
+        if isinstance(diagnostics, dict) and diagnostics.get("critical"):
+            self._critical_counter += 1
+            if self._critical_counter > 10000:
+                neurapy_logger.error(f"{diagnostics}")
+                self._critical_counter = 0
+        if previous == diagnostics:
+            return
+        if isinstance(diagnostics, dict) and isinstance(previous, dict):
+            changed = {key for key in diagnostics.keys() | previous.keys() if diagnostics.get(key) != previous.get(key)}
+        else:
+            changed = set(diagnostics) if isinstance(diagnostics, dict) else set()
+        with self._lock:
+            subscribers = list(self._subscribers)
+        for callback in subscribers:
+            try:
+                callback(diagnostics, changed)
+            except Exception as e:
+                neurapy_logger.warning(f"Diagnostics subscriber {callback} failed: {e}")
+
+    def status(self):
+        return {
+            "address": self.address if isinstance(self.address, str) else list(self.address),
+            "cycle_time": self.cycle_time,
+            "last_update_age": self.last_update_age,
+            "polls": self.polls,
+            "subscribers": len(self._subscribers),
+        }
+
+
+class BatchCall:
+    """The pending reply of one call queued in a Batch."""
+    def __init__(self, function_name, args, kwargs):
+        self.function_name = function_name
+        self.args = args
+        self.kwargs = kwargs
+        self.done = False
+        self._value = None
+        self._error = None
+
+    @property
+    def data(self):
+        return {"function": self.function_name, "args": self.args, "kwargs": self.kwargs}
+
+    def set_response(self, logger, response, arrays=False):
+        try:
+            self._value = unwrap_response(logger, self.function_name, self.args, self.kwargs, response, arrays)
         except Exception as e:
-            self.logger.warning("Not attaching signal handlers")
-            
+            self._error = e
+        self.done = True
+
+    def set_error(self, error):
+        self._error = error
+        self.done = True
+
+    @property
+    def failed(self):
+        return self._error is not None
+
+    def result(self):
+        if not self.done:
+            raise RuntimeError(f"{self.function_name} has not been sent yet, leave the batch block first")
+        if self._error is not None:
+            raise self._error
+        return self._value
+
+
+class Batch:
+    """
+    Collects calls and sends them to the control box together, one round trip for the whole batch.
+
+    Each queued call returns a BatchCall whose result() is available once the block exits:
+
+        with robot.batch() as batch:
+            joints = batch.get_current_joint_angles()
+            batch.set_mode("Automatic")
+        joints.result()
+
+    AsyncRobot.batch() is used the same way with "async with".
+    All requests are written before any reply is read, so later calls run on the
+    control box even if an earlier one fails; only queue calls that do not depend
+    on each other's outcome. Until the server has shown that it keeps connections
+    open, the calls are sent one after another instead.
+    """
+    def __init__(self, robot):
+        self._robot = robot
+        self.calls = []
+
+    def __getattr__(self, name):
+        if name not in FUNCTIONS:
+            raise AttributeError(name)
+        def queue(*args, **kwargs):
+            call = BatchCall(name, args, kwargs)
+            self.calls.append(call)
+            return call
+        return queue
+
+    def flush(self):
+        calls, self.calls = self.calls, []
+        return self._robot._request_many(calls)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.flush()
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            await self.flush()
+
+
+def generate_function(function_name):
+    def wrapped_function(self, *args, **kwargs):
         self.logger.info(f"{function_name} called with args {args}, {kwargs}")
         data = {"function": function_name, "args": args, "kwargs": kwargs}
-        sock.sendall(json.dumps(data).encode("utf-8"))
-        new_data = sock.recv(4096)
-        sock.close()
-        response = json.loads(new_data.decode("utf-8"))
-        if response["error"]:
-            if "Not Enough Points in Target" in response["error"]:
-                self.logger.warning(f"{function_name} called with args {args}, {kwargs} returned warning: {response['error']}")
-            else:
-                self.logger.error(f"{function_name} call with args {args}, {kwargs} failed with exception {response['error']}")
-            raise Exception(response["error"])
-        return response["result"]
+        try:
+            with self.metrics.track(function_name) as timing:
+                with DiagnosticsMonitor.motion_context(self.address, function_name):
+                    if self.cache is None:
+                        response, received, decode_time = self._request(data, timing)
+                    else:
+                        response, received, decode_time = self.cache.call(function_name, args, kwargs, lambda: self._request(data, timing))
+                self.last_call_stats = {"function": function_name, "bytes": received, "decode_time": decode_time}
+                self.logger.debug(f"{function_name} reply: {received} bytes decoded in {decode_time * 1000:.2f} ms")
+                result = unwrap_response(self.logger, function_name, args, kwargs, response, self.arrays)
+        except Exception as e:
+            notify_listeners(self, function_name, args, kwargs, e)
+            raise
+        notify_listeners(self, function_name, args, kwargs)
+        return result
 
     wrapped_function.__name__ = function_name + "_method"
     return wrapped_function
 
 
 class Robot:
-    def __init__(self):
-        self.__server_address = ("192.168.2.13", 65432)
-        self.__functions = [
-            "move_joint",
-            "move_linear",
-            "move_circular",
-            "move_composite",
-            "record_path",
-            "power",
-            "zero_g",
-            "io",
-            "set_tool",
-            "gripper",
-            "wait",
-            "override",
-            "pause",
-            "unpause",
-            "stop",
-            "ik_fk",
-            "robot_status",
-            "program_status",
-            "get_point",
-            "initialize_attributes",
-            "set_mode",
-            "motion_status",
-            "get_mode",
-            "get_zerog_status",
-            "rpy_to_quaternion",
-            "quaternion_to_rpy",
-            "get_tcp_pose",
-            "get_reference_frame",
-            "get_doc",
-            "get_reference_frame_with_offset",
-            "set_encoder_offsets",
-            "set_opcua_msg",
-            "turn_on_jog",
-            "turn_off_jog",
-            "jog",
-            "read_safeio",
-            "get_encoder_offsets",
-            "get_sim_or_real",
-            "move_linear_from_current_position",
-            "get_tools",
-            "get_encoder_offsets",
-            "set_sim_real",
-            "reset_error",
-            "reset_warnings",
-            "get_diagnostics",
-            "get_errors",
-            "get_warnings",
-            "wait",
-            "wait_for_digital_input",
-            "wait_for_digital_input_timer_on_delay",
-            "wait_for_digital_input_timer_off_delay",
-            "wait_for_analog_input",
-            "wait_for_tool_digital_input",
-            "wait_for_tool_digital_input_timer_on_delay",
-            "wait_for_tool_digital_input_timer_off_delay",
-            "wait_for_tool_analog_input",
-            "set_linear_speed",
-            "get_linear_speed",
-            "disable_collision_detection",
-            "disable_reflex",
-            "enable_collision_detection",
-            "enable_reflex",
-            "encoder2rad",
-            "get_tcp_pose_quaternion",
-            "get_current_joint_torques",
-            "is_robot_in_automatic_mode",
-            "is_robot_in_collision",
-            "is_robot_in_semi_automatic_mode",
-            "is_robot_in_simulation",
-            "is_robot_in_teach_mode",
-            "motion_status",
-            "move_linear_relative",
-            "quaternion_to_rpy",
-            "rpy_to_quaternion",
-            "set_joint_speed",
-            "set_linear_acceleration",
-            "set_current_position_as_zero",
-            "get_current_load_side_encoder_values",
-            "get_current_load_side_encoder2rade_values",
-            "get_current_cartesian_pose",
-            "get_tcp_pose_quaternion",
-            "quaternion_to_rpy",
-            "program_status",
-            "compute_inverse_kinematics",
-            "get_flange_pose_quaternion",
-            "get_tool_flange_pose",
-            "plan_move_linear_relative",
-            "get_current_joint_angles",
-            "executor"
-        ]
+    """
+    Client for the control box RPC. RPC methods can be called right after
+    construction; the attributes reported by initialize_attributes (version, ...)
+    are loaded by _initialize. With background_init=True that happens in a thread
+    so constructing a Robot does not wait on the control box; self.ready resolves
+    once it is done and reading one of those attributes before then waits for it.
+    A failed initialization is tried again by the next wait_ready or attribute read.
+    codec picks the serializer (see codec.get_codec). With arrays=True, replies
+    that are lists of numbers (joint angles, poses) are returned as NumPy arrays.
+    Calls are recorded in metrics, the process-wide rpc_metrics by default.
+    """
+    def __init__(self, address=("192.168.2.13", 65432), pooled=POOLED, length_prefixed=False, cache=None, background_init=False, codec=None, arrays=False, metrics=None):
+        self.__server_address = address
+        self.address = address
+        self.metrics = rpc_metrics if metrics is None else metrics
+        # callables(function_name, args, kwargs, error) told about every completed call
+        self.listeners = []
+        self.codec = get_codec(codec) if codec is None or isinstance(codec, str) else codec
+        self.arrays = arrays
+        self._pool = ConnectionPool(address, persistent=pooled, length_prefixed=length_prefixed, codec=self.codec)
+        self.last_call_stats = None
+        self.cache = cache
+        self.__functions = FUNCTIONS
         self.logger = neurapy_logger
-        
-        for function in self.__functions:
-            setattr(
-                self,
-                function,
-                MethodType(generate_function(function, self.__server_address), self),
-            )
-
-        for key, value in self.initialize_attributes().items():
-            setattr(self, key, value)
-        self.logger.info(f"Robot initialized with following functions {self.__functions} and robot version {self.version}")
-        if self.version != VERSION:
-            self.logger.warning("Current client version is not compatiable with the version of the server running on the robot. Some of the functionlities specified in the documentation might not work in the intended way. Please upgrade to the correct version .Client Version : {VERSION},Server Version : {self.version}")
+        self.init_time = None
+        self._init_lock = Lock()
+        self.ready = Future()
+        self._attach_signal_handlers()
         self.start_diagnostics_monitor()
-        
+        if background_init:
+            Thread(target=self._initialize, daemon=True).start()
+        else:
+            self._initialize()
+            self.ready.result()
+
+    def _initialize(self):
+        start = time.perf_counter()
+        try:
+            attributes = self.initialize_attributes()
+            for key, value in attributes.items():
+                setattr(self, key, value)
+            # the reply as received, for the gateway to answer its clients' initialize_attributes with
+            self.attributes = attributes
+        except Exception as e:
+            self.logger.error(f"Robot initialization failed: {e}")
+            self.ready.set_exception(e)
+            return
+        self.init_time = time.perf_counter() - start
+        version = self.__dict__.get("version")
+        self.logger.info(f"Robot initialized in {self.init_time:.2f} s with following functions {self.__functions} and robot version {version}")
+        if version != VERSION:
+            self.logger.warning("Current client version is not compatiable with the version of the server running on the robot. Some of the functionlities specified in the documentation might not work in the intended way. Please upgrade to the correct version .Client Version : {VERSION},Server Version : {self.version}")
+        self.ready.set_result(self)
+
+    def wait_ready(self, timeout=None):
+        """
+        Blocks until the robot attributes are loaded and returns self. If the last initialization
+        failed it is started again; raises its error if that one fails too.
+        """
+        with self._init_lock:
+            ready = self.ready
+            if ready.done() and ready.exception() is not None:
+                self.ready = ready = Future()
+                Thread(target=self._initialize, daemon=True).start()
+        return ready.result(timeout)
+
+    def __getattr__(self, name):
+        # only reached for missing attributes, i.e. ones initialize_attributes has not set yet
+        ready = self.__dict__.get("ready")
+        if ready is None or name.startswith("__"):
+            raise AttributeError(name)
+        try:
+            self.wait_ready()
+        except Exception as e:
+            # an AttributeError keeps hasattr and getattr with a default working while the control box is away
+            raise AttributeError(f"'Robot' object has no attribute '{name}', initialization failed: {e}") from e
+        try:
+            return self.__dict__[name]
+        except KeyError:
+            raise AttributeError(f"'Robot' object has no attribute '{name}'") from None
+
+    def _attach_signal_handlers(self):
+        try:
+            if OS == 'linux':
+                signal.signal(signal.SIGINT,lambda signal, frame: self.stop())
+                signal.signal(signal.SIGHUP,lambda signal, frame: self.stop())
+            else:
+                win32api.SetConsoleCtrlHandler(self.stop, True)
+        except Exception as e:
+            self.logger.warning("Not attaching signal handlers")
+
+    def _request(self, data, timing=None):
+        payload = self.codec.encode(data)
+        while True:
+            start = time.perf_counter()
+            conn, reused = self._pool.acquire()
+            sent = time.perf_counter()
+            written = False
+            try:
+                conn.send(payload)
+                written = True
+                reply = conn.receive()
+            except (ConnectionClosed, ConnectionResetError, BrokenPipeError):
+                self._pool.discard(conn)
+                if not reused or not can_resend([data["function"]], written):
+                    raise
+                # the server dropped the idle socket before handling the request, try another one
+                self._pool.closed_by_peer()
+                continue
+            except BaseException:
+                self._pool.discard(conn)
+                raise
+            if timing is not None:
+                if not reused:
+                    timing["connect"] += sent - start
+                timing["server"] += time.perf_counter() - sent - reply[2]
+                timing["decode"] += reply[2]
+            if reused:
+                self._pool.reused()
+            self._pool.release(conn)
+            return reply
+
+    def batch(self):
+        return Batch(self)
+
+    def _request_many(self, calls):
+        if not calls:
+            return
+        try:
+            if self.cache is not None and any(self.cache.invalidates(call.function_name) for call in calls):
+                self.cache.invalidate()
+                try:
+                    return self._send_many(calls)
+                finally:
+                    self.cache.invalidate()
+            return self._send_many(calls)
+        finally:
+            notify_batch(self, calls)
+
+    def _pipelining(self):
+        """Whether batches may be written back to back, probing the server the first time."""
+        pool = self._pool
+        if not (pool.persistent and pool.reuse_confirmed) or pool.pipelining is False:
+            return False
+        if pool.pipelining is None:
+            pool.pipelining = self._probe_pipelining()
+        return pool.pipelining
+
+    def _probe_pipelining(self):
+        document = probe_document(self.codec)
+        conn, reused = self._pool.acquire()
+        timeout = conn.sock.gettimeout()
+        try:
+            conn.sock.settimeout(PIPELINE_PROBE_TIMEOUT)
+            conn.send(document, document)
+            conn.receive()
+            conn.receive()
+        except (OSError, ValueError) as e:
+            self._pool.discard(conn)
+            self.logger.info(f"Control box at {self.address} does not answer pipelined requests ({e!r}), sending batches call by call")
+            return False
+        conn.sock.settimeout(timeout)
+        self._pool.release(conn)
+        return True
+
+    def _send_many(self, calls):
+        if len(calls) == 1 or not self._pipelining():
+            for call in calls:
+                timing = self.metrics.timing()
+                start = self.metrics.begin(call.function_name)
+                try:
+                    response, received, decode_time = self._request(call.data, timing)
+                except Exception as e:
+                    call.set_error(e)
+                else:
+                    call.set_response(self.logger, response, self.arrays)
+                timing["error"] = call.failed
+                self.metrics.end(call.function_name, start, timing)
+            return
+        for call in calls:
+            self.logger.info(f"{call.function_name} batched with args {call.args}, {call.kwargs}")
+        documents = [self.codec.encode(call.data) for call in calls]
+        starts = [self.metrics.begin(call.function_name) for call in calls]
+        conn, reused = self._pool.acquire()
+        answered = 0
+        written = False
+        try:
+            conn.send(*documents)
+            written = True
+            last = time.perf_counter()
+            for call, start in zip(calls, starts):
+                response, received, decode_time = conn.receive()
+                call.set_response(self.logger, response, self.arrays)
+                # replies arrive in order, so each call waited on the server since the previous reply
+                now = time.perf_counter()
+                timing = dict(self.metrics.timing(), server=now - last - decode_time, decode=decode_time, error=call.failed)
+                last = now
+                self.metrics.end(call.function_name, start, timing)
+                answered += 1
+        except (ConnectionClosed, ConnectionResetError, BrokenPipeError) as e:
+            self._pool.discard(conn)
+            # a server that only seemed to pipeline gets its batches call by call from now on
+            self._pool.pipelining = False
+            if reused and answered == 0 and can_resend([call.function_name for call in calls], written):
+                # the server dropped the idle socket before handling the batch
+                for call in calls:
+                    self.metrics.cancel(call.function_name)
+                self._pool.closed_by_peer()
+                return self._send_many(calls)
+            for call, start in zip(calls[answered:], starts[answered:]):
+                call.set_error(e)
+                self.metrics.end(call.function_name, start, dict(self.metrics.timing(), error=True))
+            return
+        except BaseException as e:
+            self._pool.discard(conn)
+            if isinstance(e, OSError):
+                self._pool.pipelining = False
+            for call, start in zip(calls[answered:], starts[answered:]):
+                self.metrics.end(call.function_name, start, dict(self.metrics.timing(), error=True))
+            raise
+        if reused:
+            self._pool.reused()
+        self._pool.release(conn)
+
+    def close(self):
+        self._pool.close()
+
     def help(self, name):
         print(self.get_doc(name))
         
-    def notify_diagnostics(self):
-        global COUNTER
-        while True:
-            diagnostics = self.get_diagnostics()
-            if "critical" in diagnostics:
-                if diagnostics["critical"]:
-                    COUNTER += 1
-                    if COUNTER > 10000:
-                        self.logger.error(f"{diagnostics}")
-                        COUNTER = 0
-            time.sleep(MONITOR_CYCLE_TIME)
-        
     def start_diagnostics_monitor(self):
-        self.monitor = Thread(target=self.notify_diagnostics)
-        self.monitor.daemon = True
-        self.monitor.start()
\ No newline at end of file
+        self.monitor = DiagnosticsMonitor.for_robot(self)
+
+
+for _function in FUNCTIONS:
+    setattr(Robot, _function, generate_function(_function))
@@ -0,0 +1,107 @@
+import numpy as np
+
+# Joints 2-6 of the posture transfers pass through, arm folded above the base
+SAFE_POSTURE = [-0.056414989727909474, 1.5068518732631686, 0.0006344149059273136, 1.6912666241349086, 2.322130079912925]
+TRANSFER_SPEED = 50.0
+TRANSFER_ACCELERATION = 3.0
+# A posture is valid if its TCP ends up at least this high above the station it approaches (m)
+MIN_CLEARANCE = 0.1
+
+
+class ApproachPosture:
+	"""Joint targets above one station: the safe posture with the base turned towards it."""
+	def __init__(self, name, heading, target=None):
+		self.name = name
+		self.heading = float(heading)
+		self.target = target
+		self.joints = [self.heading] + SAFE_POSTURE
+		# TCP pose of the posture from the controller's forward kinematics, set by validate()
+		self.tcp = None
+		self.valid = None
+
+	def transfer_property(self, current_joint_angles, speed=TRANSFER_SPEED, acceleration=TRANSFER_ACCELERATION):
+		"""move_joint property from current_joint_angles: fold in place, then turn the base to the station."""
+		current = [float(angle) for angle in current_joint_angles]
+		return {
+			"speed": speed,
+			"acceleration": acceleration,
+			"safety_toggle": True,
+			"target_joint": [
+				current,
+				[current[0]] + SAFE_POSTURE,
+				self.joints,
+			],
+			"current_joint_angles": current,
+		}
+
+	def to_dict(self):
+		return {"heading": self.heading, "joints": self.joints, "tcp": self.tcp, "valid": self.valid}
+
+
+class PostureLibrary:
+	"""
+	Approach postures by station name (tray, socket, home), computed once when the station is
+	taught instead of on every transfer. validate() checks them with the controller's forward
+	kinematics. get() refuses postures that failed validation until a later validate() passes;
+	postures not validated yet (the controller could not be asked) are returned, as every
+	posture was before there was a check.
+	"""
+	def __init__(self):
+		self.postures = {}
+		self.teach_heading("home", 0.0)
+
+	def teach(self, name, position):
+		"""Posture above a station at position (Vector3 in the base frame)."""
+		posture = ApproachPosture(name, np.arctan2(position.y, position.x), position)
+		self.postures[name] = posture
+		return posture
+
+	def teach_heading(self, name, heading):
+		posture = ApproachPosture(name, heading)
+		self.postures[name] = posture
+		return posture
+
+	def forget(self, name):
+		self.postures.pop(name, None)
+
+	def validated(self, name):
+		posture = self.postures.get(name)
+		return posture is not None and posture.valid is True
+
+	def get(self, name) -> ApproachPosture:
+		posture = self.postures.get(name)
+		if posture is None:
+			raise KeyError(f"No approach posture for {name}, teach the station first")
+		if posture.valid is False:
+			raise ValueError(f"The approach posture for {name} failed validation")
+		return posture
+
+	def validate(self, robot, names=None):
+		"""
+		Checks the postures not validated yet, or that failed before, with robot.ik_fk("fk").
+		Returns {name: valid}. Blocks on the RPC, call it from a thread in async code.
+		"""
+		results = {}
+		for name in names or list(self.postures):
+			posture = self.postures.get(name)
+			if posture is None or posture.valid:
+				continue
+			# a failed posture is unvalidated again until the controller answers
+			posture.valid = None
+			try:
+				tcp = robot.ik_fk("fk", target_angle=posture.joints)
+			except Exception as e:
+				print(f"Could not validate the {name} posture: {e}")
+				continue
+			tcp = [float(value) for value in np.ravel(tcp)]
+			posture.tcp = tcp
+			posture.valid = bool(np.all(np.isfinite(tcp))) and len(tcp) >= 3
+			if posture.valid and posture.target is not None:
+				posture.valid = tcp[2] >= posture.target.z + MIN_CLEARANCE
+			if not posture.valid:
+				print(f"The {name} approach posture does not clear its station: {tcp}")
+			results[name] = posture.valid
+		return results
+
+	def to_dict(self):
+		return {name: posture.to_dict() for name, posture in self.postures.items()}
@@ -0,0 +1,167 @@
+import argparse
+import asyncio
+import os
+import socket
+import struct
+import time
+from neura.neurapy.robot import Robot, ReadCache, ResponseReader, MONITOR_IDLE_CYCLE_TIME
+from neura.neurapy.async_robot import AsyncRobot
+from neura.neurapy.codec import get_codec, codec_for_document
+
+CONTROL_BOX_ADDRESS = ("192.168.2.13", 65432)
+GATEWAY_ADDRESS = ("127.0.0.1", 65433)
+# ROBOT_GATEWAY="off" disables the gateway, "host:port" or a Unix socket path overrides its address
+GATEWAY_ENV = "ROBOT_GATEWAY"
+
+# Commands that must never wait behind queued commands from other clients
+BYPASS_FUNCTIONS = {"stop", "pause", "unpause", "power", "reset_error", "turn_off_jog"}
+
+
+def gateway_address():
+	"""Address of the local gateway as configured by ROBOT_GATEWAY, None if disabled."""
+	value = os.getenv(GATEWAY_ENV, "")
+	if value.lower() in ("off", "0", "false"):
+		return None
+	if not value:
+		return GATEWAY_ADDRESS
+	if ":" in value and not value.startswith("/"):
+		host, port = value.rsplit(":", 1)
+		return (host, int(port))
+	return value
+
+
+def resolve_robot_address(timeout=0.2):
+	"""
+	Returns the gateway address if a gateway is listening, otherwise the control box address,
+	so processes keep working when the gateway is not running.
+	"""
+	address = gateway_address()
+	if address is None:
+		return CONTROL_BOX_ADDRESS
+	try:
+		if isinstance(address, str):
+			probe = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+			probe.settimeout(timeout)
+			probe.connect(address)
+		else:
+			probe = socket.create_connection(address, timeout=timeout)
+		probe.close()
+		print(f"Using robot gateway at {address}")
+		return address
+	except OSError:
+		return CONTROL_BOX_ADDRESS
+
+
+class RobotGateway:
+	"""
+	Owns the connections to the control box for every local process.
+
+	Clients connect with a normal Robot/AsyncRobot pointed at the gateway address and
+	get the same method surface. Each client connection is served in order, so
+	pipelined batches keep working. Across clients, reads are coalesced through one
+	ReadCache, commands are sent one at a time in arrival order (except the
+	BYPASS_FUNCTIONS), and get_diagnostics / initialize_attributes are answered
+	locally from the gateway's own monitor and robot.
+	Messages may be bare JSON or 4 byte length-prefixed JSON or msgpack; the gateway
+	answers in the framing and codec the client used.
+	"""
+	def __init__(self, control_box_address=CONTROL_BOX_ADDRESS):
+		self.cache = ReadCache()
+		self.robot = Robot(address=control_box_address, cache=self.cache)
+		self.async_robot = AsyncRobot(address=control_box_address, cache=self.cache)
+		# loaded while constructing self.robot
+		self.attributes = self.robot.attributes
+		self.command_lock = asyncio.Lock()
+		self.clients = 0
+		self.requests = 0
+
+	async def handle_request(self, data):
+		function_name = data.get("function")
+		args = data.get("args", [])
+		kwargs = data.get("kwargs", {})
+		self.requests += 1
+		if function_name == "initialize_attributes":
+			return {"error": None, "result": self.attributes}
+		if function_name == "get_diagnostics":
+			monitor = self.robot.monitor
+			age = monitor.last_update_age
+			if age is not None and age < 2 * MONITOR_IDLE_CYCLE_TIME:
+				return {"error": None, "result": monitor.snapshot}
+		try:
+			if self.cache.invalidates(function_name) and function_name not in BYPASS_FUNCTIONS:
+				async with self.command_lock:
+					return await self.async_robot.request(function_name, args, kwargs)
+			return await self.async_robot.request(function_name, args, kwargs)
+		except Exception as e:
+			return {"error": f"Gateway failed to reach the control box: {e}", "result": None}
+
+	async def serve_client(self, reader, writer):
+		self.clients += 1
+		parser = None
+		try:
+			while True:
+				if parser is None:
+					first = await reader.read(65536)
+					if not first:
+						return
+					# JSON documents start with "{" (possibly after whitespace), anything else is a
+					# length header followed by a JSON or msgpack document
+					if first.lstrip()[:1] == b"{":
+						parser = ResponseReader(codec=get_codec())
+					else:
+						while len(first) < 5:
+							chunk = await reader.read(65536)
+							if not chunk:
+								return
+							first += chunk
+						parser = ResponseReader(length_prefixed=True, codec=codec_for_document(first[4:]))
+					parser.feed(first)
+				reply = parser.next_reply()
+				if reply is None:
+					chunk = await reader.read(parser.chunk_size)
+					if not chunk:
+						return
+					parser.feed(chunk)
+					continue
+				request, received, decode_time = reply
+				response = parser.codec.encode(await self.handle_request(request))
+				if parser.length_prefixed:
+					response = struct.pack(">I", len(response)) + response
+				writer.write(response)
+				await writer.drain()
+		except (ConnectionError, asyncio.IncompleteReadError):
+			pass
+		finally:
+			self.clients -= 1
+			writer.close()
+
+	def status(self):
+		return {
+			"clients": self.clients,
+			"requests": self.requests,
+			"cache": self.cache.stats(),
+			"diagnostics": self.robot.monitor.status(),
+		}
+
+
+async def run_gateway(address, control_box_address=CONTROL_BOX_ADDRESS):
+	start = time.perf_counter()
+	gateway = RobotGateway(control_box_address)
+	if isinstance(address, str):
+		if os.path.exists(address):
+			os.remove(address)
+		server = await asyncio.start_unix_server(gateway.serve_client, path=address)
+	else:
+		server = await asyncio.start_server(gateway.serve_client, address[0], address[1])
+	print(f"Robot gateway listening on {address}, ready in {time.perf_counter() - start:.2f} s")
+	async with server:
+		await server.serve_forever()
+
+
+if __name__ == "__main__":
+	parser = argparse.ArgumentParser(description="Local gateway that shares the control box connection between processes")
+	parser.add_argument("--host", default=GATEWAY_ADDRESS[0])
+	parser.add_argument("--port", type=int, default=GATEWAY_ADDRESS[1])
+	parser.add_argument("--unix", default=None, help="serve on this Unix socket path instead of TCP")
+	args = parser.parse_args()
+	asyncio.run(run_gateway(args.unix or (args.host, args.port)))
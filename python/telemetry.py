@@ -0,0 +1,116 @@
+import time
+from threading import Lock
+import numpy as np
+
+# Samples kept per stream, about a minute of socket.io events
+DEFAULT_CAPACITY = 4096
+
+
+class RingBuffer:
+	"""
+	Fixed-size buffer of timestamped samples with `width` values each, stored in
+	preallocated NumPy arrays. append() is O(1); the queries return copies ordered
+	oldest to newest and are vectorized over the stored samples.
+	Timestamps are time.monotonic() seconds unless the caller passes its own.
+	"""
+	def __init__(self, width, capacity=DEFAULT_CAPACITY):
+		self.width = width
+		self.capacity = capacity
+		self._times = np.zeros(capacity)
+		self._values = np.zeros((capacity, width))
+		self._next = 0
+		self._count = 0
+		self._lock = Lock()
+
+	def __len__(self):
+		return self._count
+
+	def append(self, values, t=None):
+		with self._lock:
+			self._times[self._next] = time.monotonic() if t is None else t
+			self._values[self._next] = values
+			self._next = (self._next + 1) % self.capacity
+			self._count = min(self._count + 1, self.capacity)
+
+	def clear(self):
+		with self._lock:
+			self._next = 0
+			self._count = 0
+
+	def _ordered(self):
+		# caller holds the lock
+		if self._count < self.capacity:
+			return self._times[:self._count].copy(), self._values[:self._count].copy()
+		order = np.r_[self._next:self.capacity, 0:self._next]
+		return self._times[order], self._values[order]
+
+	def latest(self, n=1):
+		"""Returns (times, values) of the newest n samples."""
+		with self._lock:
+			n = min(n, self._count)
+			index = (self._next - n + np.arange(n)) % self.capacity
+			return self._times[index], self._values[index]
+
+	def first(self):
+		"""Returns (time, values) of the oldest sample, or None if the buffer is empty."""
+		with self._lock:
+			if self._count == 0:
+				return None
+			index = (self._next - self._count) % self.capacity
+			return self._times[index], self._values[index].copy()
+
+	def last(self):
+		"""Returns (time, values) of the newest sample, or None if the buffer is empty."""
+		with self._lock:
+			if self._count == 0:
+				return None
+			index = (self._next - 1) % self.capacity
+			return self._times[index], self._values[index].copy()
+
+	def window(self, start, end=None):
+		"""Returns (times, values) of the samples with start <= t <= end."""
+		with self._lock:
+			times, values = self._ordered()
+		lower = np.searchsorted(times, start, side="left")
+		upper = len(times) if end is None else np.searchsorted(times, end, side="right")
+		return times[lower:upper], values[lower:upper]
+
+	def since(self, seconds):
+		"""Returns (times, values) of the samples from the last `seconds`."""
+		return self.window(time.monotonic() - seconds)
+
+	def interpolate(self, t):
+		"""
+		Linearly interpolated values at time t, clamped to the oldest/newest sample.
+		Returns None if the buffer is empty.
+		"""
+		with self._lock:
+			times, values = self._ordered()
+		if len(times) == 0:
+			return None
+		index = np.searchsorted(times, t)
+		if index == 0:
+			return values[0]
+		if index == len(times):
+			return values[-1]
+		t0, t1 = times[index - 1], times[index]
+		if t1 == t0:
+			return values[index]
+		fraction = (t - t0) / (t1 - t0)
+		return values[index - 1] + (values[index] - values[index - 1]) * fraction
+
+	def velocity(self, seconds=0.2):
+		"""
+		Average rate of change per second of every value over the last `seconds`,
+		from a least squares fit. Returns None with fewer than two samples.
+		"""
+		times, values = self.since(seconds)
+		if len(times) < 2 or times[-1] == times[0]:
+			return None
+		centered = times - times.mean()
+		return centered @ (values - values.mean(axis=0)) / (centered @ centered)
+
+	def age(self):
+		"""Seconds since the newest sample, None if the buffer is empty."""
+		last = self.last()
+		return None if last is None else time.monotonic() - last[0]
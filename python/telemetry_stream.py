@@ -0,0 +1,196 @@
+import asyncio
+import json
+import struct
+import time
+import numpy as np
+from scipy.spatial.transform import Rotation as R
+from event_hub import EventHub, Message
+
+# Frame rates clients may ask for (Hz), other values are clamped
+MIN_RATE = 1
+MAX_RATE = 60
+# Values that need an RPC are polled at most this often, once for all streams (Hz)
+TORQUE_RATE = 10.0
+MODE_RATE = 1.0
+# Delta frames are relative to a full frame sent this often (s)
+KEYFRAME_INTERVAL = 1.0
+# Frames waiting per client; frames coalesce, so this only bounds keyframe + delta pairs
+TELEMETRY_BACKLOG = 4
+ENCODINGS = ("binary", "delta")
+
+MODES = ["Teach", "SemiAutomatic", "Automatic"]
+# Little endian: seq (uint32), time (float64), pose X Y Z qx qy qz qw, euler x y z (deg),
+# joints A1..A6, torques 1..6 (float32 each), mode index (uint8, 255 unknown), collided (uint8)
+BINARY_FRAME = struct.Struct("<Id7f3f6f6fBB")
+BINARY_SCHEMA = {
+	"struct": BINARY_FRAME.format,
+	"fields": ["seq", "t", "pose", "euler", "joints", "torques", "mode", "collided"],
+	"sizes": [1, 1, 7, 3, 6, 6, 1, 1],
+	"modes": MODES,
+}
+VECTOR_FIELDS = ("pose", "euler", "joints", "torques")
+
+
+class TelemetrySource:
+	"""
+	Current robot state for the telemetry streams. Pose and joints come from Lara's socket.io
+	stream; torques and mode need RPCs, which are refreshed in the background at TORQUE_RATE and
+	MODE_RATE however many streams read them.
+	"""
+	def __init__(self, lara):
+		self.lara = lara
+		self.torques = np.zeros(6)
+		self.mode = None
+		self._torques_at = 0.0
+		self._mode_at = 0.0
+		self._refresh = None
+
+	def _poll_due(self):
+		if self._refresh is not None and not self._refresh.done():
+			return
+		now = time.monotonic()
+		due = []
+		if now - self._torques_at >= 1.0 / TORQUE_RATE:
+			self._torques_at = now
+			due.append(self._poll_torques())
+		if now - self._mode_at >= 1.0 / MODE_RATE:
+			self._mode_at = now
+			due.append(self._poll_mode())
+		if due:
+			self._refresh = asyncio.ensure_future(asyncio.gather(*due, return_exceptions=True))
+
+	async def _poll_torques(self):
+		torques = np.asarray(await self.lara.async_robot.get_current_joint_torques(), dtype=float).ravel()
+		if len(torques) == 6:
+			self.torques = torques
+
+	async def _poll_mode(self):
+		self.mode = await self.lara.async_robot.get_mode()
+
+	def sample(self):
+		self._poll_due()
+		pose = self.lara.pose_history.last()
+		joints = self.lara.joint_history.last()
+		pose_values = pose[1] if pose is not None else np.r_[np.zeros(6), 1.0]
+		return {
+			"t": time.time(),
+			"pose": pose_values,
+			"euler": R.from_quat(pose_values[3:]).as_euler("xyz", degrees=True),
+			"joints": joints[1] if joints is not None else np.zeros(6),
+			"torques": self.torques,
+			"mode": self.mode,
+			"collided": bool(self.lara.collided),
+		}
+
+
+def binary_frame(seq, sample):
+	mode = MODES.index(sample["mode"]) if sample["mode"] in MODES else 255
+	return BINARY_FRAME.pack(seq, sample["t"], *sample["pose"], *sample["euler"], *sample["joints"], *sample["torques"], mode, sample["collided"])
+
+
+def json_values(sample):
+	values = {field: [round(float(v), 6) for v in sample[field]] for field in VECTOR_FIELDS}
+	values["mode"] = sample["mode"]
+	values["collided"] = sample["collided"]
+	return values
+
+
+class TelemetryStream:
+	"""
+	Samples the source at one rate and fans the encoded frames out to every client of that rate,
+	so the sampling and encoding cost is paid once per rate, not per client. Binary frames are
+	self-contained; delta frames carry only the fields that changed since the last keyframe
+	(sent every KEYFRAME_INTERVAL and to new clients) with "k" naming that keyframe.
+	"""
+	def __init__(self, source, rate):
+		self.source = source
+		self.rate = rate
+		self.hubs = {encoding: EventHub(maxsize=TELEMETRY_BACKLOG) for encoding in ENCODINGS}
+		self.task = None
+		self.seq = 0
+		self.keyframe = None
+		self.keyframe_seq = 0
+		self.keyframe_at = 0.0
+		self.frames = 0
+
+	@property
+	def clients(self):
+		return sum(len(hub.subscribers) for hub in self.hubs.values())
+
+	def subscribe(self, encoding, send, name, on_drop=None):
+		hub = self.hubs[encoding]
+		subscriber = hub.subscribe(send, name=name, on_drop=on_drop)
+		if encoding == "delta" and self.keyframe is not None:
+			# new delta clients start from the current keyframe
+			subscriber.offer(self._keyframe_message())
+		if self.task is None or self.task.done():
+			self.task = asyncio.get_running_loop().create_task(self.run())
+		return subscriber
+
+	def unsubscribe(self, encoding, subscriber):
+		self.hubs[encoding].unsubscribe(subscriber)
+
+	def _keyframe_message(self):
+		return Message("key", json.dumps({"key": self.keyframe, "seq": self.keyframe_seq}), True)
+
+	def publish(self, sample):
+		self.seq += 1
+		binary = self.hubs["binary"]
+		if binary.subscribers:
+			binary.publish_encoded("frame", binary_frame(self.seq, sample), coalesce=True)
+		delta = self.hubs["delta"]
+		if not delta.subscribers:
+			self.keyframe = None
+			return
+		values = json_values(sample)
+		now = time.monotonic()
+		if self.keyframe is None or now - self.keyframe_at >= KEYFRAME_INTERVAL:
+			self.keyframe = {"t": sample["t"], **values}
+			self.keyframe_seq = self.seq
+			self.keyframe_at = now
+			delta.publish_encoded("key", json.dumps({"key": self.keyframe, "seq": self.seq}), coalesce=True)
+			return
+		changed = {field: value for field, value in values.items() if value != self.keyframe[field]}
+		delta.publish_encoded("delta", json.dumps({"delta": changed, "t": sample["t"], "seq": self.seq, "k": self.keyframe_seq}), coalesce=True)
+
+	async def run(self):
+		loop = asyncio.get_running_loop()
+		period = 1.0 / self.rate
+		deadline = loop.time()
+		while self.clients:
+			self.publish(self.source.sample())
+			self.frames += 1
+			deadline += period
+			now = loop.time()
+			if now > deadline:
+				# behind schedule: skip the missed frames rather than send them late
+				deadline = now
+			await asyncio.sleep(deadline - now)
+		self.task = None
+
+
+class TelemetryService:
+	"""Telemetry streams by rate, created on first use and stopped when their last client leaves."""
+	def __init__(self, lara):
+		self.source = TelemetrySource(lara)
+		self.streams = {}
+
+	@staticmethod
+	def clamp_rate(rate):
+		return int(min(MAX_RATE, max(MIN_RATE, round(rate))))
+
+	def stream(self, rate):
+		rate = self.clamp_rate(rate)
+		if rate not in self.streams:
+			self.streams[rate] = TelemetryStream(self.source, rate)
+		return self.streams[rate]
+
+	def stats(self):
+		return {
+			rate: {
+				"clients": stream.clients,
+				"frames": stream.frames,
+				"subscribers": {encoding: hub.stats()["subscribers"] for encoding, hub in stream.hubs.items()},
+			}
+			for rate, stream in self.streams.items()
+		}
@@ -0,0 +1,86 @@
+import os
+import sys
+
+# the services import their modules from the python directory, as when run from there
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import json
+import socket
+import threading
+import time
+
+import pytest
+
+
+class StubControlBox:
+	"""
+	A TCP server answering control box RPCs with replies[function] (a value or a callable taking
+	the request), [0.0]*6 by default. Requests are recorded in calls. A reply of DROP closes the
+	connection without answering, after the request was read; functions in close_after close it
+	shortly after answering, like a server dropping idle connections.
+	"""
+	DROP = object()
+
+	def __init__(self):
+		self.replies = {"initialize_attributes": {"version": "v4.11.0-alpha.74"}, "get_diagnostics": {}}
+		self.calls = []
+		self.close_after = set()
+		# like a server that parses only the first document of every recv
+		self.one_document_per_read = False
+		self.connections = 0
+		self.server = socket.socket()
+		self.server.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+		self.server.bind(("127.0.0.1", 0))
+		self.server.listen(50)
+		self.address = self.server.getsockname()
+		threading.Thread(target=self._accept, daemon=True).start()
+
+	def _accept(self):
+		while True:
+			try:
+				conn, _ = self.server.accept()
+			except OSError:
+				return
+			self.connections += 1
+			threading.Thread(target=self._serve, args=(conn,), daemon=True).start()
+
+	def _serve(self, conn):
+		decoder = json.JSONDecoder()
+		buffer = ""
+		with conn:
+			while True:
+				try:
+					data = conn.recv(65536)
+				except OSError:
+					return
+				if not data:
+					return
+				buffer += data.decode()
+				while buffer.strip():
+					try:
+						request, end = decoder.raw_decode(buffer.lstrip())
+					except ValueError:
+						break
+					buffer = "" if self.one_document_per_read else buffer.lstrip()[end:]
+					function = request["function"]
+					if function != "get_diagnostics":
+						self.calls.append(function)
+					reply = self.replies.get(function, [0.0] * 6)
+					if callable(reply):
+						reply = reply(request)
+					if reply is self.DROP:
+						return
+					conn.sendall(json.dumps({"error": None, "result": reply}).encode())
+					if function in self.close_after:
+						time.sleep(0.05)
+						return
+
+	def close(self):
+		self.server.close()
+
+
+@pytest.fixture
+def control_box():
+	box = StubControlBox()
+	yield box
+	box.close()
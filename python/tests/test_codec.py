@@ -0,0 +1,37 @@
+import math
+
+import pytest
+
+from neura.neurapy.codec import JsonCodec, OrjsonCodec, SocketioJson, get_codec, orjson
+from neura.neurapy.robot import ResponseReader
+
+# what the Python control box sends for a NaN value
+NAN_REPLY = b'{"error": null, "result": [NaN, 1.0]}'
+
+
+def test_default_codec_is_json():
+	assert isinstance(get_codec(), JsonCodec)
+	assert get_codec().name == "json"
+
+
+def test_reader_decodes_nan_reply():
+	reader = ResponseReader()
+	reader.feed(NAN_REPLY)
+	response, received, _ = reader.next_reply()
+	assert received == len(NAN_REPLY)
+	assert response["error"] is None
+	assert math.isnan(response["result"][0]) and response["result"][1] == 1.0
+
+
+@pytest.mark.skipif(orjson is None, reason="orjson is not installed")
+def test_orjson_falls_back_to_json():
+	codec = OrjsonCodec()
+	response = codec.decode(NAN_REPLY)
+	assert math.isnan(response["result"][0])
+	reader = ResponseReader(codec=codec)
+	reader.feed(NAN_REPLY)
+	assert math.isnan(reader.next_reply()[0]["result"][0])
+	# orjson only takes str keys
+	assert codec.decode(codec.encode({1: "a"})) == {"1": "a"}
+	assert math.isnan(SocketioJson.loads(NAN_REPLY)["result"][0])
+	assert SocketioJson.loads(SocketioJson.dumps({1: "a"})) == {"1": "a"}
@@ -0,0 +1,41 @@
+import math
+
+import pytest
+
+from neura.neurapy.robot import Robot
+from composite_motion import CompositeMotion, UnreachablePath, base_arc_via
+from space import Pose, Vector3, Quaternion
+
+JOINTS = [0.0] * 6
+START = Pose(Vector3(0.4, -0.4, 0.5), Quaternion(0, 0, 0, 1))
+TARGET = Pose(Vector3(0.4, 0.4, 0.3), Quaternion(0, 0, 0, 1))
+
+
+def arc_motion():
+	motion = CompositeMotion(START)
+	motion.arc_around_base(TARGET)
+	return motion
+
+
+def test_reachable_waypoints_are_checked_in_one_batch(control_box):
+	robot = Robot(address=control_box.address)
+	motion = arc_motion()
+	motion.min_via_z = 0.2
+	motion.validate(robot, JOINTS)
+	assert control_box.calls.count("ik_fk") == 2
+
+
+def test_waypoint_without_ik_solution_is_refused(control_box):
+	robot = Robot(address=control_box.address)
+	control_box.replies["ik_fk"] = lambda request: [math.nan] * 6 if request["kwargs"]["target_pose"][1] > 0.3 else [0.0] * 6
+	with pytest.raises(UnreachablePath, match="circular"):
+		arc_motion().validate(robot, JOINTS)
+
+
+def test_low_via_point_is_refused_before_asking_the_controller(control_box):
+	robot = Robot(address=control_box.address)
+	motion = arc_motion()
+	motion.min_via_z = base_arc_via(START, TARGET).position.z + 0.01
+	with pytest.raises(UnreachablePath, match="clearance"):
+		motion.validate(robot, JOINTS)
+	assert "ik_fk" not in control_box.calls
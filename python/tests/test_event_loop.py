@@ -0,0 +1,140 @@
+import asyncio
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+import lara as lara_module
+import robot_gateway
+from config_store import ConfigStore
+from loop_watchdog import LoopLagMonitor, LAG_WARNING
+from space import Pose, Vector3, Quaternion
+
+# every stub reply takes this long, so a blocking call on the event loop stalls it at least as long
+DELAY = 0.2
+# any stall the services would report fails the test, not only ones as long as a reply
+MAX_LAG = LAG_WARNING
+POSE = {"X": 0.3, "Y": 0.3, "Z": 0.5, "_X": 0.0, "_Y": 0.0, "_Z": 0.0, "_W": 1.0}
+
+
+class ControllerRest(BaseHTTPRequestHandler):
+	"""The controller's REST API as Lara uses it, answering after DELAY."""
+	def _reply(self, body):
+		time.sleep(DELAY)
+		data = json.dumps(body).encode()
+		self.send_response(200)
+		self.send_header("Content-Type", "application/json")
+		self.send_header("Content-Length", str(len(data)))
+		self.end_headers()
+		self.wfile.write(data)
+
+	def do_GET(self):
+		self._reply([POSE] if self.path == "/api/cartesianpose" else {})
+
+	def do_PATCH(self):
+		self.rfile.read(int(self.headers.get("Content-Length", 0)))
+		self._reply({})
+
+	def log_message(self, *args):
+		pass
+
+
+class AcknowledgingSocketio:
+	"""Connected socket.io client whose events the controller acknowledges after DELAY."""
+	connected = True
+
+	def __init__(self):
+		self.events = []
+
+	async def call(self, event, data, timeout=None):
+		self.events.append(event)
+		await asyncio.sleep(DELAY)
+		return True
+
+	async def emit(self, event, data=None):
+		self.events.append(event)
+
+	async def disconnect(self):
+		self.connected = False
+
+
+@pytest.fixture
+def controller_url(monkeypatch):
+	server = ThreadingHTTPServer(("127.0.0.1", 0), ControllerRest)
+	threading.Thread(target=server.serve_forever, daemon=True).start()
+	monkeypatch.setattr(lara_module, "CONTROLLER_URL", f"http://127.0.0.1:{server.server_address[1]}")
+	yield
+	server.shutdown()
+	server.server_close()
+
+
+@pytest.fixture
+def lara(control_box, controller_url, monkeypatch):
+	monkeypatch.setenv(robot_gateway.GATEWAY_ENV, "off")
+	monkeypatch.setattr(robot_gateway, "CONTROL_BOX_ADDRESS", control_box.address)
+	control_box.replies["ik_fk"] = lambda request: time.sleep(DELAY) or [0.3, 0.3, 0.6, 0.0, 0.0, 0.0]
+	control_box.replies["move_joint"] = lambda request: time.sleep(DELAY) or True
+	lara = lara_module.Lara()
+	lara.sio = AcknowledgingSocketio()
+	return lara
+
+
+async def measure(paths):
+	"""Runs the coroutines made by paths one after another and returns the loop monitor."""
+	monitor = LoopLagMonitor(interval=0.01)
+	monitor.start()
+	await asyncio.sleep(0.05)
+	for path in paths:
+		await path()
+	await asyncio.sleep(0.05)
+	monitor.stop()
+	return monitor
+
+
+def test_lara_io_does_not_block_the_loop(lara):
+	async def run():
+		try:
+			return await measure([
+				lambda: lara.controller_get("/api/cartesian"),
+				lara.fetch_cartesian_pose,
+				lara.reset_collision,
+				lambda: lara.apply_speed("linear", 0.01),
+				lambda: lara.set_translation_speed_mms(4),
+			])
+		finally:
+			await lara.close()
+	monitor = asyncio.run(run())
+	assert lara.sio.events == ["reset_collision", "linearveltrigger", "linearveltrigger"]
+	assert lara.pose.position.z == POSE["Z"]
+	assert monitor.samples > 10
+	assert monitor.max_lag < MAX_LAG, monitor.stats()
+
+
+def test_posture_and_offset_endpoints_do_not_block_the_loop(lara, control_box, tmp_path, monkeypatch):
+	pytest.importorskip("serial")
+	import main
+	monkeypatch.setattr(main, "lara", lara)
+	monkeypatch.setattr(main, "socket_pose", None)
+	monkeypatch.setattr(main, "tray", None)
+	monkeypatch.setattr(main, "config", ConfigStore(str(tmp_path / "config.json")))
+	offsets = ConfigStore(str(tmp_path / "offset_tag.json"), default=Pose(Vector3(0, 0, 0), Quaternion(0, 0, 0, 1)).to_dict())
+	lara.pose = Pose(Vector3(0.3, -0.3, 0.1), Quaternion(0, 0, 0, 1))
+
+	async def set_offset():
+		# what camera's /SetOffSet does once a tag is seen
+		offsets.replace(Pose(Vector3(0.01, 0, 0), Quaternion(0, 0, 0, 1)).to_dict(), note="SetOffSet")
+
+	async def run():
+		try:
+			return await measure([main.set_socket, main.set_tray, lambda: lara.transfer("tray"), set_offset])
+		finally:
+			await lara.close()
+	monitor = asyncio.run(run())
+	assert control_box.calls.count("ik_fk") == 2
+	assert lara.postures.validated("socket") and lara.postures.validated("tray")
+	assert control_box.calls.count("move_joint") == 1
+	assert monitor.max_lag < MAX_LAG, monitor.stats()
+	offsets.save()
+	assert Pose.from_json(ConfigStore(str(tmp_path / "offset_tag.json")).get()).position.x == 0.01
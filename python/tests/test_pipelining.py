@@ -0,0 +1,55 @@
+import asyncio
+
+from neura.neurapy import async_robot as async_robot_module
+from neura.neurapy import robot as robot_module
+from neura.neurapy.async_robot import AsyncRobot
+from neura.neurapy.robot import Robot
+
+
+def run_batch(robot):
+	robot.get_mode()
+	robot.get_mode()
+	with robot.batch() as batch:
+		switch = batch.set_mode("Automatic")
+		joints = batch.get_current_joint_angles()
+	return switch.result(), list(joints.result())
+
+
+def test_batches_are_pipelined_to_a_server_that_answers_them(control_box):
+	robot = Robot(address=control_box.address)
+	assert run_batch(robot) == ([0.0] * 6, [0.0] * 6)
+	assert robot._pool.pipelining is True
+
+
+def test_batches_are_sent_call_by_call_to_a_server_reading_one_document_at_a_time(control_box, monkeypatch):
+	monkeypatch.setattr(robot_module, "PIPELINE_PROBE_TIMEOUT", 0.2)
+	control_box.one_document_per_read = True
+	robot = Robot(address=control_box.address)
+	assert run_batch(robot) == ([0.0] * 6, [0.0] * 6)
+	assert robot._pool.pipelining is False
+	assert control_box.calls.count("set_mode") == 1
+
+
+def test_async_batches_are_sent_call_by_call_to_a_server_reading_one_document_at_a_time(control_box, monkeypatch):
+	monkeypatch.setattr(async_robot_module, "PIPELINE_PROBE_TIMEOUT", 0.2)
+	control_box.one_document_per_read = True
+	async def run():
+		robot = AsyncRobot(address=control_box.address)
+		await robot.get_mode()
+		await robot.get_mode()
+		async with robot.batch() as batch:
+			switch = batch.set_mode("Automatic")
+			joints = batch.get_current_joint_angles()
+		switch.result()
+		joints.result()
+		return robot._pool.pipelining
+	assert asyncio.run(run()) is False
+	assert control_box.calls.count("set_mode") == 1
+
+
+def test_pipelining_can_be_turned_off(control_box, monkeypatch):
+	monkeypatch.setattr(robot_module, "PIPELINING", "0")
+	robot = Robot(address=control_box.address)
+	run_batch(robot)
+	assert robot._pool.pipelining is False
+	assert control_box.calls.count("get_mode") == 2
@@ -0,0 +1,30 @@
+import asyncio
+import time
+
+from neura.neurapy.robot import Robot, ReadCache
+from neura.neurapy.async_robot import AsyncRobot
+
+TTL = {"get_current_joint_angles": 60.0}
+
+
+def test_cached_replies_are_copies(control_box):
+	robot = Robot(address=control_box.address, cache=ReadCache(TTL))
+	joints = robot.get_current_joint_angles()
+	joints[0] = 1.0
+	again = robot.get_current_joint_angles()
+	again[1] = 2.0
+	assert robot.get_current_joint_angles() == [0.0] * 6
+	assert control_box.calls.count("get_current_joint_angles") == 1
+
+
+def test_coalesced_async_reads_get_their_own_copy(control_box):
+	control_box.replies["get_current_joint_angles"] = lambda request: time.sleep(0.1) or [0.0] * 6
+	async def run():
+		robot = AsyncRobot(address=control_box.address, cache=ReadCache(TTL))
+		replies = await asyncio.gather(*[robot.get_current_joint_angles() for _ in range(3)])
+		replies[0][0] = 1.0
+		return replies, await robot.get_current_joint_angles()
+	replies, cached = asyncio.run(run())
+	assert replies[1] == replies[2] == cached == [0.0] * 6
+	assert len({id(reply) for reply in replies + [cached]}) == 4
+	assert control_box.calls.count("get_current_joint_angles") == 1
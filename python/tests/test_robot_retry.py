@@ -0,0 +1,141 @@
+import asyncio
+import socket
+import time
+
+import pytest
+
+from neura.neurapy import robot as robot_module
+from neura.neurapy.robot import Robot
+from neura.neurapy.async_robot import AsyncRobot
+from conftest import StubControlBox
+
+
+def drop_once(box, function, reply):
+	"""Reads the first call of function and closes the connection without answering."""
+	dropped = []
+	def answer(request):
+		if not dropped:
+			dropped.append(request)
+			return StubControlBox.DROP
+		return reply
+	box.replies[function] = answer
+
+
+def test_command_is_not_sent_twice_after_a_lost_reply(control_box):
+	robot = Robot(address=control_box.address)
+	robot.get_current_joint_angles()
+	drop_once(control_box, "move_joint", True)
+	with pytest.raises(ConnectionError):
+		robot.move_joint(speed=1)
+	assert control_box.calls.count("move_joint") == 1
+
+
+def test_read_is_sent_again_after_a_lost_reply(control_box):
+	robot = Robot(address=control_box.address)
+	robot.get_mode()
+	drop_once(control_box, "get_current_joint_angles", [0.0] * 6)
+	assert list(robot.get_current_joint_angles()) == [0.0] * 6
+	assert control_box.calls.count("get_current_joint_angles") == 2
+
+
+def test_async_command_is_not_sent_twice_after_a_lost_reply(control_box):
+	async def run():
+		robot = AsyncRobot(address=control_box.address)
+		await robot.get_current_joint_angles()
+		drop_once(control_box, "move_linear", True)
+		with pytest.raises(ConnectionError):
+			await robot.move_linear(speed=1)
+		await robot.get_current_joint_angles()
+		drop_once(control_box, "get_mode", "Teach")
+		assert await robot.get_mode() == "Teach"
+	asyncio.run(run())
+	assert control_box.calls.count("move_linear") == 1
+	assert control_box.calls.count("get_mode") == 2
+
+
+def test_batch_of_commands_is_not_sent_twice(control_box):
+	robot = Robot(address=control_box.address)
+	robot.get_mode()
+	robot.get_mode()
+	drop_once(control_box, "set_mode", True)
+	with robot.batch() as batch:
+		switch = batch.set_mode("Automatic")
+		joints = batch.get_current_joint_angles()
+	with pytest.raises(ConnectionError):
+		switch.result()
+	assert control_box.calls.count("set_mode") == 1
+
+
+def test_idle_socket_closed_by_the_server_is_not_used(control_box):
+	robot = Robot(address=control_box.address)
+	robot.get_mode()
+	control_box.close_after.add("get_mode")
+	robot.get_mode()
+	time.sleep(0.2)
+	robot.move_joint(speed=1)
+	assert control_box.calls.count("move_joint") == 1
+
+
+def close_after_every_reply(box):
+	box.close_after.update(("initialize_attributes", "get_diagnostics", "get_mode"))
+
+
+def call_get_mode(robot, box, closing):
+	"""
+	Calls get_mode once per entry of closing on a Robot or an AsyncRobot, the stub closing the
+	connection after replies where the entry is True. Pauses so the closes reach the client.
+	"""
+	def close_after(close):
+		box.close_after.clear()
+		if close:
+			close_after_every_reply(box)
+	if isinstance(robot, Robot):
+		for close in closing:
+			close_after(close)
+			robot.get_mode()
+			time.sleep(0.1)
+		return
+	async def run():
+		for close in closing:
+			close_after(close)
+			await robot.get_mode()
+			await asyncio.sleep(0.1)
+	asyncio.run(run())
+
+
+@pytest.mark.parametrize("robot_class", [Robot, AsyncRobot])
+def test_one_closed_socket_keeps_the_pool(control_box, robot_class):
+	robot = robot_class(address=control_box.address)
+	call_get_mode(robot, control_box, [False, False, True, False, False, False])
+	assert robot._pool.persistent
+	assert robot._pool.closes_in_a_row == 0
+
+
+@pytest.mark.parametrize("robot_class", [Robot, AsyncRobot])
+def test_server_closing_after_every_reply_gets_one_shot_connections(control_box, robot_class):
+	close_after_every_reply(control_box)
+	robot = robot_class(address=control_box.address)
+	call_get_mode(robot, control_box, [True] * 4)
+	assert not robot._pool.persistent
+	assert control_box.calls.count("get_mode") == 4
+
+
+def test_pooled_socket_times_out(control_box, monkeypatch):
+	monkeypatch.setattr(robot_module, "CALL_TIMEOUT", 0.2)
+	robot = Robot(address=control_box.address)
+	control_box.replies["move_joint"] = lambda request: time.sleep(1) or True
+	start = time.monotonic()
+	with pytest.raises(socket.timeout):
+		robot.move_joint(speed=1)
+	assert time.monotonic() - start < 1.0
+
+
+def test_failed_initialization_is_retried_on_the_next_read(control_box):
+	control_box.replies["initialize_attributes"] = StubControlBox.DROP
+	robot = Robot(address=control_box.address, background_init=True)
+	with pytest.raises(ConnectionError):
+		robot.wait_ready(5)
+	assert getattr(robot, "version", None) is None
+	assert not hasattr(robot, "version")
+	control_box.replies["initialize_attributes"] = {"version": "v4.11.0-alpha.74"}
+	assert robot.version == "v4.11.0-alpha.74"
@@ -0,0 +1,109 @@
+import asyncio
+import math
+import numpy as np
+
+# Setpoints per second of Lara.move before the streamer, 10 slider emits 0.1 s apart
+DEFAULT_RATE = 10.0
+# A move bounded only by distance stops after this long even if the distance was not reached
+MAX_DURATION = 30.0
+# Distance bounded moves ramp down to this fraction of the velocity, not zero, so they still arrive
+DISTANCE_FINAL_SCALE = 0.1
+
+
+def ramp_scale(elapsed, ramp, remaining=None, floor=0.0):
+	"""
+	Velocity scale in [0, 1]: a cosine ramp up over the first `ramp` seconds and, when the
+	time left is known, a matching ramp down over the last `ramp` seconds to `floor`. ramp=0 is a step.
+	"""
+	if ramp <= 0:
+		return 1.0
+	scale = 1.0
+	if elapsed < ramp:
+		scale = 0.5 - 0.5 * math.cos(math.pi * elapsed / ramp)
+	if remaining is not None and remaining < ramp:
+		down = 0.5 - 0.5 * math.cos(math.pi * max(remaining, 0.0) / ramp)
+		scale = min(scale, floor + (1.0 - floor) * down)
+	return scale
+
+
+class VelocityStreamer:
+	"""
+	Streams velocity setpoints (6 slider/jog values) through async send(values) at a fixed rate
+	and calls async stop() at the end.
+
+	Ticks are scheduled on absolute deadlines, so a late tick does not delay the following
+	ones; ticks more than one period late are skipped instead of sent in a burst. The profile
+	is evaluated at the measured time of each send, not the tick count. Moves end after
+	`duration` seconds or once progress() (distance travelled, e.g. from the pose stream)
+	reaches `distance`, whichever comes first. stream() returns the requested and achieved
+	rate with the scheduling lateness.
+	"""
+	def __init__(self, send, stop, rate=DEFAULT_RATE):
+		self.send = send
+		self.stop = stop
+		self.rate = rate
+		self.last_report = None
+
+	async def stream(self, velocity, duration=None, distance=None, progress=None, ramp=0.0, rate=None):
+		if duration is None and distance is None:
+			raise ValueError("A streamed move needs a duration or a distance")
+		if distance is not None and progress is None:
+			raise ValueError("A distance bounded move needs a progress callable")
+		rate = rate or self.rate
+		period = 1.0 / rate
+		velocity = np.asarray(velocity, dtype=float)
+		limit = duration if duration is not None else MAX_DURATION
+		loop = asyncio.get_running_loop()
+		start = loop.time()
+		tick = 0
+		sent = 0
+		skipped = 0
+		lateness = []
+		travelled = 0.0
+		reason = "duration"
+		floor = DISTANCE_FINAL_SCALE if distance is not None else 0.0
+		try:
+			while True:
+				now = loop.time()
+				elapsed = now - start
+				if elapsed >= limit:
+					break
+				remaining = limit - elapsed if duration is not None else None
+				if distance is not None:
+					travelled = progress() or 0.0
+					if travelled >= distance:
+						reason = "distance"
+						break
+					if ramp > 0 and sent > 1 and elapsed > 0:
+						# time left at the average speed so far, so the ramp down ends near the target
+						speed = travelled / elapsed
+						if speed > 0:
+							left = (distance - travelled) / speed
+							remaining = left if remaining is None else min(remaining, left)
+				lateness.append(now - (start + tick * period))
+				await self.send((velocity * ramp_scale(elapsed, ramp, remaining, floor)).tolist())
+				sent += 1
+				tick += 1
+				deadline = start + tick * period
+				now = loop.time()
+				if now > deadline + period:
+					missed = int((now - deadline) / period)
+					skipped += missed
+					tick += missed
+					deadline = start + tick * period
+				await asyncio.sleep(max(0.0, deadline - now))
+		finally:
+			await self.stop()
+		elapsed = loop.time() - start
+		self.last_report = {
+			"requested_rate": rate,
+			"achieved_rate": sent / elapsed if elapsed > 0 else None,
+			"setpoints": sent,
+			"skipped_ticks": skipped,
+			"mean_lateness": float(np.mean(lateness)) if lateness else 0.0,
+			"max_lateness": float(np.max(lateness)) if lateness else 0.0,
+			"duration": elapsed,
+			"distance": travelled if distance is not None else None,
+			"ended_by": reason,
+		}
+		return self.last_report